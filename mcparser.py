@@ -14,11 +14,21 @@ comics, figures, anomalies = parser.getFiguresAndComics()
 
 import re
 import os
+import sys
+import time
+import json
+import socket
+import httplib
 import urllib2
+import hashlib
+import cPickle
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from cStringIO import StringIO
 
 DATADIR = os.path.join(os.path.dirname(__file__), 'data')
 MCPFILESDIR = os.path.join(DATADIR, 'mcp')
+CACHEDIR = os.path.join(DATADIR, 'cache')
 
 class Anomalies(dict):
    """Extension of dict for storing and printing of anomalies in the mcp files"""
@@ -64,6 +74,80 @@ class Anomalies(dict):
          write('\n')
       return b.getvalue()
       
+class AnomalyLog(list):
+   """
+   Record anomalies as a list of Anomalies.add arguments.
+   Used when parsing in worker processes, the log is replayed into an Anomalies instance in figure order.
+   """
+
+   def add(self, *args):
+      self.append(args)
+
+   def replay(self, anomalies):
+      """Add all recorded anomalies to @anomalies"""
+      for args in self:
+         anomalies.add(*args)
+
+class Comic(object):
+   """
+   A unique comic and all appearances of figures in it.
+
+   * id           - Comic id.
+   * abbreviation - Abbreviated comic string, for example 'W2 1'.
+   * full_name    - Full comic name, for example 'WOLVERINE VOL. 2 1'.
+   * sortkey      - Natural order sort key, see MCPFilesParser.getComicSortKey.
+   * appendixes   - {appendix: {figid: [Appearance, ...]}}, where appendix is for example '' or '-FB'.
+   """
+   __slots__ = ('id', 'abbreviation', 'full_name', 'sortkey', 'appendixes')
+
+   def __init__(self, id, abbreviation, full_name, sortkey):
+      self.id = id
+      self.abbreviation = abbreviation
+      self.full_name = full_name
+      self.sortkey = sortkey
+      self.appendixes = dict()
+
+class Appearance(object):
+   """
+   An appearance of a figure in a comic.
+
+   * index    - Entry index in the figure's chronology list.
+   * current  - The Entry of the appearance.
+   * next     - The next Entry in the list, EMPTY_ENTRY after the last entry.
+   * previous - The previous Entry in the list, EMPTY_ENTRY before the first entry.
+   """
+   __slots__ = ('index', 'current', 'next', 'previous')
+
+   def __init__(self, index, current, next, previous):
+      self.index = index
+      self.current = current
+      self.next = next
+      self.previous = previous
+
+class Entry(object):
+   """
+   An entry in a figure's chronology list, shared by the appearances of all comics in the entry.
+
+   * rawstr - The cleaned entry, for example 'W2 1-BTS'.
+   * comics - The comics in the entry, tuple of ComicRef.
+   """
+   __slots__ = ('rawstr', 'comics')
+
+   def __init__(self, rawstr, comics):
+      self.rawstr = rawstr
+      self.comics = comics
+
+class ComicRef(object):
+   """A comic in an Entry, with comicstr and appendix as in Comic.abbreviation and Comic.appendixes"""
+   __slots__ = ('comicstr', 'appendix', 'comicid')
+
+   def __init__(self, comicstr, appendix, comicid):
+      self.comicstr = comicstr
+      self.appendix = appendix
+      self.comicid = comicid
+
+EMPTY_ENTRY = Entry('', ())
+
 class ParseError(Exception):
    """Raised by MCPFilesParser if something goes terribly wrong with the parsing"""
    pass
@@ -79,6 +163,9 @@ class MCPFilesParser:
    Download all mcp files:
    >> parser.updateMCPFiles()
 
+   Use another directory for the mcp files and the parse cache:
+   >> parser = MCPFilesParser(mcpfilesdir='/tmp/mcp', cachedir='/tmp/mcpcache')
+
    Extract figure chronology lists and comics in the mcp files: 
    >> comics, figures, anomalies = parser.getFiguresAndComics()
 
@@ -126,6 +213,12 @@ class MCPFilesParser:
    KEYFILE = 'key'
    FILEEND = '.php'
 
+   # Increase when the parsing or the parsed figure data structure is changed, invalidates the parse cache
+   PARSER_VERSION = 1
+
+   # Sidecar file in the mcp files directory with the ETag and Last-Modified headers of the downloaded files
+   DOWNLOADMANIFEST = 'downloads.json'
+
    # Regular expressions for parsing
                          
    re_find_figures = re.compile(r'\n(\n|<b>)(?P<figure>.*?)(\n<p>|\n</span></p>|\n<hr>|\n<br>)', re.DOTALL | re.IGNORECASE)
@@ -134,6 +227,9 @@ class MCPFilesParser:
    re_body = re.compile(r'key.gif(?P<body>.*?)key.gif', re.DOTALL)
    re_body_single_fig = re.compile(r'</table>(?P<body>.*?)key.gif', re.DOTALL)
    re_body_killraven = re.compile(r'</h1>(?P<body>.*?)<font', re.DOTALL)
+   # Any of the figure names in SINGLEFIGURES, and the position of each name in the list
+   re_single_figure = re.compile('|'.join([re.escape(n) for n,_ in SINGLEFIGURES]))
+   single_figure_order = dict([(n, i) for i, (n,_) in enumerate(SINGLEFIGURES)])
    
    re_tag = re.compile(r'<[^>]*?>')
    
@@ -142,71 +238,219 @@ class MCPFilesParser:
    
    figure_redirections = ["(~", "(See", "See", "(From","From", "Note", "Caution", "(may continue","may continue","between"]
    comic_appendixes = ["-FB", "-BTS", "-OP","-VO", "(", "pg", "Pg"]
+
+   # Patterns for _clean. The entities were replaced one by one in the order:
+   # &Ntilde; &quot; &lt; &infin; &amp; newline &hearts; &and; &gt;
+   # so "&amp;gt;" becomes ">" but "&amp;lt;" becomes "&lt;", and "&and;gt;" becomes ">".
+   # re_entity does the replacements before the newlines are removed, re_entity_joined the ones after.
+   html_entities = {"&Ntilde;": "",
+                    "&quot;": '"',
+                    "&lt;": "<",
+                    "&infin;": "INFINITY",
+                    "&amp;": "&",
+                    "&hearts;": "HEART", # TODO, unicode
+                    "&and;": "&",
+                    "&and;gt;": ">",
+                    "&gt;": ">"}
+   re_entity = re.compile(r'&(?:Ntilde|quot|lt|infin|amp);')
+   re_entity_joined = re.compile(r'&(?:hearts|and;gt|and|gt);')
+   re_spaces = re.compile(' +')
+   # The first redirection in the string, the redirections never overlap so this is where the
+   # redirections in figure_redirections would cut the string if searched for one by one
+   re_figure_redirect = re.compile('|'.join([re.escape(r) for r in figure_redirections]))
+   # Patterns for _classifyComic. The appendix starts at the first of comic_appendixes in the string.
+   re_appendix = re.compile('|'.join([re.escape(a) for a in comic_appendixes]))
+   re_annual = re.compile(r'@[2-9]?$')
+   re_unexpected_char = re.compile(r"[^A-Z@ \-\:&/\?\.\d/'\-\.]")
    
    re_abbr_nr = re.compile(r"^(?P<abbr>.+?) (?P<nr>['-]?[\.\d]*[A-B]?/?\d+[A-B]?(?=$))")
+   re_nr_fraction = re.compile(r"^(?P<num>\d+)/(?P<den>\d+)$")
+   re_nr_decimal = re.compile(r"^(?P<value>-?\d*\.?\d+)(?P<suffix>[A-B]?)$")
+   re_nr_year = re.compile(r"^'(?P<year>\d+)$")
+
+   def __init__(self, mcpfilesdir=MCPFILESDIR, cachedir=CACHEDIR):
+      self.mcpfilesdir = mcpfilesdir
+      self.cachedir = cachedir
+      self._setAbbreviations(dict())
+      # The parsed single figure pages, figure name mapped to (chronolist, link, file)
+      self._single_figures = dict()
 
-   def getFiguresAndComics(self, verbose=False):
+   def getFiguresAndComics(self, verbose=False, jobs=1, cache=False, registry=None):
       """
       Extract figures and comics from the mcp files
       
+      The files are parsed and the chronology lists cleaned file by file, in @jobs worker processes if @jobs > 1.
+      Figure ids and comic ids are then assigned in file order, so the result does not depend on @jobs.
+      If @registry (mcpids.IdRegistry) is given, figures and comics from earlier builds keep their ids from the
+      registry, and new ones are added to it.
+
+      If @cache is True, the parse result of each file is stored in the cache directory and reused as long as the file,
+      the mcp key, the single figure pages and PARSER_VERSION are unchanged.
+
       Return:
       * figures   - List of all figures. See _getFigures for data structure documentation.
       * comics    - Dict with all comics. See _cleanAndCollectComics for data structure documentation.
       * anomalies - All syntax anomlies found, instance of the class Anomalies.
       """
-      self.abbrs = self._getAbbreviations()
-      figures = self._getFigures(verbose)
+      figures = []
       comics = dict()
       anomalies = Anomalies()
-      
-      for i,f in enumerate(figures):
-         if not 'name' in f:
-            fig_name = self._clean(f['chronolist'][:f['chronolist'].lower().find('<br>')], False)
-            f['chronolist'] = f['chronolist'][f['chronolist'].lower().find('<br>') + 4:]
-            #if verbose:
-            #   print 'CAC: ' + fig_name + '|'
-            f['name'] = fig_name
-         m = re.search(r'\[(?P<race>[^\]]+)\]', f['name'])
-         if not m:
-            f['race'] = ''
-         else:
-            f['race'] = m.group('race')
-         fig_search = self._cleanAndCollectComics(i, f['chronolist'], comics, anomalies, f['name'], f['file'], verbose)
-         f['id'] = i
-         f['search'] = fig_search
+      for f, appearances in self.iterFiguresAndComics(comics, anomalies, verbose, jobs, cache, registry):
+         del f['entries']
+         figures.append(f)
+         self._addAppearances(f['id'], appearances)
       return figures, comics, anomalies
+
+   def iterFiguresAndComics(self, comics, anomalies, verbose=False, jobs=1, cache=False, registry=None):
+      """
+      Extract figures and comics from the mcp files one figure at a time, see getFiguresAndComics for the parameters.
+
+      Generate (figure, appearances) for each figure in file order, where appearances is the list of the figure's
+      (Comic, appendix, Appearance), see _collectAppearances. The 'entries' of the figure are replaced by the list
+      of the Entry of each entry, shared with the appearances.
+      New comics are added to the dict @comics, without appearances, and the anomalies to @anomalies (Anomalies).
+
+      Only the figures of the mcp file being processed are kept, a figure is released when the next one is generated.
+      """
+      self._setAbbreviations(self._getAbbreviations())
+      i = 0
+      for file_figures in self._iterFileFigures(verbose, jobs, cache):
+         for n in range(len(file_figures)):
+            f = file_figures[n]
+            file_figures[n] = None
+            f.pop('anomalies').replay(anomalies)
+            f['id'] = registry.getFigureId(f['link']) if registry else i
+            entries = []
+            appearances = self._collectAppearances(f['id'], f['entries'], comics, registry, entries)
+            f['entries'] = entries
+            yield f, appearances
+            i += 1
       
-   def updateMCPFiles(self, verbose=True):
-      """Download all mcp files and store in MCPFILESDIR"""
-      if(not os.path.isdir(MCPFILESDIR)):
-         os.mkdir(MCPFILESDIR)
+   def updateMCPFiles(self, verbose=True, connections=4, retries=3, backoff=1.0, baseurl=None):
+      """
+      Download all mcp files and store in the mcp files directory
+
+      * baseurl     - Url of the directory with the mcp files, default is BASEURL.
+      * connections - Max number of concurrent downloads.
+      * retries     - Number of retries of a failed download. The wait before a retry starts at @backoff seconds
+                      and is doubled for each retry. Client errors (4xx) are not retried.
+
+      The ETag and Last-Modified headers of each file are stored in DOWNLOADMANIFEST and sent with the next
+      download of the file, files that have not changed on the server are not downloaded again, and DOWNLOADMANIFEST
+      is only written when a validator has changed. The files are written atomically, a failed download never leaves a half written file.
+      """
+      if not os.path.isdir(self.mcpfilesdir):
+         os.makedirs(self.mcpfilesdir)
       files_to_download = self.MCPFILES[:]
       files_to_download.append(self.KEYFILE)
       files_to_download.extend([u for _,u in self.SINGLEFIGURES])
       files_to_download.extend([u for u,_ in self.MCPDIMENSIONS])
-      for f in files_to_download:
-         f += self.FILEEND
+      files_to_download = [f + self.FILEEND for f in files_to_download]
+
+      manifest = self._readDownloadManifest()
+      pool = ThreadPool(connections)
+      try:
+         results = pool.map(lambda f: self._downloadFile(baseurl or self.BASEURL, f, manifest.get(f), retries, backoff),
+                            files_to_download)
+      finally:
+         pool.close()
+         pool.join()
+
+      failed = []
+      changed = False
+      for f, (status, validators, log) in zip(files_to_download, results):
          if verbose:
-            print 'Downloading %s' % f
-         urlin = urllib2.urlopen(self.BASEURL + f)
-         data = urlin.read()
-         urlin.close()
-         with open(os.path.join(MCPFILESDIR, f), 'w') as fileout:
-            fileout.write(data)
+            sys.stdout.write(log)
+            print '%s %s' % (status, f)
+         if validators is None:
+            failed.append(f)
+         elif manifest.get(f) != validators:
+            manifest[f] = validators
+            changed = True
+      if changed:
+         self._writeDownloadManifest(manifest)
+      if failed:
+         raise IOError('Failed to download %s' % ', '.join(failed))
+
+   def _downloadFile(self, baseurl, f, validators, retries, backoff):
+      """
+      Download the mcp file @f from @baseurl, with a conditional request if @validators (ETag and Last-Modified from the
+      last download) are given and the file exists.
+
+      Return status, validators for the next download (None if the download failed), log
+      """
+      path = os.path.join(self.mcpfilesdir, f)
+      request = urllib2.Request(baseurl + f)
+      if validators and os.path.isfile(path):
+         if validators.get('etag'):
+            request.add_header('If-None-Match', validators['etag'])
+         if validators.get('last_modified'):
+            request.add_header('If-Modified-Since', validators['last_modified'])
+
+      log = StringIO()
+      for attempt in range(retries + 1):
+         try:
+            urlin = urllib2.urlopen(request, timeout=60)
+            try:
+               data = urlin.read()
+               headers = urlin.info()
+            finally:
+               urlin.close()
+            length = headers.get('Content-Length')
+            if length and length.isdigit() and int(length) != len(data):
+               # urllib2 returns the part of the body that was read before the connection was closed
+               raise httplib.IncompleteRead(data, int(length) - len(data))
+         except urllib2.HTTPError as e:
+            if e.code == 304:
+               return 'Not modified', validators, log.getvalue()
+            error = e
+            if e.code < 500:
+               break
+         except (urllib2.URLError, httplib.HTTPException, socket.error) as e:
+            error = e
+         else:
+            if f == 'alternate' + self.FILEEND:
+               data = self._cleanAlternateUniverses(data)
+            self._writeFileAtomic(path, data)
+            return 'Downloaded', {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}, log.getvalue()
+         if attempt < retries:
+            log.write('Download of %s failed (%s), retry in %.1f s\n' % (f, error, backoff * 2**attempt))
+            time.sleep(backoff * 2**attempt)
+      return 'Failed (%s)' % error, None, log.getvalue()
+
+   def _cleanAlternateUniverses(self, data):
       """Remove extra expand-collapse coding from alternate universes file"""
-      altuniverse="c:/python27/data/mcp/alternate.php"
-      altuni = open(altuniverse,"r")
-      lines = altuni.readlines()
-      altuni.close()
-      altuni = open(altuniverse,"w")
-      for line in lines:
-         if line!="<p><hr></p>"+"\n" and line!="</span></div>"+"\n" and line[:8]!="<div id=":
-    	    altuni.write(line)
-      altuni.close()
+      lines = []
+      for line in data.splitlines(True):
+         stripped = line.rstrip('\r\n')
+         if stripped != "<p><hr></p>" and stripped != "</span></div>" and stripped[:8] != "<div id=":
+            lines.append(line)
+      return ''.join(lines)
+
+   def _writeFileAtomic(self, path, data):
+      """Write @data to a temporary file and move it to @path"""
+      tmp = path + '.tmp'
+      with open(tmp, 'wb') as fileout:
+         fileout.write(data)
+      if os.name == 'nt' and os.path.exists(path):
+         # os.rename does not replace files on windows
+         os.remove(path)
+      os.rename(tmp, path)
+
+   def _readDownloadManifest(self):
+      """Return the download manifest: {file name: {'etag': ..., 'last_modified': ...}, ...}"""
+      path = os.path.join(self.mcpfilesdir, self.DOWNLOADMANIFEST)
+      if not os.path.isfile(path):
+         return dict()
+      with open(path, 'r') as inp:
+         return json.load(inp)
+
+   def _writeDownloadManifest(self, manifest):
+      self._writeFileAtomic(os.path.join(self.mcpfilesdir, self.DOWNLOADMANIFEST), json.dumps(manifest, indent=1, sort_keys=True, separators=(',', ': ')))
          
    def _readFile(self, f):
       """Read mcp file with name @f from disk and return the contents"""
-      with open(os.path.join(MCPFILESDIR, f + self.FILEEND), 'r') as inp:
+      with open(os.path.join(self.mcpfilesdir, f + self.FILEEND), 'r') as inp:
          return inp.read()
       
    def _getAbbreviations(self):
@@ -259,22 +503,32 @@ class MCPFilesParser:
       Check if the string @name_line matches any figures that have their chronlogy list on their own page.
       
       Return the chronolist and the url to the page if a match is found, else return None, None
+      
+      Each page is read and parsed once, the first time its figure is found.
+      If @name_line has more than one of the names, the first one in SINGLEFIGURES is used.
       """
-      for n, f in self.SINGLEFIGURES:
-         if name_line.find(n) != -1:
-            if verbose:
-               print 'Parsing single figure list %r' % f
-            #thelink = self.BASEURL + f
-            thelink = self.BASEURL + f + self.FILEEND# Replaces line above, see if this adds php to filename
-            content = self._readFile(f)
-            m_body = self.re_body_single_fig.search(content)
-            if not m_body:
-               raise ParseError('No chronological list found in %s' % f)
-            body = m_body.group('body')
-            fig_list = self.re_find_figures.search(body).group('figure')
-            return fig_list, thelink, f
-            
-      return None,None,None
+      m = self.re_single_figure.search(name_line)
+      if not m:
+         return None,None,None
+      n = m.group()
+      # The pattern finds the leftmost name, only the names before it in the list can win over it
+      for other,_ in self.SINGLEFIGURES[:self.single_figure_order[n]]:
+         if other in name_line:
+            n = other
+            break
+      if not n in self._single_figures:
+         f = dict(self.SINGLEFIGURES)[n]
+         if verbose:
+            print 'Parsing single figure list %r' % f
+         thelink = self.BASEURL + f + self.FILEEND
+         content = self._readFile(f)
+         m_body = self.re_body_single_fig.search(content)
+         if not m_body:
+            raise ParseError('No chronological list found in %s' % f)
+         body = m_body.group('body')
+         fig_list = self.re_find_figures.search(body).group('figure')
+         self._single_figures[n] = (fig_list, thelink, f)
+      return self._single_figures[n]
          
    def _getFiguresListsOldSyntax(self, files, verbose=False):
       """
@@ -438,40 +692,200 @@ class MCPFilesParser:
          
       return figures
       
-   def _getFigures(self, verbose=False):
+   def _getFigures(self, verbose=False, jobs=1, cache=False):
       """
       Extract all figures and their chronlogical lists from the mcp files.
 
       Return list of figure dicts with the contents:
-      * chronolist - The raw html that contain figure name and chronological list.
+      * name       - The name of the figure.
+      * race       - For example "Skrull", or ''.
+      * search     - All variants of the figure name, see _cleanEntries.
+      * chronolist - The raw html that contain the chronological list.
       * dimension  - Name of the dimension the figure come from (standard, 2099, ultimate etc)
       * link       - The link to the figure, examples:
                      http://chronologyproject.com/a.php#ANGEL_III
                      http://chronologyproject.com/spidey.php
                      ...
+      * file       - The mcp file of the figure.
+      * entries    - The cleaned chronological list, see _cleanEntries.
+      * anomalies  - Anomalies found in the chronological list, instance of AnomalyLog.
+      """
+      figures = []
+      for file_figures in self._iterFileFigures(verbose, jobs, cache):
+         figures.extend(file_figures)
+      return figures
+
+   def _iterFileFigures(self, verbose=False, jobs=1, cache=False):
+      """
+      Generate the list of figures of each mcp file in file order, see _getFigures.
+      The files are parsed while the figures are consumed, in @jobs worker processes if @jobs > 1.
       """
       all_files = [(f, 'standard') for f in self.MCPFILES] + self.MCPDIMENSIONS
       # Files with the expand/collapse functinality
       new_syntax_files = [(f,n) for f,n in all_files if not f in self.OLD_SYNTAX_FILES]
       # Files without expand/collapse
       old_syntax_files = [(f,n) for f,n in all_files if f in self.OLD_SYNTAX_FILES]
-   
-      figures = self._getFiguresListsNewSyntax(new_syntax_files, verbose)
-      figures.extend(self._getFiguresListsOldSyntax(old_syntax_files, verbose))
+      files = new_syntax_files + old_syntax_files
+
+      hits = set()
+      if cache:
+         cache_keys = self._getCacheKeys(files)
+         for n,(f,dim) in enumerate(files):
+            if self._isCached(f, cache_keys[n]):
+               hits.add(n)
+            if verbose:
+               print 'Parse cache %s for %r' % ('hit' if n in hits else 'miss', f)
+      misses = [n for n in range(len(files)) if not n in hits]
+
+      pool = None
+      if jobs > 1 and len(misses) > 1:
+         pool = multiprocessing.Pool(min(jobs, len(misses)), _initWorker, (self.abbrs, self.mcpfilesdir))
+         parsed = pool.imap(_parseFileInWorker, [files[n] + (verbose,) for n in misses])
+      else:
+         parsed = (('', self._parseFile(files[n][0], files[n][1], verbose)) for n in misses)
+
+      try:
+         for n,(f,dim) in enumerate(files):
+            if n in hits:
+               file_figures = self._readCache(f, cache_keys[n])
+               if file_figures is None:
+                  # The cache file was broken
+                  file_figures = self._parseFile(f, dim, verbose)
+                  self._writeCache(f, cache_keys[n], file_figures)
+            else:
+               log, file_figures = parsed.next()
+               sys.stdout.write(log)
+               if cache:
+                  self._writeCache(f, cache_keys[n], file_figures)
+            yield file_figures
+      finally:
+         if pool:
+            pool.close()
+            pool.join()
+
+   def _getFileHash(self, f):
+      """Return the sha1 hex digest of the mcp file with name @f, or '' if the file does not exist"""
+      path = os.path.join(self.mcpfilesdir, f + self.FILEEND)
+      if not os.path.isfile(path):
+         return ''
+      with open(path, 'rb') as inp:
+         return hashlib.sha1(inp.read()).hexdigest()
+
+   def _getCacheKeys(self, files):
+      """
+      Return the parse cache key for each (file, dimension) in @files.
+      The parse result of a file also depend on the mcp key and on the single figure pages, they are part of all keys.
+      """
+      shared = [str(self.PARSER_VERSION), self._getFileHash(self.KEYFILE)]
+      shared.extend([self._getFileHash(f) for _,f in self.SINGLEFIGURES])
+      return [hashlib.sha1('|'.join(shared + [f, dim, self._getFileHash(f)])).hexdigest() for f,dim in files]
+
+   def _isCached(self, f, key):
+      """Return True if the parse result of mcp file @f is cached with @key"""
+      path = os.path.join(self.cachedir, f + '.pickle')
+      if not os.path.isfile(path):
+         return False
+      try:
+         with open(path, 'rb') as inp:
+            return cPickle.load(inp) == key
+      except Exception:
+         # Broken cache file, parse again
+         return False
+
+   def _readCache(self, f, key):
+      """Return the cached figures of mcp file @f if they were stored with @key, else None"""
+      path = os.path.join(self.cachedir, f + '.pickle')
+      if not os.path.isfile(path):
+         return None
+      try:
+         with open(path, 'rb') as inp:
+            if cPickle.load(inp) != key:
+               return None
+            return cPickle.load(inp)
+      except Exception:
+         # Broken cache file, parse again
+         return None
+
+   def _writeCache(self, f, key, figures):
+      """
+      Store the figures of mcp file @f in the parse cache.
+      The key is pickled before the figures, so _isCached does not need to load the figures.
+      """
+      if not os.path.isdir(self.cachedir):
+         os.makedirs(self.cachedir)
+      with open(os.path.join(self.cachedir, f + '.pickle'), 'wb') as out:
+         cPickle.dump(key, out, cPickle.HIGHEST_PROTOCOL)
+         cPickle.dump(figures, out, cPickle.HIGHEST_PROTOCOL)
+
+   def _parseFile(self, f, dim, verbose=False):
+      """
+      Extract the figures in the mcp file @f and clean their chronological lists.
+      A file is parsed independently of all other files.
+
+      Return list of figure dicts, see _getFigures.
+      """
+      if f in self.OLD_SYNTAX_FILES:
+         figures = self._getFiguresListsOldSyntax([(f, dim)], verbose)
+      else:
+         figures = self._getFiguresListsNewSyntax([(f, dim)], verbose)
+
+      for fig in figures:
+         if not 'name' in fig:
+            fig_name = self._clean(fig['chronolist'][:fig['chronolist'].lower().find('<br>')], False)
+            fig['chronolist'] = fig['chronolist'][fig['chronolist'].lower().find('<br>') + 4:]
+            fig['name'] = fig_name
+         m = re.search(r'\[(?P<race>[^\]]+)\]', fig['name'])
+         if not m:
+            fig['race'] = ''
+         else:
+            fig['race'] = m.group('race')
+         fig['anomalies'] = AnomalyLog()
+         fig['entries'], fig['search'] = self._cleanEntries(fig['chronolist'], fig['anomalies'], fig['name'], fig['file'])
       return figures
          
-   def _anomalyDetector(self, comicstr, abbr, nr, fig_name, fig_file, snippet, anomalies):
-      """
-      Check that the parser understand the syntax of the comic string and
-      that the extracted abbreviation exist in the mcp key.
-      """
-      abbr_chars = 'A-Z@ \-\:&/\?\.'
-      nr_chars = "\d/'\-\."
-      if re.search(r"[^%s%s]" % (abbr_chars,nr_chars), comicstr):
-         anomalies.add(abbr, fig_name, fig_file, snippet, comicstr, 'Unexpected character')
-         return
-      if not abbr in self.abbrs:
-         anomalies.add(abbr, fig_name, fig_file, snippet, comicstr, 'Unknown abbreviation')
+   def _setAbbreviations(self, abbrs):
+      """Set the mcp key, see _getAbbreviations"""
+      self.abbrs = abbrs
+      # _classifyComic results, they depend on the key
+      self._classified = dict()
+
+   def _classifyComic(self, comicstr):
+      """
+      Split a comic string from a chronology list into comic and appendix, translate it to the full
+      comic name, and check that the parser understand the syntax of the comic string and that the
+      abbreviation exist in the mcp key.
+
+      Return (comic, appendix, abbreviation, full name, anomaly reason or None), example:
+      'A2@ 1-FB' >> ('A2@ 1', '-FB', 'A2', 'AVENGERS VOL. 2 ANNUAL 1', None)
+
+      The result is memoized by @comicstr, the same comic string is found in many figures' lists.
+      """
+      result = self._classified.get(comicstr)
+      if result is not None:
+         return result
+
+      m = self.re_appendix.search(comicstr)
+      if m:
+         thecomic, theappendix = comicstr[:m.start()].strip(), comicstr[m.start():]
+      else:
+         thecomic, theappendix = comicstr, ''
+      if thecomic == 'CA152':
+         thecomic = 'CA 152' # Special fix for Scorpion II
+      abbr, nr = self._getAbbreviationAndNumber(thecomic)
+      m = self.re_annual.search(abbr)
+      if m:
+         abbr = abbr[:m.start()]
+      full_name = self._getFullComicName(abbr, nr, m is not None)
+
+      if self.re_unexpected_char.search(thecomic):
+         reason = 'Unexpected character'
+      elif not abbr in self.abbrs:
+         reason = 'Unknown abbreviation'
+      else:
+         reason = None
+
+      result = self._classified[comicstr] = (thecomic, theappendix, abbr, full_name, reason)
+      return result
          
    def _getFullComicName(self, abbr, nr, isAnnual):
       """
@@ -488,45 +902,35 @@ class MCPFilesParser:
             
    def _cleanAndCollectComics(self, fig_index, fig_list, comic_dict, anomalies, fig_name, fig_file, verbose=False):
       """
-      Collect comics from a figure's chronology list
+      Collect comics from a figure's chronology list, the same as _cleanEntries followed by _collectComics.
 
-      Store data in comic_dict which contains a rather complicated data structure for each unique comic.
+      Store a Comic record in comic_dict for each unique comic.
       All figures appearing in a comic are stored in this structure together with which comic the figures appear in before and after.
+      The Entry records are shared, the current entry of one appearance is the next or previous entry of others.
 
       Comic dict example for "W2 1"
       -----------------------------
 
-      {'w2 1': {'abbreviation': 'W2 1',
-                'appendixes': {'': {6536:  [{'current':  {'comics': [{'appendix': '', 'comicid': 18012, 'comicstr': 'W2 1'}],
-                                                          'rawstr': 'W2 1'},
-                                             'index':    26,
-                                             'next':     {'comics': [{'appendix': '', 'comicid': 18013, 'comicstr': 'W2 2'}],
-                                                          'rawstr': 'W2 2'},
-                                             'previous': {'comics': [{'appendix': '', 'comicid': 3978, 'comicstr': 'UX 206'}],
-                                                          'rawstr': 'UX 206'}}],
-                                    11516: [{'current':  {'comics': [{'appendix': '', 'comicid': 18012, 'comicstr': 'W2 1'}],
-                                                          'rawstr': 'W2 1'},
-                                             'index':    620,
-                                             'next':     {'comics': [{'appendix': '', 'comicid': 18013, 'comicstr': 'W2 2'}],
-                                                          'rawstr': 'W2 2'},
-                                             'previous': {'comics': [{'appendix': '', 'comicid': 18420, 'comicstr': 'M/CP 10'}],
-                                                          'rawstr': 'M/CP 10'}}]},
-                           '-BTS': {9734:  [{'current':  {'comics': [{'appendix': '-BTS', 'comicid': 18012, 'comicstr': 'W2 1'}],
-                                                          'rawstr': 'W2 1-BTS'},
-                                             'index':    145,
-                                             'next':     {'comics': [{'appendix': '', 'comicid': 18013, 'comicstr': 'W2 2'}],
-                                                          'rawstr': 'W2 2'},
-                                             'previous': {'comics': [{'appendix': '', 'comicid': 3978, 'comicstr': 'UX 206'}],
-                                                          'rawstr': 'UX 206'}}],
-                                    11624: [{'current':  {'comics': [{'appendix': '-BTS', 'comicid': 18012, 'comicstr': 'W2 1'}],
-                                                          'rawstr': 'W2 1-BTS'},
-                                             'index':    19,
-                                             'next':     {'comics': [{'appendix': '-FB', 'comicid': 12260, 'comicstr': 'W:DOOMBRINGER'}],
-                                                          'rawstr': 'W:DOOMBRINGER-FB'},
-                                             'previous': {'comics': [{'appendix': '', 'comicid': 18435, 'comicstr': 'KP&W 6'}],
-                                                          'rawstr': 'KP&W 6'}}]}},
-                'full_name': 'WOLVERINE VOL. 2 1',
-                'id': 18012}
+      {'W2 1': Comic(id=18012,
+                     abbreviation='W2 1',
+                     full_name='WOLVERINE VOL. 2 1',
+                     sortkey=('W2', 1, 1.0, '', '1'),
+                     appendixes={'': {6536:  [Appearance(index=26,
+                                                         current=Entry(rawstr='W2 1', comics=(ComicRef('W2 1', '', 18012),)),
+                                                         next=Entry(rawstr='W2 2', comics=(ComicRef('W2 2', '', 18013),)),
+                                                         previous=Entry(rawstr='UX 206', comics=(ComicRef('UX 206', '', 3978),)))],
+                                      11516: [Appearance(index=620,
+                                                         current=Entry(rawstr='W2 1', comics=(ComicRef('W2 1', '', 18012),)),
+                                                         next=Entry(rawstr='W2 2', comics=(ComicRef('W2 2', '', 18013),)),
+                                                         previous=Entry(rawstr='M/CP 10', comics=(ComicRef('M/CP 10', '', 18420),)))]},
+                                 '-BTS': {9734:  [Appearance(index=145,
+                                                             current=Entry(rawstr='W2 1-BTS', comics=(ComicRef('W2 1', '-BTS', 18012),)),
+                                                             next=Entry(rawstr='W2 2', comics=(ComicRef('W2 2', '', 18013),)),
+                                                             previous=Entry(rawstr='UX 206', comics=(ComicRef('UX 206', '', 3978),)))],
+                                          11624: [Appearance(index=19,
+                                                             current=Entry(rawstr='W2 1-BTS', comics=(ComicRef('W2 1', '-BTS', 18012),)),
+                                                             next=Entry(rawstr='W:DOOMBRINGER-FB', comics=(ComicRef('W:DOOMBRINGER', '-FB', 12260),)),
+                                                             previous=Entry(rawstr='KP&W 6', comics=(ComicRef('KP&W 6', '', 18435),)))]}})
       }
       
 
@@ -535,29 +939,8 @@ class MCPFilesParser:
 
       * fig_index  - Figure id.
       * fg_list   - The figure's raw chronology list as a string.
-      * comic_dict - Dictionary with all comics:
-                     { Comic string: { id:           Comic id,
-                                       abbreviation: Abbreviated comic string,
-                                       full_name:    full_comicstr,
-                                       appendixes: { appendix { figid: { index:    Entry index
-                                                                         next:     { rawstr: "The raw list entry in the figure chronology list",
-                                                                                     comics: [{comicstr: str, comicid: id, appendix: app}, ...]
-                                                                                    },
-                                                                         previous: { rawstr: "The raw list entry in the figure chronology list",
-                                                                                     comics: [{comicstr:str, comicid:id, appendix:app}, ...]
-                                                                                    },
-                                                                        current:  { rawstr: "The raw list entry in the figure chronology list",
-                                                                                    comics: [{comicstr:str, comicid:id, appendix:app}, ...]
-                                                                                   },
-                                                                       },
-                                                                ...
-                                                              },
-                                                     ...
-                                                   },
-                                       ...
-                                     },
-                       ...
-                     }
+      * comic_dict - Dictionary with all comics: {Comic string: Comic, ...}, see the Comic, Appearance,
+                     Entry and ComicRef records.
       * anomalies  - Dictionary with possible syntax bugs:
                      { comic_abbr: { comicstr: { figures: [figname, ...],
                                                  reason:  "reason"
@@ -576,66 +959,123 @@ class MCPFilesParser:
 
       """
       
-      def addComic(comicstr, full_name):
-         if not comicstr in comic_dict:
-            comic_dict[comicstr] = {'id': len(comic_dict), 'abbreviation': comicstr, 'full_name': full_name, 'appendixes': dict()}
-      
-      def addAppendix(comicstr, appendix, figid, previous, rawstr, entry_index, current):
-         if not appendix in comic_dict[comicstr]['appendixes']:
-            comic_dict[comicstr]['appendixes'][appendix] = dict()
-         if not figid in comic_dict[comicstr]['appendixes'][appendix]:
-            comic_dict[comicstr]['appendixes'][appendix][figid] = []
-         comic_dict[comicstr]['appendixes'][appendix][figid].append({'index': entry_index, 'next': dict(rawstr='', comics=[]), 'previous': previous, 'current': current})
-         
-      def setNext(comicstr, appendix, figid, next_comic, current_entry_index):
-         if comic_dict[comicstr]['appendixes'][appendix][figid][-1]['index'] == current_entry_index:
-            comic_dict[comicstr]['appendixes'][appendix][figid][-2]['next'] = next_comic
-         else:
-            comic_dict[comicstr]['appendixes'][appendix][figid][-1]['next'] = next_comic
+      entries, fig_search = self._cleanEntries(fig_list, anomalies, fig_name, fig_file)
+      self._collectComics(fig_index, entries, comic_dict)
+      return fig_search
+
+   def _cleanEntries(self, fig_list, anomalies, fig_name, fig_file):
+      """
+      Clean the entries of a figure's chronology list and check the comic syntax.
+      Only depend on the mcp key, so it can be done for all figures independently.
+
+      Parameters
+      ----------
+
+      * fig_list   - The figure's raw chronology list as a string.
+      * anomalies  - Anomalies or AnomalyLog, to add found anomalies to.
+      * fig_name   - The name of the figure.
+      * fig_file   - The mcp file of the figure.
+
+      Return
+      ------
 
+      * entries    - List with one (rawstr, comics) tuple per entry, where comics is a list of
+                     (comicstr, appendix, full_name) tuples. Entries without comics are included.
+      * fig_search - String with all variants of a figure name comma separated, example: "SCHEMER/RICHARD FISK, Rose".
+      """
       re_br = re.compile('<br>', re.I)
       fig_list = re_br.split(fig_list)
       
-      fig_search = fig_name[:] # The name including 'See' and 'From' redirections 
       extra_search = [] # See and From redirections
-         
-      previous = dict(rawstr='', comics=[])
+      entries = []
       for i in range(len(fig_list) - 1):
          rawstr = fig_list[i].strip()
          comics,rawstr,e = self._clean(rawstr)
          
-         current = dict(rawstr=rawstr, comics=[])
+         current = []
          if e:
             extra_search.append(e)
 
-         snippet = '<br>'.join(fig_list[max(0,i-1):i+2])
-         
          for c in comics:
             if c:
-               thecomic, theappendix = self._getComicAndAppendix(c)
-               if thecomic == 'CA152':
-                  thecomic = 'CA 152' # Special fix for Scorpion II
-               abbr, nr = self._getAbbreviationAndNumber(thecomic)
-               isAnnual = False
-               annualmatch = re.search('@[2-9]?$', abbr)
-               if annualmatch:
-                  abbr = abbr[:annualmatch.start()]
-                  isAnnual = True
-               full_name = self._getFullComicName(abbr, nr, isAnnual)
-               self._anomalyDetector(thecomic, abbr, nr, fig_name, fig_file, snippet, anomalies)
-               addComic(thecomic, full_name)
-               current['comics'].append(dict(comicstr=thecomic, appendix=theappendix, comicid=comic_dict[thecomic]['id']))
-               addAppendix(thecomic, theappendix, fig_index, previous, rawstr, i, current)
-               
-         if previous:
-            for prevcomic in previous['comics']:
-               setNext(prevcomic['comicstr'], prevcomic['appendix'], fig_index, current, i)
-               
-         previous = current
+               thecomic, theappendix, abbr, full_name, reason = self._classifyComic(c)
+               if reason:
+                  snippet = '<br>'.join(fig_list[max(0,i-1):i+2])
+                  anomalies.add(abbr, fig_name, fig_file, snippet, thecomic, reason)
+               current.append((thecomic, theappendix, full_name))
+         entries.append((rawstr, current))
                
       fig_search = ', '.join(extra_search)
       
-      return fig_search
+      return entries, fig_search
+
+   def _collectComics(self, fig_index, entries, comic_dict, registry=None):
+      """
+      Add the cleaned chronology list @entries of figure @fig_index (see _cleanEntries) to @comic_dict.
+      New comics get their id from @registry, or else the next free comic id, so the figures must be
+      collected in the same order every run.
+      See _cleanAndCollectComics for the comic_dict data structure.
+      """
+      self._addAppearances(fig_index, self._collectAppearances(fig_index, entries, comic_dict, registry))
+
+   def _addAppearances(self, fig_index, appearances):
+      """Add the appearances of figure @fig_index, see _collectAppearances, to the appendixes of the comics"""
+      for comic, appendix, appearance in appearances:
+         figs = comic.appendixes.get(appendix)
+         if figs is None:
+            figs = comic.appendixes[appendix] = dict()
+         l = figs.get(fig_index)
+         if l is None:
+            l = figs[fig_index] = []
+         l.append(appearance)
+
+   def _collectAppearances(self, fig_index, entries, comic_dict, registry=None, entry_list=None):
+      """
+      Return the appearances in the cleaned chronology list @entries of figure @fig_index (see _cleanEntries),
+      as a list of (Comic, appendix, Appearance) in entry order.
+      New comics are added to @comic_dict, without appearances. They get their id from @registry, or else the
+      next free comic id, so the figures must be collected in the same order every run.
+      If @entry_list is given, the Entry of every entry, also those without comics, is appended to it.
+
+      The next entry of an appearance is always in the same figure, so an appearance is complete when
+      the figure's list has been collected.
+      """
+      appearances = []
+      # The figure's appearances in each (comic, appendix)
+      figure_appearances = dict()
+      previous = EMPTY_ENTRY
+      for i, (rawstr, comics) in enumerate(entries):
+         refs = []
+         current = Entry(rawstr, refs)
+         for thecomic, theappendix, full_name in comics:
+            # The same strings are found in many entries and figures
+            thecomic = intern(thecomic)
+            theappendix = intern(theappendix)
+            comic = comic_dict.get(thecomic)
+            if comic is None:
+               comicid = registry.getComicId(thecomic) if registry else len(comic_dict)
+               comic = comic_dict[thecomic] = Comic(comicid, thecomic, full_name, self.getComicSortKey(thecomic))
+            refs.append(ComicRef(thecomic, theappendix, comic.id))
+            appearance = Appearance(i, current, EMPTY_ENTRY, previous)
+            appearances.append((comic, theappendix, appearance))
+            l = figure_appearances.get((thecomic, theappendix))
+            if l is None:
+               l = figure_appearances[(thecomic, theappendix)] = []
+            l.append(appearance)
+         current.comics = tuple(refs)
+         if entry_list is not None:
+            entry_list.append(current)
+         
+         for prevcomic in previous.comics:
+            l = figure_appearances[(prevcomic.comicstr, prevcomic.appendix)]
+            if l[-1].index == i:
+               # The comic is also in the current entry
+               l[-2].next = current
+            else:
+               l[-1].next = current
+               
+         previous = current
+      return appearances
       
    def _clean(self, rawstr, isComic=True):
       """
@@ -647,64 +1087,48 @@ class MCPFilesParser:
                   and some extra comic specific cleaning is done.
       
       Return clean string, figure redirect string
+
+      Called for every entry, so each step is a precompiled pattern or a plain string method, and the
+      entity replacements are only done for strings with a '&'.
       """
       
       # Remove html tags
-      cleanstr = self.re_tag.sub('',rawstr)
-      
-      replacements = {"&lt;":"<",
-                      "&gt;":">",
-                      "&amp;":"&",
-                      "&quot;":'"',
-                      "&and;":"&",
-                      "&Ntilde;":"",
-                      '\n':'',
-                      '&hearts;':'HEART', # TODO, unicode
-                      '&infin;': 'INFINITY'}
+      cleanstr = self.re_tag.sub('', rawstr) if '<' in rawstr else rawstr
       
       # Replace html entities etc
-      for torepl,repl in replacements.items():
-         cleanstr = cleanstr.replace(torepl,repl)
-      rawstr = re.sub(' +', ' ', cleanstr.strip())
+      if '&' in cleanstr:
+         cleanstr = self.re_entity.sub(self._replaceEntity, cleanstr)
+      cleanstr = cleanstr.replace('\n', '')
+      if '&' in cleanstr:
+         cleanstr = self.re_entity_joined.sub(self._replaceEntity, cleanstr)
+      rawstr = cleanstr.strip()
+      if '  ' in rawstr:
+         rawstr = self.re_spaces.sub(' ', rawstr)
       
       figure_redirect = ''
       if isComic:
-         cleanstr = self.re_cf.sub('',cleanstr)
-         extra_repl = {" | ":" ~ ", " & ":" ~ ", "=":" ~ "}
-         for torepl,repl in extra_repl.items():
-            cleanstr = cleanstr.replace(torepl,repl)
-            
-         cleanstr = self.re_to_remove.sub('',cleanstr)
-         for r in self.figure_redirections:
-            i = cleanstr.find(r)
-            if i != -1:
-               figure_redirect = cleanstr[i:] + figure_redirect
-               cleanstr = cleanstr[:i]
+         if '|' in cleanstr:
+            cleanstr = self.re_cf.sub('', cleanstr)
+         # In this order, a ' ~ ' from '=' can be part of a ' | '
+         cleanstr = cleanstr.replace(' & ', ' ~ ').replace('=', ' ~ ').replace(' | ', ' ~ ')
+         cleanstr = self.re_to_remove.sub('', cleanstr)
+         m = self.re_figure_redirect.search(cleanstr)
+         if m:
+            figure_redirect = cleanstr[m.start():]
+            cleanstr = cleanstr[:m.start()]
       
          cleanstr = cleanstr.strip()
-         cleanstr = re.sub(' +', ' ', cleanstr)
+         if '  ' in cleanstr:
+            cleanstr = self.re_spaces.sub(' ', cleanstr)
          comics = cleanstr.split(" ~ ")
          
          return comics, rawstr, figure_redirect
          
       return rawstr
+
+   def _replaceEntity(self, m):
+      return self.html_entities[m.group()]
       
-   def _getComicAndAppendix(self, comicstr):
-      """
-      Split comic and comic appendix (for example -FB and -BTS)
-      Example:
-      'A 256-FB' >> ('A 256', '-FB')
-      """
-      cands = []
-      for a in self.comic_appendixes:
-         i = comicstr.find(a)
-         if i != -1:
-            cands.append(i)
-      if cands:
-         i = min(cands)
-         return comicstr[:i].strip(), comicstr[i:]
-      return comicstr, ''
-  
    def _getAbbreviationAndNumber(self, comicstr):
       """
       Split comic into abbreviation and number.
@@ -719,3 +1143,48 @@ class MCPFilesParser:
       if not m:
          return comicstr,None
       return m.group('abbr'),m.group('nr')
+
+   def getComicSortKey(self, comicstr):
+      """
+      Return a key for sorting comics in natural order: by abbreviation, then by issue number.
+      For the same abbreviation:
+      * Comics without number first.
+      * Numbered issues by value: 'A -1', 'A 1/2', 'A 1', 'A 1.5', 'A 2', 'A 2A', 'A 10', 'A 12345'
+      * Year issues by year: "A '98", "A '01"
+      * Anything else, by string.
+      """
+      abbr, nr = self._getAbbreviationAndNumber(comicstr)
+      if nr is None:
+         return (abbr, 0, 0, '', '')
+      m = self.re_nr_decimal.match(nr)
+      if m:
+         return (abbr, 1, float(m.group('value')), m.group('suffix'), nr)
+      m = self.re_nr_fraction.match(nr)
+      if m and int(m.group('den')):
+         return (abbr, 1, float(m.group('num'))/int(m.group('den')), '', nr)
+      m = self.re_nr_year.match(nr)
+      if m:
+         year = int(m.group('year'))
+         if len(m.group('year')) == 2:
+            year += 1900 if year >= 39 else 2000
+         return (abbr, 2, year, '', nr)
+      return (abbr, 3, 0, '', nr)
+
+# Parser used by the worker processes in MCPFilesParser._getFigures
+_worker_parser = None
+
+def _initWorker(abbrs, mcpfilesdir):
+   global _worker_parser
+   _worker_parser = MCPFilesParser(mcpfilesdir)
+   _worker_parser._setAbbreviations(abbrs)
+
+def _parseFileInWorker(args):
+   """Parse one mcp file in a worker process. Return the verbose output and the figures of the file"""
+   f, dim, verbose = args
+   stdout = sys.stdout
+   sys.stdout = log = StringIO()
+   try:
+      figures = _worker_parser._parseFile(f, dim, verbose)
+   finally:
+      sys.stdout = stdout
+   return log.getvalue(), figures
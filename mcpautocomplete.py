@@ -0,0 +1,382 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Provide functions for building the data used by the comic auto completion on the search page.
+
+Two formats are supported:
+* getAutoCompletionDict - A map between prefixes and matching comics, dumped as json.
+                          getAutoCompletionShards splits the map in files that are loaded lazily.
+* getAutoCompletionTrie - A serialized trie of all comics, decoded by web/autocomplete/comictrie.js.
+
+Usage
+-----
+with open('comics.txt') as comics:
+    d = getAutoCompletionDict(comics)
+"""
+
+import re
+import json
+import time
+
+class _TrieNode(object):
+   """
+   A node in the comic prefix trie.
+
+   * count    - Number of comics starting with the prefix of the node.
+   * ends     - Number of comics that are exactly the prefix of the node.
+   * lines    - Indexes of the comics starting with the prefix, in input order.
+                Set to None as soon as count passes the limit, the node will never be part of the map.
+   * children - Dict with the next character mapped to the child node.
+   """
+   __slots__ = ('count', 'ends', 'lines', 'children')
+
+   def __init__(self):
+      self.count = 0
+      self.ends = 0
+      self.lines = []
+      self.children = {}
+
+def _buildTrie(lines, limit):
+   """Build a prefix trie of the strings in @lines, return the root node"""
+   root = _TrieNode()
+   for n, line in enumerate(lines):
+      node = root
+      for ch in line:
+         child = node.children.get(ch)
+         if child is None:
+            child = node.children[ch] = _TrieNode()
+         child.count += 1
+         if child.lines is not None:
+            if child.count > limit:
+               child.lines = None
+            else:
+               child.lines.append(n)
+         node = child
+      if node is not root:
+         node.ends += 1
+   return root
+
+def getAutoCompletionDict(comics, limit=44):
+   """
+   Create a map between a string and a list of matching comics:
+
+   {'A': [all comics starting with A],
+    'AA': [all comics starting with AA],
+    ...
+   }
+
+   If there are more than @limit comics starting with the key string it is excluded from the map,
+   so 'A' will probably never be included if you don't use an extremly large limit.
+
+   Usage
+   -----
+   with open('file_listing_all_comics.txt', limit=100) as comics:
+       d = getAutoCompletionDict(comics)
+
+   Compression
+   -----------
+   Some tricks are used to make the map smaller:
+   * Only include the missing part of the string in the matching list.
+     Example: "GUN RUNNER ": ["1","2","3","4","5","6"]
+   * If the key contain exactly the same list of matching comics as a longer key, redirect to the longer key.
+     Example: "GUN RUNNER": "GUN R"
+   * Do not include exact matches.
+     Example: "GUN RUNNER 1": [""] is not included in the map
+
+   Implementation
+   --------------
+   The comics are inserted in a prefix trie with the number of matching comics stored on each node,
+   and the map is then collected in one walk over the trie. Nodes with more than @limit matches only
+   keep their count, so the matching lists are never built for keys that are excluded from the map.
+   """
+   lines = [line.strip() for line in comics]
+   root = _buildTrie(lines, limit)
+
+   dlimit = dict()
+   path = []
+   # The size of each map entry on the current path (length of the matching list, or length of
+   # the redirect key) mapped to the shortest key length with that size.
+   first_depth = dict()
+
+   def walk(node):
+      depth = len(path)
+      size = None
+      if node.count > limit:
+         # Too many alternatives
+         pass
+      elif node.count == 1 and node.ends == 1:
+         # Do not include exact matches, example: "GUN RUNNER 1":[""] is excluded from the dict
+         pass
+      else:
+         key = ''.join(path)
+         i = first_depth.get(node.count)
+         if i is not None:
+            # If the matches list is the same, redirect, example: "GUN RUNNER":"GUN R"
+            dlimit[key] = key[:i]
+            size = i
+         else:
+            dlimit[key] = [lines[n][depth:] for n in node.lines]
+            size = node.count
+      added = size is not None and size not in first_depth
+      if added:
+         first_depth[size] = depth
+      for ch, child in node.children.iteritems():
+         path.append(ch)
+         walk(child)
+         path.pop()
+      if added:
+         del first_depth[size]
+
+   for ch, child in root.children.iteritems():
+      path.append(ch)
+      walk(child)
+      path.pop()
+
+   return dlimit
+
+def getAutoCompletionShards(acd, prefix_length=1):
+   """
+   Split the auto completion dict @acd (see getAutoCompletionDict) into shards by the leading
+   @prefix_length characters of the keys.
+
+   Return manifest, shards:
+   * manifest - {'prefix_length': @prefix_length,
+                 'shards': {prefix: shard file name, ...},
+                 'short':  {key: value, ...}}  All keys shorter than @prefix_length.
+   * shards   - {prefix: {key: value, ...}, ...}
+
+   A key can redirect to a key shorter than the shard prefix. The redirect chain is then copied into
+   the shard, so the matches for a key can always be found within the shard of the key.
+   """
+   manifest = {'prefix_length': prefix_length, 'shards': {}, 'short': {}}
+   shards = dict()
+   for k, v in acd.iteritems():
+      if len(k) < prefix_length:
+         manifest['short'][k] = v
+         continue
+      prefix = k[:prefix_length]
+      if not prefix in shards:
+         shards[prefix] = dict()
+         manifest['shards'][prefix] = getAutoCompletionShardFileName(prefix)
+      shard = shards[prefix]
+      shard[k] = v
+      while isinstance(v, basestring) and len(v) < prefix_length:
+         # Redirect out of the shard
+         k = v
+         v = acd[k]
+         shard[k] = v
+   return manifest, shards
+
+def getAutoCompletionShardFileName(prefix):
+   """Return the file name of the shard with the keys starting with @prefix, example: 'AB' >> 'comics_4142.json'"""
+   return 'comics_%s.json' % ''.join(['%02x' % ord(c) for c in prefix])
+
+# Characters used for the structure of the serialized trie. They are removed from all comic strings by the parser.
+TRIE_TERMINAL = '['
+TRIE_LEAF_END = ']'
+TRIE_OPEN = '{'
+TRIE_CLOSE = '}'
+_BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def _base36(n):
+   """Return the non negative int @n as a base 36 string"""
+   s = ''
+   while True:
+      n, r = divmod(n, 36)
+      s = _BASE36[r] + s
+      if not n:
+         return s
+
+def getAutoCompletionTrie(comics):
+   """
+   Serialize the comics to a string with a compact trie where shared prefixes are stored once.
+
+   The trie is written in pre-order, each edge as:
+
+      LABEL ['[' RANK] ('{' EDGES '}' | ']')
+
+   * LABEL - The characters of the edge, chains of nodes with one child are merged into one edge.
+   * RANK  - Present if a comic ends at the edge. The position of the comic in @comics, base 36.
+             Used to give the matches in the same order as in the auto completion dict.
+   * EDGES - The edges of the child nodes, or ']' if the node has no children.
+
+   Example: ['GUN RUNNER 1', 'GUN RUNNER 2'] >> 'GUN RUNNER {1[0]2[1]}'
+
+   The matching comics of a prefix is found with AutoCompletionTrie or with the javascript decoder
+   in web/autocomplete/comictrie.js.
+   """
+   root = dict()
+   for n, line in enumerate(comics):
+      line = line.strip()
+      if not line:
+         continue
+      for ch in (TRIE_TERMINAL, TRIE_LEAF_END, TRIE_OPEN, TRIE_CLOSE):
+         if ch in line:
+            raise ValueError('Comic %r contains the reserved trie character %r' % (line, ch))
+      node = root
+      for ch in line:
+         node = node.setdefault(ch, dict())
+      # The empty string can never be a character, use it for the rank
+      node.setdefault('', n)
+
+   out = []
+   def encode(node):
+      for ch in sorted(node):
+         if not ch:
+            continue
+         label = ch
+         child = node[ch]
+         while len(child) == 1 and not '' in child:
+            ch, child = child.items()[0]
+            label += ch
+         out.append(label)
+         if '' in child:
+            out.append(TRIE_TERMINAL + _base36(child['']))
+         if len(child) > ('' in child):
+            out.append(TRIE_OPEN)
+            encode(child)
+            out.append(TRIE_CLOSE)
+         else:
+            out.append(TRIE_LEAF_END)
+   encode(root)
+   return ''.join(out)
+
+class AutoCompletionTrie:
+   """
+   Answer prefix queries on a trie serialized by getAutoCompletionTrie.
+
+   Give the same matches as the auto completion dict built with the same @limit, see getAutoCompletionDict.
+   Mirror of the javascript decoder in web/autocomplete/comictrie.js.
+
+   Usage
+   -----
+   >> trie = AutoCompletionTrie(getAutoCompletionTrie(comics), limit=44)
+   >> trie.match('GUN RUNNER ')
+   ['GUN RUNNER 1', 'GUN RUNNER 2', ...]
+   """
+
+   # An edge head: label, optional rank and the character that ends the edge head ('{' or ']')
+   re_edge = re.compile(r'([^\[\]{}]+)(?:\[([0-9a-z]+))?([{\]])')
+   re_braces = re.compile(r'[{}]')
+
+   def __init__(self, data, limit=44):
+      self.data = data
+      self.limit = limit
+      self._close = None
+
+   def _getCloseIndex(self):
+      """Map the position of each '{' to the position of the matching '}'"""
+      close = dict()
+      stack = []
+      for m in self.re_braces.finditer(self.data):
+         if m.group() == TRIE_OPEN:
+            stack.append(m.start())
+         else:
+            close[stack.pop()] = m.start()
+      return close
+
+   def match(self, query):
+      """Return the list of comics starting with @query, or None if there are too many or no matches"""
+      if self._close is None:
+         self._close = self._getCloseIndex()
+      if not query:
+         return None
+      s = self.data
+      pos, end = 0, len(s)
+      qi = 0
+      while True:
+         # Find the edge starting with the next query character
+         while True:
+            if pos >= end:
+               return None
+            m = self.re_edge.match(s, pos)
+            edge_end = self._close[m.end() - 1] + 1 if m.group(3) == TRIE_OPEN else m.end()
+            if s[pos] == query[qi]:
+               break
+            pos = edge_end
+         label = m.group(1)
+         rest = query[qi:qi + len(label)]
+         if not label.startswith(rest):
+            return None
+         if qi + len(rest) == len(query):
+            break
+         qi += len(label)
+         if m.group(3) != TRIE_OPEN:
+            return None
+         # Step into the children of the edge
+         pos, end = m.end(), edge_end - 1
+
+      # Collect all comics in the sub trie of the edge
+      matches = []
+      stack = [query[:qi]]
+      i = pos
+      while i < edge_end:
+         if s[i] == TRIE_CLOSE:
+            stack.pop()
+            i += 1
+            continue
+         m = self.re_edge.match(s, i)
+         current = stack[-1] + m.group(1)
+         if m.group(2):
+            matches.append((int(m.group(2), 36), current))
+            if len(matches) > self.limit:
+               # Too many alternatives
+               return None
+         if m.group(3) == TRIE_OPEN:
+            stack.append(current)
+         i = m.end()
+      if len(matches) == 1 and matches[0][1] == query:
+         # Exact matches are not included
+         return None
+      matches.sort()
+      return [c for _,c in matches]
+
+def matchAutoCompletionDict(query, acd):
+   """
+   Return the list of comics starting with @query in the auto completion dict @acd, or None.
+   Mirror of matchfunc in web/searchthemcp.php.
+   """
+   l = acd.get(query)
+   if isinstance(l, basestring):
+      query = l
+      l = acd.get(query)
+   if l is None:
+      return None
+   return [query + c for c in l]
+
+def compareAutoCompletionFormats(acd, trie_data, limit=44):
+   """
+   Compare size, load time and lookup time of the json dict and the serialized trie.
+   Every key of the dict is looked up in both formats.
+
+   Return a dict with the measurements.
+   """
+   json_data = json.dumps(acd)
+   trie_js = json.dumps(trie_data)
+
+   t = time.time()
+   acd = json.loads(json_data)
+   json_load = time.time() - t
+
+   t = time.time()
+   trie = AutoCompletionTrie(json.loads(trie_js), limit)
+   trie._close = trie._getCloseIndex()
+   trie_load = time.time() - t
+
+   queries = acd.keys()
+   t = time.time()
+   for q in queries:
+      matchAutoCompletionDict(q, acd)
+   json_lookup = time.time() - t
+
+   t = time.time()
+   for q in queries:
+      trie.match(q)
+   trie_lookup = time.time() - t
+
+   return {'queries': len(queries),
+           'json_size': len(json_data),
+           'trie_size': len(trie_js),
+           'json_load': json_load,
+           'trie_load': trie_load,
+           'json_lookup': json_lookup,
+           'trie_lookup': trie_lookup}
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Time the parsing and the file generation on synthetic mcp files of increasing size, see mcpcorpus.py.
+
+For each scale a corpus of scale*figures figures is written to a scratch directory and these phases are timed:
+* parse        - MCPFilesParser.getFiguresAndComics, without the parse cache.
+* sort         - Sorting the comics by their sort key.
+* autocomplete - getAutoCompletionDict.
+* sql_*        - Each MCPDB.generateSqlFor* pass.
+* tsv_*        - Writing each table to its tab separated file, see MCPDB.generateTsvFor*.
+* comic_pages  - MCPDB.generateTsvForComicPages, from the comic and figure table files.
+* tsv_sql_*    - The sql of each table from its tab separated file, as searchthemcp.py generates it.
+
+The tsv, comic_pages and tsv_sql phases are the stages a build runs after the parsing. Compared with a result
+file from before they were timed, --compare shows them with - as the old time.
+
+The results are written as json to data/benchmarks/<date and time>.json with the git commit, so a later run can be
+compared with --compare. Each phase has its time in seconds, the scale also has the number of figures, comics and
+appearances and the peak memory of the process so far (not available on windows).
+
+Usage
+-----
+$ ./mcpbenchmark.py --scales 1,5,20
+$ ./mcpbenchmark.py --compare data/benchmarks/2026-10-01_120000.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import tempfile
+import argparse
+import subprocess
+
+from mcparser import MCPFilesParser, DATADIR
+from mcpdb import MCPDB, tsvRows
+from mcpcorpus import generateCorpus
+from mcpautocomplete import getAutoCompletionDict
+from mcpprofile import getPeakMemory
+
+BENCHMARKDIR = os.path.join(DATADIR, 'benchmarks')
+
+def _consume(statements):
+   """Generate all statements and return their total size"""
+   return sum(len(s) for s in statements)
+
+def getGitCommit():
+   """Return the commit of the working directory, None if it is not a git repository"""
+   try:
+      with open(os.devnull, 'w') as devnull:
+         return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                                        cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+   except (OSError, subprocess.CalledProcessError):
+      return None
+
+def benchmarkScale(mcpfilesdir, jobs=1):
+   """Run the phases on the mcp files in @mcpfilesdir, return a dict with the times and counts"""
+   times = dict()
+   db = MCPDB('mcp_figures', 'mcp_comics', 'mcp_comics_fullname', 'mcp_figures_trigram', 'mcp_comics_page',
+              'mcp_entries', 'mcp_entry_comics')
+
+   start = time.time()
+   figures, comics, anomalies = MCPFilesParser(mcpfilesdir=mcpfilesdir, cachedir=os.path.join(mcpfilesdir, 'cache')) \
+                                   .getFiguresAndComics(jobs=jobs, cache=False)
+   times['parse'] = time.time() - start
+
+   start = time.time()
+   comics_str = comics.keys()
+   comics_str.sort(key=lambda c: comics[c].sortkey)
+   times['sort'] = time.time() - start
+
+   start = time.time()
+   getAutoCompletionDict(['%s\n' % c for c in comics_str], 44)
+   times['autocomplete'] = time.time() - start
+
+   for name, generate, rows in [('sql_figures', db.generateSqlForFigures, figures),
+                                ('sql_figure_trigrams', db.generateSqlForFigureTrigrams, figures),
+                                ('sql_comics', db.generateSqlForComics, comics),
+                                ('sql_comics_fullname', db.generateSqlForComicsFullName, comics)]:
+      start = time.time()
+      _consume(generate(rows))
+      times[name] = time.time() - start
+
+   tsvdir = os.path.join(mcpfilesdir, 'tsv')
+   if not os.path.isdir(tsvdir):
+      os.mkdir(tsvdir)
+   tsv_files = dict()
+   for name, t, generate, rows in [('figures', 'mcp_figures', db.generateTsvForFigures, figures),
+                                   ('figure_trigrams', 'mcp_figures_trigram', db.generateTsvForFigureTrigrams, figures),
+                                   ('comics', 'mcp_comics', db.generateTsvForComics, comics),
+                                   ('comics_fullname', 'mcp_comics_fullname', db.generateTsvForComicsFullName, comics)]:
+      tsv_files[name] = (t, os.path.join(tsvdir, name + '.tsv'))
+      start = time.time()
+      with open(tsv_files[name][1], 'wb') as out:
+         out.writelines(generate(rows))
+      times['tsv_' + name] = time.time() - start
+
+   tsv_files['comic_pages'] = ('mcp_comics_page', os.path.join(tsvdir, 'comic_pages.tsv'))
+   start = time.time()
+   with open(tsv_files['comics'][1], 'rb') as comic_lines:
+      with open(tsv_files['figures'][1], 'rb') as figure_lines:
+         with open(tsv_files['comic_pages'][1], 'wb') as out:
+            out.writelines(db.generateTsvForComicPages(comics, figure_lines, comic_lines))
+   times['comic_pages'] = time.time() - start
+
+   for name, (t, path) in tsv_files.items():
+      start = time.time()
+      with open(path, 'rb') as rows:
+         _consume(db.generateSqlForTable(t, tsvRows(rows)))
+      times['tsv_sql_' + name] = time.time() - start
+
+   return {'figures': len(figures),
+           'comics': len(comics),
+           'appearances': sum(len(apps) for c in comics.values() for figs in c.appendixes.values() for apps in figs.values()),
+           'times': times,
+           'peak_memory_mb': getPeakMemory()}
+
+def runBenchmark(scales=(1, 5, 20), figures=2000, list_length=40, jobs=1, workdir=None, keep=False, verbose=False):
+   """
+   Benchmark corpora of @figures * scale figures for each of @scales, return the result dict that is saved as json.
+
+   * workdir - Directory of the corpora, a new temporary directory if not given.
+   * keep    - If True, the corpora are not deleted.
+   """
+   scratch = workdir or tempfile.mkdtemp(prefix='mcpbenchmark')
+   result = {'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+             'commit': getGitCommit(),
+             'python': sys.version.split()[0],
+             'figures': figures,
+             'list_length': list_length,
+             'jobs': jobs,
+             'scales': dict()}
+   try:
+      for scale in scales:
+         mcpfilesdir = os.path.join(scratch, 'x%d' % scale)
+         if verbose:
+            print 'Writing %d figures to %s' % (figures*scale, mcpfilesdir)
+         generateCorpus(mcpfilesdir, figures=figures*scale, list_length=list_length)
+         r = benchmarkScale(mcpfilesdir, jobs)
+         result['scales'][str(scale)] = r
+         if verbose:
+            print 'x%d: %s' % (scale, ', '.join(['%s %.2fs' % (p, r['times'][p]) for p in sorted(r['times'])]))
+   finally:
+      if not keep:
+         shutil.rmtree(scratch, ignore_errors=True)
+   return result
+
+def compareBenchmarks(old, new):
+   """Return the lines of a table with the times of @new relative to @old, per scale and phase"""
+   lines = ['%-6s %-28s %10s %10s %7s' % ('scale', 'phase', 'old (s)', 'new (s)', 'ratio')]
+   for scale in sorted(new['scales'], key=int):
+      if not scale in old['scales']:
+         continue
+      old_times, new_times = old['scales'][scale]['times'], new['scales'][scale]['times']
+      for phase in sorted(new_times):
+         if phase in old_times:
+            ratio = new_times[phase] / old_times[phase] if old_times[phase] else float('inf')
+            lines.append('%-6s %-28s %10.3f %10.3f %7.2f' % ('x' + scale, phase, old_times[phase], new_times[phase], ratio))
+         else:
+            # A phase that was not timed in the old run, for example a new stage of the build
+            lines.append('%-6s %-28s %10s %10.3f %7s' % ('x' + scale, phase, '-', new_times[phase], '-'))
+   return lines
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Time the parsing and the file generation on synthetic mcp files.')
+   parser.add_argument('--scales', default='1,5,20', help="Comma separated corpus sizes, as multiples of --figures.")
+   parser.add_argument('--figures', type=int, default=2000, help="Number of figures in the corpus of scale 1.")
+   parser.add_argument('--listlength', type=int, default=40, help="Mean number of entries in a chronology list.")
+   parser.add_argument('--jobs', type=int, default=1, help="Number of processes used for parsing the mcp files.")
+   parser.add_argument('--workdir', default=None, help="Directory of the corpora, default is a temporary directory.")
+   parser.add_argument('--keep', action='store_true', help="If provided, do not delete the corpora.")
+   parser.add_argument('--output', default=None, help="Result file, default is data/benchmarks/<date and time>.json.")
+   parser.add_argument('--compare', default=None, help="Result file of an earlier run to compare with.")
+   args = parser.parse_args()
+
+   result = runBenchmark([int(s) for s in args.scales.split(',')], figures=args.figures, list_length=args.listlength,
+                         jobs=args.jobs, workdir=args.workdir, keep=args.keep, verbose=True)
+   output = args.output
+   if output is None:
+      if not os.path.isdir(BENCHMARKDIR):
+         os.makedirs(BENCHMARKDIR)
+      output = os.path.join(BENCHMARKDIR, datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S') + '.json')
+   with open(output, 'w') as out:
+      json.dump(result, out, indent=1, sort_keys=True)
+   print 'Results written to %s' % output
+   if args.compare:
+      with open(args.compare, 'r') as inp:
+         print '\n'.join(compareBenchmarks(json.load(inp), result))
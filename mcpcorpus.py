@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Provide the function generateCorpus that writes a synthetic set of mcp files, for testing and benchmarking the
+parser and the file generation without the files from www.chronologyproject.com.
+
+The files have the same structure as the real ones:
+* key.php               - The comic abbreviations and titles.
+* a.php ... z.php and
+  the dimension files   - The figures with the expand/collapse syntax, see MCPFilesParser._getFiguresListsNewSyntax.
+* capa.php, hulk.php... - The single figure pages, each found as the first figure of some of the other files.
+
+The entries are comics with numbers, annuals, appendixes, several comics joined with '&amp;', redirections
+and some broken comic strings that are reported as anomalies. The same parameters always give the same files.
+
+Usage
+-----
+generateCorpus('/tmp/mcp', figures=10000)
+figures, comics, anomalies = MCPFilesParser(mcpfilesdir='/tmp/mcp').getFiguresAndComics()
+
+or from the command line:
+
+$ ./mcpcorpus.py /tmp/mcp --figures 10000
+"""
+
+import os
+import random
+import argparse
+
+from mcparser import MCPFilesParser
+
+def generateCorpus(mcpfilesdir, figures=2000, list_length=40, abbreviations=400, appendix_ratio=0.1, annual_ratio=0.08,
+                   seed=1):
+   """
+   Write the synthetic mcp files to @mcpfilesdir.
+
+   * figures        - Number of figures, spread over the letter and dimension files.
+   * list_length    - Mean length of the chronology lists, a list has 1 to 2*@list_length entries.
+                      The single figure pages have 5*@list_length entries.
+   * abbreviations  - Number of comic abbreviations in the key.
+   * appendix_ratio - Part of the comics with an appendix, for example '-FB'.
+   * annual_ratio   - Part of the comics that are annuals, for example 'A@ 3'.
+   * seed           - Seed of the random generator.
+   """
+   r = random.Random(seed)
+   if not os.path.isdir(mcpfilesdir):
+      os.makedirs(mcpfilesdir)
+
+   abbrs = set()
+   while len(abbrs) < abbreviations:
+      a = ''.join([r.choice('ABCDEFGHIJKLMNOPRSTUVWXYZ') for _ in range(r.choice([1, 2, 2, 3, 3, 4]))])
+      if r.random() < 0.1:
+         a += r.choice(['2', '3'])
+      abbrs.add(a)
+   abbrs = sorted(abbrs)
+   with open(os.path.join(mcpfilesdir, MCPFilesParser.KEYFILE + MCPFilesParser.FILEEND), 'w') as out:
+      out.write('<html>TITLE KEY By KEY<table>\n')
+      for a in abbrs:
+         out.write('<tr><td>%s</td><td>TITLE OF %s</td></tr>\n' % (a, a))
+      out.write('</table>TITLE KEY By TITLE</html>\n')
+
+   def comic():
+      a = r.choice(abbrs)
+      if r.random() < annual_ratio:
+         a += '@'
+      nr = r.choice([str(r.randint(1, 400))]*8 + ["'%02d" % r.randint(80, 99), '%d.5' % r.randint(0, 9), '1/2', '-1', None])
+      s = '%s %s' % (a, nr) if nr else a
+      if r.random() < appendix_ratio:
+         s += r.choice(['-FB', '-BTS', '-OP', '-VO', ' (2)'])
+      return s
+
+   def entry():
+      s = comic()
+      if r.random() < 0.1:
+         s += ' &amp; ' + comic()
+      if r.random() < 0.05:
+         s += ' <a href="#X">See FIG %d</a>' % r.randint(0, 99)
+      if r.random() < 0.03:
+         s = '[' + s + ']'
+      if r.random() < 0.01:
+         # Not in the key or not a comic string
+         s = r.choice(['QQQ 1', 'ZZ9 %d' % r.randint(1, 5), 'A_B 2', 'x 1'])
+      return s
+
+   files = MCPFilesParser.MCPFILES + [d for d,_ in MCPFilesParser.MCPDIMENSIONS]
+   per_file = max(1, figures // len(files))
+   singles = list(MCPFilesParser.SINGLEFIGURES)
+   for fi, f in enumerate(files):
+      with open(os.path.join(mcpfilesdir, f + MCPFilesParser.FILEEND), 'w') as out:
+         out.write('<html>\n<body>\n\n')
+         for k in range(per_file):
+            name = '%s FIGURE %d' % (f.upper(), k)
+            if r.random() < 0.1:
+               name += ' [Skrull]'
+            if singles and fi % 5 == 0 and k == 0:
+               # The list is on the single figure page
+               name = singles.pop()[0]
+            out.write('<p id="%s_%d"><span class="char">%s</span><br>\n' % (f, k, name))
+            out.write('<span class="chron">\n')
+            for j in range(r.randint(1, 2*list_length)):
+               out.write(entry() + '<br>\n')
+            out.write('</span></p>\n\n')
+         out.write('<hr>\n</body></html>\n')
+
+   for n, f in MCPFilesParser.SINGLEFIGURES:
+      with open(os.path.join(mcpfilesdir, f + MCPFilesParser.FILEEND), 'w') as out:
+         out.write('<html><table><tr><td>x</td></tr></table>\n\n<b>%s</b><br>\n' % n.replace(' Chronology Page', ''))
+         for j in range(list_length*5):
+            out.write(entry() + '<br>\n')
+         out.write('<hr>key.gif\n')
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Write a synthetic set of mcp files.')
+   parser.add_argument('mcpfilesdir', help="Directory of the mcp files.")
+   parser.add_argument('--figures', type=int, default=2000, help="Number of figures.")
+   parser.add_argument('--listlength', type=int, default=40, help="Mean number of entries in a chronology list.")
+   parser.add_argument('--abbreviations', type=int, default=400, help="Number of comic abbreviations in the key.")
+   parser.add_argument('--appendixratio', type=float, default=0.1, help="Part of the comics with an appendix.")
+   parser.add_argument('--annualratio', type=float, default=0.08, help="Part of the comics that are annuals.")
+   parser.add_argument('--seed', type=int, default=1, help="Seed of the random generator.")
+   args = parser.parse_args()
+   generateCorpus(args.mcpfilesdir, figures=args.figures, list_length=args.listlength, abbreviations=args.abbreviations,
+                  appendix_ratio=args.appendixratio, annual_ratio=args.annualratio, seed=args.seed)
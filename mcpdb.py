@@ -3,45 +3,521 @@
 Provide the class MCPDB for generating sql statements for inserting figures and comics data into the MySQL database.
 """
 
+import re
+import heapq
+import marshal
+import tempfile
+import itertools
 import MySQLdb
 sqlEscape = MySQLdb.escape_string
 
+re_tsv_special = re.compile(r'[\\\t\n\r\0]')
+
+def tsvEscape(s):
+   """
+   Escape @s for a tab separated file loaded with LOAD DATA INFILE (ESCAPED BY '\\').
+   All other bytes are written as they are, the file is loaded with CHARACTER SET latin1.
+   """
+   if not re_tsv_special.search(s):
+      return s
+   return s.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r').replace('\0', '\\0')
+
+re_tsv_escaped = re.compile(r'\\(.)', re.DOTALL)
+_tsv_unescape = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r', '0': '\0'}
+
+def tsvUnescape(s):
+   """Reverse tsvEscape"""
+   if not '\\' in s:
+      return s
+   return re_tsv_escaped.sub(lambda m: _tsv_unescape.get(m.group(1), m.group(1)), s)
+
+def tsvRows(lines):
+   """Generate the rows of a tab separated file as tuples of strings, see MCPDB.generateTsvFor*"""
+   for line in lines:
+      yield tuple([tsvUnescape(v) for v in line[:-1].split('\t')])
+
+# Number of lines sortLines sorts in memory at a time
+SORT_CHUNK_LINES = 100000
+
+def sortLines(lines, key, chunk_lines=SORT_CHUNK_LINES):
+   """
+   Generate (key(line), line) for the @lines, sorted by the key. Lines with the same key keep their order.
+   At most @chunk_lines lines are in memory, more lines are sorted in chunks that are written to temporary
+   files and merged.
+   """
+   chunks = []
+   try:
+      lines = iter(lines)
+      n = 0
+      while True:
+         chunk = [(key(line), n + i, line) for i, line in enumerate(itertools.islice(lines, chunk_lines))]
+         if not chunk:
+            break
+         n += len(chunk)
+         chunk.sort()
+         if len(chunk) < chunk_lines and not chunks:
+            # All lines fit in one chunk
+            for k, i, line in chunk:
+               yield k, line
+            return
+         out = tempfile.TemporaryFile()
+         for item in chunk:
+            marshal.dump(item, out)
+         out.seek(0)
+         chunks.append(out)
+         del chunk
+      for k, i, line in heapq.merge(*[_readChunk(f) for f in chunks]):
+         yield k, line
+   finally:
+      for f in chunks:
+         f.close()
+
+def _readChunk(f):
+   """Generate the items of a chunk file of sortLines"""
+   while True:
+      try:
+         yield marshal.load(f)
+      except EOFError:
+         return
+
+def figureTrigrams(s):
+   """
+   Return the distinct lower case trigrams (three character substrings) of @s, sorted.
+   Mirror of figureSearchTrigrams in web/mcpfunctions.php.
+   """
+   s = s.lower()
+   return sorted(set([s[i:i+3] for i in range(len(s) - 2)]))
+
+re_create_table = re.compile(r'^CREATE TABLE IF NOT EXISTS (?P<table>\w+) \((?P<body>.*)\)(?P<options>[^)]*)$', re.S)
+
+def splitCreateTable(create_sql):
+   """
+   Split a CREATE TABLE statement of MCPDB._sqlCreate*Table.
+   Return the table name, the column and primary key definitions, the index definitions ('index (...)')
+   and the table options, for example ' ENGINE = innodb'.
+   """
+   m = re_create_table.match(create_sql)
+   if not m:
+      raise ValueError('Unknown CREATE TABLE statement %r' % create_sql)
+   columns = []
+   indexes = []
+   depth = 0
+   start = 0
+   body = m.group('body')
+   # Split at the commas outside parentheses
+   for i, c in enumerate(body + ','):
+      if c == '(':
+         depth += 1
+      elif c == ')':
+         depth -= 1
+      elif c == ',' and depth == 0:
+         part = body[start:i].strip()
+         (indexes if part.startswith('index ') else columns).append(part)
+         start = i + 1
+   return m.group('table'), columns, indexes, m.group('options')
+
 class MCPDB:
    """
-   There are three mysql tables that need to be created.
+   There are five mysql tables that need to be created.
 
    Generate the sql statements with:
    * generateSqlForFigures
+   * generateSqlForFigureTrigrams
    * generateSqlForComics
    * generateSqlForComicsFullName
+   * generateSqlForTable for the comic pages, see generateTsvForComicPages
+
+   If max_insert_size is given, rows are packed into multi-row INSERT statements of at most
+   max_insert_size characters (a row that is longer on its own get an INSERT statement of its own).
+   Else there is one INSERT statement per row.
+
+   For bulk loading, generate tab separated data files with:
+   * generateTsvForFigures
+   * generateTsvForFigureTrigrams
+   * generateTsvForComics (or generateTsvForAppearances, one figure at a time)
+   * generateTsvForComicsFullName
+   * generateTsvForComicPages
+
+   and the LOAD DATA LOCAL INFILE statements for the files with generateSqlLoadData.
+
+   The rows of a table can also be given directly, for example read back from its tab separated file
+   with tsvRows, to generateSqlForTable. Then only one row at a time is kept in memory.
+
+   The tab separated files of a previous build can be used to update the tables with only the rows
+   that have changed since that build, see generateSqlDeltaFor*. Both builds are sorted by the key of the
+   table with sortLines, so the tables need not fit in memory.
+
+   The comic table can also be stored normalized, with one row per entry and one row per comic in an entry
+   instead of the packed current, next and previous columns, see generateTsvForEntries, generateTsvForEntryComics
+   and generateSqlForComicsView.
+
+   With shadow=True, generateSqlForTable and generateSqlLoadData load the rows into a new table with the suffix
+   SHADOW_SUFFIX instead of emptying the live table, and add its indexes after the rows. When all tables are loaded,
+   the statements from generateSqlForShadowSwap replace the live tables with the new ones at once.
    """
+
+   FIGURE_COLUMNS = ('figid', 'name', 'race', 'search_name', 'link', 'dimension', 'chronolist')
+   FIGURE_TRIGRAM_COLUMNS = ('figid', 'trigram')
+   COMIC_COLUMNS = ('comicid', 'abbreviation', 'appendix', 'figid', 'entry_index', 'current_raw', 'current_comics',
+                    'next_raw', 'next_comics', 'previous_raw', 'previous_comics')
+   COMIC_FULLNAME_COLUMNS = ('comicid', 'full_name')
+   COMIC_PAGE_COLUMNS = ('comicid', 'abbreviation', 'full_name', 'appearances')
+   ENTRY_COLUMNS = ('figid', 'entry_index', 'rawstr')
+   ENTRY_COMIC_COLUMNS = ('figid', 'entry_index', 'position', 'comicid', 'abbreviation', 'appendix')
+   # The fields of each line in the appearances column of the comic page table
+   COMIC_PAGE_FIELDS = ('appendix', 'figid', 'entry_index', 'current_raw', 'current_comics', 'next_raw', 'next_comics',
+                        'previous_raw', 'previous_comics', 'name', 'link', 'dimension')
+
+   # Indexes of the columns that identify a row in the delta statements
+   FIGURE_KEY = (0,)
+   FIGURE_TRIGRAM_KEY = (0,)
+   COMIC_KEY = (0, 2, 3, 4)
+   COMIC_FULLNAME_KEY = (0,)
+   COMIC_PAGE_KEY = (0,)
+   ENTRY_KEY = (0, 1)
+   ENTRY_COMIC_KEY = (0, 1, 2)
+
+   # Suffixes of the shadow tables being loaded and of the replaced tables, see generateSqlForShadowSwap
+   SHADOW_SUFFIX = '_new'
+   OLD_SUFFIX = '_old'
    
-   def __init__(self, figtable, comictable, fullnametable):
+   def __init__(self, figtable, comictable, fullnametable, trigramtable, pagetable, entrytable, entrycomictable,
+                max_insert_size=0):
       self._figtable = figtable
+      self._entrytable = entrytable
+      self._entrycomictable = entrycomictable
+      self._pagetable = pagetable
+      self._trigramtable = trigramtable
       self._comictable = comictable
       self._fullnametable = fullnametable
+      self._max_insert_size = max_insert_size
+      # Table name mapped to the create statement function, the columns and the delta key of the table
+      self._tables = {figtable: (self._sqlCreateFigureTable, self.FIGURE_COLUMNS, self.FIGURE_KEY),
+                      trigramtable: (self._sqlCreateFigureTrigramTable, self.FIGURE_TRIGRAM_COLUMNS, self.FIGURE_TRIGRAM_KEY),
+                      comictable: (self._sqlCreateComicTable, self.COMIC_COLUMNS, self.COMIC_KEY),
+                      fullnametable: (self._sqlCreateComicFullnameTable, self.COMIC_FULLNAME_COLUMNS, self.COMIC_FULLNAME_KEY),
+                      pagetable: (self._sqlCreateComicPageTable, self.COMIC_PAGE_COLUMNS, self.COMIC_PAGE_KEY),
+                      entrytable: (self._sqlCreateEntryTable, self.ENTRY_COLUMNS, self.ENTRY_KEY),
+                      entrycomictable: (self._sqlCreateEntryComicTable, self.ENTRY_COMIC_COLUMNS, self.ENTRY_COMIC_KEY)}
       
    def generateSqlForFigures(self, figures):
-      yield self._sqlCreateFigureTable(self._figtable)
-      yield self._sqlDeleteAllFromTable(self._figtable)
-      for f in figures:
-         yield self._sqlInsertFigure(self._figtable, f)
+      return self.generateSqlForTable(self._figtable, (self._rowFigure(f) for f in figures))
+
+   def generateSqlForFigureTrigrams(self, figures):
+      return self.generateSqlForTable(self._trigramtable, (row for f in figures for row in self._rowsFigureTrigrams(f)))
          
    def generateSqlForComics(self, comics):
-      yield self._sqlCreateComicTable(self._comictable)
-      yield self._sqlDeleteAllFromTable(self._comictable)
-      for comic in comics.values():
-         for sql in self._sqlInsertComic(self._comictable, comic):
-            yield sql
+      return self.generateSqlForTable(self._comictable, (row for comic in comics.values() for row in self._rowsComic(comic)))
             
    def generateSqlForComicsFullName(self, comics):
-      yield self._sqlCreateComicFullnameTable(self._fullnametable)
-      yield self._sqlDeleteAllFromTable(self._fullnametable)
+      return self.generateSqlForTable(self._fullnametable, (self._rowComicFullname(comic) for comic in comics.values()))
+
+   def getTableSchema(self, t):
+      """Return the CREATE TABLE statement and the columns of table @t"""
+      create, columns, key = self._tables[t]
+      return create(t), columns
+
+   def generateSqlForTable(self, t, rows, shadow=False):
+      """
+      Generate the statements that create table @t and insert @rows, tuples with the values of the table's columns.
+      If @shadow is True, the rows are inserted into the shadow table of @t instead, see generateSqlForShadowSwap.
+      """
+      create, columns, key = self._tables[t]
+      if shadow:
+         for sql in self._sqlCreateShadowTable(t):
+            yield sql
+         for sql in self._sqlInsert(t + self.SHADOW_SUFFIX, (self._sqlValues(row) for row in rows)):
+            yield sql
+         for sql in self._sqlAddShadowIndexes(t):
+            yield sql
+         return
+      yield create(t)
+      yield self._sqlDeleteAllFromTable(t)
+      for sql in self._sqlInsert(t, (self._sqlValues(row) for row in rows)):
+         yield sql
+
+   def generateSqlForShadowSwap(self, tables):
+      """
+      Generate the statements that replace the live @tables with their shadow tables, loaded with shadow=True.
+      All tables are swapped with one RENAME TABLE, so a query sees either all old or all new tables,
+      and the old tables are dropped. The live tables are created first if they do not exist.
+      """
+      for t in tables:
+         create, columns, key = self._tables[t]
+         yield create(t)
+         yield self._sqlDropTableIfExists(t + self.OLD_SUFFIX)
+      yield 'RENAME TABLE %s' % ', '.join(['%s TO %s, %s TO %s' % (t, t + self.OLD_SUFFIX, t + self.SHADOW_SUFFIX, t)
+                                           for t in tables])
+      yield self._sqlDropTable(', '.join([t + self.OLD_SUFFIX for t in tables]))
+
+   def generateTsvForFigures(self, figures):
+      for f in figures:
+         yield self._tsvLine(self._rowFigure(f))
+
+   def generateTsvForFigureTrigrams(self, figures):
+      for f in figures:
+         for row in self._rowsFigureTrigrams(f):
+            yield self._tsvLine(row)
+
+   def generateTsvForComics(self, comics):
+      for comic in comics.values():
+         for row in self._rowsComic(comic):
+            yield self._tsvLine(row)
+
+   def generateTsvForComicsFullName(self, comics):
       for comic in comics.values():
-         yield self._sqlInsertComicFullname(self._fullnametable, comic)
+         yield self._tsvLine(self._rowComicFullname(comic))
+
+   def generateTsvForComicPages(self, comics, figure_lines, comic_lines):
+      """
+      The comic page table rows, in comic id order.
+
+      * comics       - Dict with the mcparser.Comic of all comics, the appearances are not used.
+      * figure_lines - The lines of the figure table file, see generateTsvForFigures.
+      * comic_lines  - The lines of the comic table file, see generateTsvForComics. They are sorted by comic id
+                       with sortLines, so only the name, link and dimension of the figures and the lines of
+                       SORT_CHUNK_LINES comic rows are in memory.
+      """
+      figures = dict()
+      for row in tsvRows(figure_lines):
+         figures[row[0]] = (row[1], row[4], row[5])
+      groups = itertools.groupby(sortLines(comic_lines, lambda line: int(line[:line.index('\t')])), lambda item: item[0])
+      comicid, lines = next(groups, (None, ()))
+      for comic in sorted(comics.values(), key=lambda c: c.id):
+         # Skip the rows of comics that are not in @comics
+         while comicid is not None and comicid < comic.id:
+            comicid, lines = next(groups, (None, ()))
+         rows = list(tsvRows([line for k, line in lines])) if comicid == comic.id else []
+         yield self._tsvLine(self._rowComicPage(comic, rows, figures))
+
+   def generateTsvForEntries(self, figures):
+      """The entry table rows of figures from mcparser.MCPFilesParser.iterFiguresAndComics"""
+      for f in figures:
+         for i, entry in enumerate(f['entries']):
+            yield self._tsvLine((f['id'], i, entry.rawstr))
+
+   def generateTsvForEntryComics(self, figures):
+      """The entry comic table rows of figures from mcparser.MCPFilesParser.iterFiguresAndComics"""
+      for f in figures:
+         for i, entry in enumerate(f['entries']):
+            for position, c in enumerate(entry.comics):
+               yield self._tsvLine((f['id'], i, position, c.comicid, c.comicstr, c.appendix))
+
+   def generateSqlForComicsView(self, view_name):
+      """
+      Generate the statements that create the view @view_name with the columns of the comic table,
+      from the entry and entry comic tables.
+
+      The packed comics are built with GROUP_CONCAT, which cuts the result at group_concat_max_len
+      (1024 by default). Increase it for the session if an entry has many comics.
+
+      The next entry of an appearance is always the entry after it. The comic table differs when the same comic
+      with the same appendix is twice in one entry: the first of them, and the appearance of the comic in the
+      entry before, do not get the entry after them as next entry.
+      """
+      def packed(entry_index):
+         return ("(SELECT GROUP_CONCAT(CONCAT(x.abbreviation,'|',x.comicid,'|',x.appendix) ORDER BY x.position SEPARATOR '#') "
+                 "FROM %s x WHERE x.figid=c.figid AND x.entry_index=%s)") % (self._entrycomictable, entry_index)
+      yield ("CREATE OR REPLACE VIEW %s AS SELECT c.comicid, c.abbreviation, c.appendix, c.figid, c.entry_index, "
+             "cur.rawstr AS current_raw, %s AS current_comics, "
+             "COALESCE(nxt.rawstr,'') AS next_raw, COALESCE(%s,'') AS next_comics, "
+             "COALESCE(prv.rawstr,'') AS previous_raw, COALESCE(%s,'') AS previous_comics "
+             "FROM %s c JOIN %s cur ON cur.figid=c.figid AND cur.entry_index=c.entry_index "
+             "LEFT JOIN %s nxt ON nxt.figid=c.figid AND nxt.entry_index=c.entry_index+1 "
+             "LEFT JOIN %s prv ON prv.figid=c.figid AND prv.entry_index=c.entry_index-1") % (
+             view_name, packed('c.entry_index'), packed('c.entry_index+1'), packed('c.entry_index-1'),
+             self._entrycomictable, self._entrytable, self._entrytable, self._entrytable)
+
+   def generateTsvForAppearances(self, figid, appearances):
+      """The comic table rows of one figure, see mcparser.MCPFilesParser.iterFiguresAndComics"""
+      for comic, appendix, appearance in appearances:
+         yield self._tsvLine(self._rowComicAppearance(comic, appendix, figid, appearance))
+
+   def generateSqlDeltaForFigures(self, figures, previous, stats=None):
+      """
+      Generate the statements that update the figure table from the rows in @previous to the rows of @figures.
+
+      * previous - The lines of the figure table file of the previous build, see generateTsvForFigures.
+      * stats    - Optional dict, filled with the number of inserted, updated, deleted and unchanged rows
+                   when the statements have been generated.
+      """
+      rows = (self._rowFigure(f) for f in figures)
+      return self._sqlDelta(self._figtable, self.FIGURE_COLUMNS, self.FIGURE_KEY, rows, previous, stats)
+
+   def generateSqlDeltaForFigureTrigrams(self, figures, previous, stats=None):
+      """See generateSqlDeltaForFigures"""
+      rows = (row for f in figures for row in self._rowsFigureTrigrams(f))
+      return self._sqlDelta(self._trigramtable, self.FIGURE_TRIGRAM_COLUMNS, self.FIGURE_TRIGRAM_KEY, rows, previous, stats)
+
+   def generateSqlDeltaForComics(self, comics, previous, stats=None):
+      """See generateSqlDeltaForFigures"""
+      rows = (row for comic in comics.values() for row in self._rowsComic(comic))
+      return self._sqlDelta(self._comictable, self.COMIC_COLUMNS, self.COMIC_KEY, rows, previous, stats)
+
+   def generateSqlDeltaForComicsFullName(self, comics, previous, stats=None):
+      """See generateSqlDeltaForFigures"""
+      rows = (self._rowComicFullname(comic) for comic in comics.values())
+      return self._sqlDelta(self._fullnametable, self.COMIC_FULLNAME_COLUMNS, self.COMIC_FULLNAME_KEY, rows, previous, stats)
+
+   def generateSqlDeltaForTable(self, t, rows, previous, stats=None):
+      """Generate the statements that update table @t to @rows, see generateSqlForTable and generateSqlDeltaForFigures"""
+      create, columns, key = self._tables[t]
+      return self._sqlDelta(t, columns, key, rows, previous, stats)
+
+   def generateSqlLoadData(self, tsv_files, shadow=False):
+      """
+      Generate statements that create the tables and load them from the tab separated files.
+
+      * tsv_files - Dict with table name mapped to the file name of the table's data file,
+                    see generateTsvFor*. The file names are relative to the working directory
+                    of the mysql client.
+      * shadow    - If True, load the shadow tables instead, see generateSqlForShadowSwap.
+      """
+      for t in (self._figtable, self._trigramtable, self._comictable, self._fullnametable, self._pagetable,
+                self._entrytable, self._entrycomictable):
+         if not t in tsv_files:
+            continue
+         create, columns, key = self._tables[t]
+         if shadow:
+            for sql in self._sqlCreateShadowTable(t):
+               yield sql
+            yield self._sqlLoadData(t + self.SHADOW_SUFFIX, tsv_files[t], columns)
+            for sql in self._sqlAddShadowIndexes(t):
+               yield sql
+            continue
+         yield create(t)
+         yield self._sqlDeleteAllFromTable(t)
+         yield self._sqlLoadData(t, tsv_files[t], columns)
+
+   def _sqlDelta(self, t, columns, key, rows, previous, stats):
+      """
+      Compare the rows with the same key values in the previous and the new build:
+      * Only in the previous build    - DELETE
+      * One row in both, not the same - UPDATE
+      * Else, if not the same         - DELETE all previous rows with the key (if any) and INSERT the new rows
+
+      Both builds are sorted by the key with sortLines and merged, the statements are in key order.
+      The DELETE statements are generated during the merge, the UPDATE statements and the inserted rows
+      are written to temporary files until then, so the memory used does not grow with the tables.
+      """
+      def lineKey(line):
+         fields = line[:-1].split('\t')
+         return tuple([tsvUnescape(fields[i]) for i in key])
+      byKey = lambda item: item[0]
+      old = itertools.groupby(sortLines(previous, lineKey), byKey)
+      new = itertools.groupby(sortLines((self._tsvLine(row) for row in rows), lineKey), byKey)
+
+      counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+      updates = tempfile.TemporaryFile()
+      inserts = tempfile.TemporaryFile()
+      try:
+         old_key, old_group = next(old, (None, ()))
+         new_key, new_group = next(new, (None, ()))
+         while old_key is not None or new_key is not None:
+            if new_key is None or (old_key is not None and old_key < new_key):
+               old_lines = [line for k, line in old_group]
+               yield self._sqlDeleteRows(t, columns, key, old_key)
+               counts['deleted'] += len(old_lines)
+               old_key, old_group = next(old, (None, ()))
+               continue
+            new_lines = [line for k, line in new_group]
+            old_lines = []
+            if old_key == new_key:
+               old_lines = [line for k, line in old_group]
+               old_key, old_group = next(old, (None, ()))
+            if old_lines == new_lines:
+               counts['unchanged'] += len(new_lines)
+            elif len(old_lines) == 1 and len(new_lines) == 1:
+               marshal.dump(self._sqlUpdate(t, columns, key, tsvRows(new_lines).next()), updates)
+               counts['updated'] += 1
+            else:
+               if old_lines:
+                  yield self._sqlDeleteRows(t, columns, key, new_key)
+                  counts['deleted'] += len(old_lines)
+               for row in tsvRows(new_lines):
+                  marshal.dump(self._sqlValues(row), inserts)
+               counts['inserted'] += len(new_lines)
+            new_key, new_group = next(new, (None, ()))
+         if stats is not None:
+            stats.update(counts)
+
+         updates.seek(0)
+         for sql in _readChunk(updates):
+            yield sql
+         inserts.seek(0)
+         for sql in self._sqlInsert(t, _readChunk(inserts)):
+            yield sql
+      finally:
+         updates.close()
+         inserts.close()
+
+   def _sqlWhere(self, columns, key, values):
+      return ' AND '.join(["%s='%s'" % (columns[i], sqlEscape(v)) for i, v in zip(key, values)])
+
+   def _sqlDeleteRows(self, t, columns, key, values):
+      return 'DELETE FROM %s WHERE %s' % (t, self._sqlWhere(columns, key, values))
+
+   def _sqlUpdate(self, t, columns, key, row):
+      assignments = ["%s=%s" % (c, self._sqlValue(v)) for i, (c, v) in enumerate(zip(columns, row)) if not i in key]
+      return 'UPDATE %s SET %s WHERE %s' % (t, ','.join(assignments), self._sqlWhere(columns, key, self._rowKey(key, row)))
+
+   def _rowKey(self, key, row):
+      """The key values of @row as strings, as they are read from a tab separated file"""
+      return tuple([str(row[i]) if isinstance(row[i], (int, long)) else row[i] for i in key])
+
+   def _sqlLoadData(self, t, file_name, columns):
+      return ("LOAD DATA LOCAL INFILE '%s' INTO TABLE %s CHARACTER SET latin1 "
+              "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (%s)") % (sqlEscape(file_name), t, ', '.join(columns))
+
+   def _tsvLine(self, row):
+      return '\t'.join([str(v) if isinstance(v, (int, long)) else tsvEscape(v) for v in row]) + '\n'
+
+   def _sqlValue(self, v):
+      return ("'%d'" % v) if isinstance(v, (int, long)) else ("'%s'" % sqlEscape(v))
+
+   def _sqlValues(self, row):
+      return '(%s)' % ','.join([self._sqlValue(v) for v in row])
+
+   def _sqlInsert(self, t, rows):
+      """Generate INSERT statements into table @t for the value tuple strings in @rows"""
+      head = 'INSERT INTO %s VALUES ' % t
+      if not self._max_insert_size:
+         for row in rows:
+            yield head + row
+         return
+      batch = []
+      size = len(head)
+      for row in rows:
+         if batch and size + 1 + len(row) > self._max_insert_size:
+            yield head + ','.join(batch)
+            batch = []
+            size = len(head)
+         if batch:
+            size += 1
+         size += len(row)
+         batch.append(row)
+      if batch:
+         yield head + ','.join(batch)
    
    def _sqlDropTable(self, table_name):
       return 'DROP TABLE %s' % table_name
+
+   def _sqlDropTableIfExists(self, table_name):
+      return 'DROP TABLE IF EXISTS %s' % table_name
+
+   def _sqlCreateShadowTable(self, t):
+      """Drop the shadow table of @t left by an earlier load and create it without the indexes of @t"""
+      create, columns, key = self._tables[t]
+      table, definitions, indexes, options = splitCreateTable(create(t))
+      yield self._sqlDropTableIfExists(t + self.SHADOW_SUFFIX)
+      yield 'CREATE TABLE %s (%s)%s' % (t + self.SHADOW_SUFFIX, ', '.join(definitions), options)
+
+   def _sqlAddShadowIndexes(self, t):
+      """Add the indexes of @t to its shadow table, all in one statement, after the rows are loaded"""
+      create, columns, key = self._tables[t]
+      table, definitions, indexes, options = splitCreateTable(create(t))
+      if indexes:
+         yield 'ALTER TABLE %s %s' % (t + self.SHADOW_SUFFIX, ', '.join(['ADD INDEX ' + index[len('index '):] for index in indexes]))
       
    def _sqlDeleteAllFromTable(self , table_name):
       return 'DELETE FROM %s' % table_name
@@ -60,6 +536,18 @@ class MCPDB:
       return ("CREATE TABLE IF NOT EXISTS %s (figid int, name varchar(256), race varchar(128), search_name text, "
               "link varchar(128), dimension varchar(128), chronolist longtext, index (figid), index (name, search_name(512)), index (race)) ENGINE = innodb") % table_name
    
+   def _sqlCreateFigureTrigramTable(self, table_name):
+      """
+      Columns:
+      * figid   - figure id
+      * trigram - A lower case trigram of the figure's name or search_name, see figureTrigrams
+
+      Used by the figure search instead of a LIKE '%...%' scan of the figure table. A figure whose name or
+      search_name contains the search string has all trigrams of the search string. The trigrams are compared
+      with the default collation, the same as the figure table, so the case and accents are treated as by LIKE.
+      """
+      return "CREATE TABLE IF NOT EXISTS %s (figid int, trigram varchar(3), index (trigram, figid))" % table_name
+   
    def _sqlCreateComicTable(self, table_name):
       """
       Columns:
@@ -87,35 +575,93 @@ class MCPDB:
       """
       return "CREATE TABLE IF NOT EXISTS %s (comicid int, full_name text, index (comicid))" % table_name
 
-   def _sqlInsertFigure(self, t, f):
-      return "INSERT INTO %s VALUES ('%d','%s','%s','%s','%s','%s','%s')" % (t, 
-                                                                             f['id'], 
-                                                                             sqlEscape(f['name']), 
-                                                                             sqlEscape(f['race']), 
-                                                                             sqlEscape(f['search']), 
-                                                                             sqlEscape(f['link']), 
-                                                                             sqlEscape(f['dimension']), 
-                                                                             sqlEscape(f['chronolist'])
-                                                                             )
+   def _sqlCreateComicPageTable(self, table_name):
+      """
+      Columns:
+      * comicid      - Unique int id for a comic
+      * abbreviation - For example 'IM 73'
+      * full_name    - Full name for a comic, for example "IRON MAN 73"
+      * appearances  - Everything needed to show the comic, one line per row of the comic in the comic table,
+                       in the order appendix, figid, entry_index. The fields of a line are COMIC_PAGE_FIELDS,
+                       separated by tabs and escaped as in the tab separated files, see tsvEscape.
+
+      A comic page is shown with one indexed read, instead of reading the full name and each figure of the comic.
+      """
+      return ("CREATE TABLE IF NOT EXISTS %s (comicid int, abbreviation varchar(128), full_name text, appearances longtext, "
+              "index (comicid), index (abbreviation))") % table_name
+
+   def _sqlCreateEntryTable(self, table_name):
+      """
+      Columns:
+      * figid       - figure id
+      * entry_index - Entry index in figure chronolist
+      * rawstr      - Entry in chronolist, also the entries without comics
+      """
+      return ("CREATE TABLE IF NOT EXISTS %s (figid int, entry_index int, rawstr varchar(128), "
+              "primary key (figid, entry_index))") % table_name
+
+   def _sqlCreateEntryComicTable(self, table_name):
+      """
+      Columns:
+      * figid        - figure id
+      * entry_index  - Entry index in figure chronolist
+      * position     - Position of the comic in the entry
+      * comicid      - Unique internal id for a comic
+      * abbreviation - For example 'IM 73'
+      * appendix     - For example '-FB', or '' if no appendix
+
+      The next and previous entries of a comic are the entries with entry_index + 1 and - 1 in the entry table.
+      """
+      return ("CREATE TABLE IF NOT EXISTS %s (figid int, entry_index int, position int, comicid int, "
+              "abbreviation varchar(128), appendix varchar(128), primary key (figid, entry_index, position), "
+              "index (comicid), index (abbreviation))") % table_name
+
+   def _rowFigure(self, f):
+      """Column values of the figure table, in the order of FIGURE_COLUMNS"""
+      return (f['id'], f['name'], f['race'], f['search'], f['link'], f['dimension'], f['chronolist'])
+   
+   def _rowsFigureTrigrams(self, f):
+      """Column values of the trigram table for the trigrams of the figure @f, in the order of FIGURE_TRIGRAM_COLUMNS"""
+      for t in sorted(set(figureTrigrams(f['name']) + figureTrigrams(f['search']))):
+         yield (f['id'], t)
    
-   def _sqlInsertComicFullname(self, t, comic):
-      return "INSERT INTO %s VALUES ('%d','%s')" % (t, comic['id'], sqlEscape(comic['full_name']))
-
-   def _sqlInsertComic(self, t, comic):
-      for app,figs in comic['appendixes'].items():
-         for figid,figdatalist in figs.items():
-            for figdata in figdatalist:
-               current_raw = figdata['current']['rawstr']
-               next_raw = figdata['next']['rawstr']
-               prev_raw = figdata['previous']['rawstr']
-               yield "INSERT INTO %s VALUES ('%d','%s','%s','%d','%d','%s','%s','%s','%s','%s','%s')" % (t, 
-                                                                                                         comic['id'], 
-                                                                                                         sqlEscape(comic['abbreviation']), 
-                                                                                                         sqlEscape(app), 
-                                                                                                         figid, 
-                                                                                                         figdata['index'], 
-                                                                                                         sqlEscape(current_raw), 
-                                                                                                         sqlEscape('#'.join(['|'.join([c['comicstr'], str(c['comicid']), c['appendix']]) for c in figdata['current']['comics']])), 
-                                                                                                         sqlEscape(next_raw), sqlEscape('#'.join(['|'.join([c['comicstr'], str(c['comicid']), c['appendix']]) for c in figdata['next']['comics']])),
-                                                                                                         sqlEscape(prev_raw), sqlEscape('#'.join(['|'.join([c['comicstr'], str(c['comicid']), c['appendix']]) for c in figdata['previous']['comics']])) 
-                                                                                                         )
+   def _rowComicFullname(self, comic):
+      """Column values of the comic full name table, in the order of COMIC_FULLNAME_COLUMNS"""
+      return (comic.id, comic.full_name)
+
+   def _rowComicPage(self, comic, rows, figures):
+      """
+      Column values of the comic page table, in the order of COMIC_PAGE_COLUMNS.
+
+      * rows    - The rows of @comic in the comic table, as read from its tab separated file.
+      * figures - Figure id mapped to the name, link and dimension of the figure.
+      """
+      # As ORDER BY appendix,figid,entry_index, the appendix is compared case insensitive by MySQL
+      rows.sort(key=lambda r: (r[2].upper(), int(r[3]), int(r[4])))
+      lines = ['\t'.join([tsvEscape(v) for v in r[2:11] + figures.get(r[3], ('', '', ''))]) for r in rows]
+      return (comic.id, comic.abbreviation, comic.full_name, '\n'.join(lines))
+
+   def _packComics(self, comics):
+      """comic1_abbr|comic1_id|comic1_appendix#comic2_abbr|..."""
+      return '#'.join(['|'.join([c.comicstr, str(c.comicid), c.appendix]) for c in comics])
+
+   def _rowsComic(self, comic):
+      """Column values of the comic table for all appearances in the mcparser.Comic @comic, in the order of COMIC_COLUMNS"""
+      for app,figs in comic.appendixes.items():
+         for figid,appearances in figs.items():
+            for a in appearances:
+               yield self._rowComicAppearance(comic, app, figid, a)
+
+   def _rowComicAppearance(self, comic, app, figid, a):
+      """Column values of the comic table for the mcparser.Appearance @a, in the order of COMIC_COLUMNS"""
+      return (comic.id,
+              comic.abbreviation,
+              app,
+              figid,
+              a.index,
+              a.current.rawstr,
+              self._packComics(a.current.comics),
+              a.next.rawstr,
+              self._packComics(a.next.comics),
+              a.previous.rawstr,
+              self._packComics(a.previous.comics))
@@ -0,0 +1,109 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Provide the class IdRegistry that keeps the figure ids and comic ids stable between builds.
+
+Usage
+-----
+registry = IdRegistry()
+figures, comics, anomalies = MCPFilesParser().getFiguresAndComics(registry=registry)
+registry.save()
+"""
+
+import os
+import json
+
+from mcparser import DATADIR
+
+IDSFILE = os.path.join(DATADIR, 'ids.json')
+
+class IdRegistry:
+   """
+   Map between figures/comics and their database ids, stored in a json file:
+
+   {'version':        1,
+    'figures':        {figure key: id, ...},
+    'comics':         {comic abbreviation: id, ...},
+    'next_figure_id': int,
+    'next_comic_id':  int}
+
+   A figure is identified by its link. If several figures have the same link, the second one gets the key 'link 2',
+   the third 'link 3' and so on, in file order.
+
+   Figures and comics already in the registry keep their ids, new ones get the next free id. Ids of figures and
+   comics that are removed from the mcp are never given to anything else, use compact to number all ids from 0 again.
+   """
+
+   VERSION = 1
+
+   def __init__(self, path=IDSFILE):
+      self.path = path
+      self.figures = dict()
+      self.comics = dict()
+      self.next_figure_id = 0
+      self.next_comic_id = 0
+      # Figure links and comics seen in this build
+      self._links = dict()
+      self._comics_seen = set()
+      if os.path.isfile(path):
+         self._read()
+
+   def _read(self):
+      with open(self.path, 'r') as inp:
+         data = json.load(inp, encoding='latin-1')
+      if data.get('version') != self.VERSION:
+         raise ValueError('Unknown version %r of the id registry %r' % (data.get('version'), self.path))
+      # The comics are iso-8859-1 byte strings in the parser
+      self.figures = dict([(k.encode('latin-1'), v) for k, v in data['figures'].iteritems()])
+      self.comics = dict([(k.encode('latin-1'), v) for k, v in data['comics'].iteritems()])
+      self.next_figure_id = data['next_figure_id']
+      self.next_comic_id = data['next_comic_id']
+
+   def save(self):
+      """Write the registry to its file"""
+      data = {'version': self.VERSION,
+              'figures': self.figures,
+              'comics': self.comics,
+              'next_figure_id': self.next_figure_id,
+              'next_comic_id': self.next_comic_id}
+      tmp = self.path + '.tmp'
+      with open(tmp, 'w') as out:
+         out.write(json.dumps(data, indent=1, sort_keys=True, separators=(',', ': '), encoding='latin-1'))
+      if os.name == 'nt' and os.path.exists(self.path):
+         # os.rename does not replace files on windows
+         os.remove(self.path)
+      os.rename(tmp, self.path)
+
+   def compact(self):
+      """
+      Forget all ids, the figures and comics are then numbered from 0 in file order, as in the first build.
+      Return the number of figure and comic ids that were in the registry.
+      """
+      n = (len(self.figures), len(self.comics))
+      self.figures = dict()
+      self.comics = dict()
+      self.next_figure_id = 0
+      self.next_comic_id = 0
+      return n
+
+   def getFigureId(self, link):
+      """Return the id of the figure with @link, call once per figure in file order"""
+      n = self._links.get(link, 0) + 1
+      self._links[link] = n
+      key = link if n == 1 else '%s %d' % (link, n)
+      if not key in self.figures:
+         self.figures[key] = self.next_figure_id
+         self.next_figure_id += 1
+      return self.figures[key]
+
+   def getComicId(self, comicstr):
+      """Return the id of the comic @comicstr"""
+      self._comics_seen.add(comicstr)
+      if not comicstr in self.comics:
+         self.comics[comicstr] = self.next_comic_id
+         self.next_comic_id += 1
+      return self.comics[comicstr]
+
+   def getUnusedCounts(self):
+      """Return the number of figure and comic ids in the registry that are not used by this build"""
+      figures_seen = sum(self._links.values())
+      return len(self.figures) - figures_seen, len(self.comics) - len(self._comics_seen)
@@ -0,0 +1,213 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Provide functions for rendering static comic pages, so the server can show them without the database.
+
+A comic page is the same html as publishComic in web/mcpfunctions.php. The pages are written gzip compressed to
+
+   PAGESDIR/comics/<comicid // 1000>/<comicid>.html.gz
+
+PAGESDIR is kept between builds. The sha1 of each page is stored in PAGESDIR/manifest.json and only the pages
+that have changed since the previous build are written, pages of removed comics are deleted.
+
+The figure pages are not rendered yet, getFigure in web/mcpfunctions.php still shows the html of a figure table
+that is not made by these scripts. The server reads the comic pages from MCP_PAGES_DIR in web/mcpfunctions.php.
+
+Usage
+-----
+pages = iterPages(tsvRows(comic_page_lines))
+stats = writePages(pages, jobs=4)
+"""
+
+import os
+import json
+import gzip
+import hashlib
+import multiprocessing
+from collections import deque
+
+from mcparser import DATADIR
+from mcpdb import MCPDB, tsvUnescape
+
+PAGESDIR = os.path.join(DATADIR, 'pages')
+MANIFEST = 'manifest.json'
+
+# Number of pages sent to a worker process at a time
+CHUNK_SIZE = 500
+
+def getPagePath(kind, id):
+   """Return the path of page @id relative to the pages directory, @kind is 'comics'"""
+   return os.path.join(kind, str(id // 1000), '%d.html.gz' % id)
+
+def addLinksToRaw(abbreviation, appendix, figid, rawstr, comics, link_current):
+   """
+   Link the comics in the entry @rawstr to their comic pages.
+   Mirror of addLinksToRaw in web/mcpfunctions.php, including that the comics are replaced one at a time.
+
+   * comics       - The packed comics of the entry, comic1_abbr|comic1_id|comic1_appendix#comic2_abbr|...
+   * link_current - If False, the comic @abbreviation with @appendix is not linked.
+   """
+   if rawstr == '':
+      return '&nbsp;'
+   linkstr = rawstr
+   for c in comics.split('#'):
+      ca = c.split('|') + ['', '']
+      if ca[0] == '':
+         # str_replace does nothing for an empty search string
+         continue
+      if not (ca[0] == abbreviation and ca[2] == appendix and not link_current):
+         linkstr = linkstr.replace(ca[0], '<a href="?comic=%s#%s%s">%s</a>' % (ca[1], ca[2], figid, ca[0]))
+   return linkstr
+
+def _figureCell(name, link, dimension):
+   if dimension != 'standard':
+      return '<td><a href="%s">%s (%s)</a></td>' % (link, name, dimension)
+   return '<td><a href="%s">%s</a></td>' % (link, name)
+
+def renderComicPage(abbreviation, full_name, appearances):
+   """
+   Return the html of a comic page, the same as publishComic in web/mcpfunctions.php.
+
+   * appearances - The appearances of the comic as dicts with the keys mcpdb.MCPDB.COMIC_PAGE_FIELDS,
+                   in the order of the comic page table.
+   """
+   if not appearances:
+      return '<table><tr><td>Could not find the comic.</td></tr></table>'
+   out = ['<table class="comictable" cellspacing=0 cellpadding=4><tr><th></th><th>Previous</th><th colspan=2>Current</th><th>Next</th></tr>',
+          '<b>%s</b>' % full_name]
+   current_appendix = None
+   color = False
+   for a in appearances:
+      appendix, figid = a['appendix'], a['figid']
+      if appendix != current_appendix:
+         if current_appendix is not None:
+            out.append('<tr class="space_row"><td colspan=5>&nbsp;</td></tr>')
+         current_appendix = appendix
+         color = False
+         out.append('<tr id="%s" class="comic_title_row"><td><b>%s %s</b></td><td colspan=4>&nbsp;</td></tr>' % (appendix, abbreviation, appendix))
+      out.append('<tr id="%s%s" class="%s">' % (appendix, figid, 'color_row figrow' if color else 'figrow'))
+      out.append(_figureCell(a['name'], a['link'], a['dimension']))
+      out.append('<td>%s</td>' % addLinksToRaw(abbreviation, appendix, figid, a['previous_raw'], a['previous_comics'], True))
+      out.append('<td alight="right">%d</td><td>%s</td>' % (int(a['entry_index']) + 1,
+                 addLinksToRaw(abbreviation, appendix, figid, a['current_raw'], a['current_comics'], False)))
+      out.append('<td>%s</td>' % addLinksToRaw(abbreviation, appendix, figid, a['next_raw'], a['next_comics'], True))
+      color = not color
+   out.append('</table>')
+   return ''.join(out)
+
+def iterPages(comic_page_rows):
+   """
+   Generate (path, args) for every comic page, where args are the arguments of renderComicPage.
+
+   * comic_page_rows - The rows of the comic page table, see mcpdb.MCPDB.generateTsvForComicPages,
+                       read one at a time, as from mcpdb.tsvRows.
+   """
+   for comicid, abbreviation, full_name, lines in comic_page_rows:
+      appearances = [dict(zip(MCPDB.COMIC_PAGE_FIELDS, [tsvUnescape(v) for v in line.split('\t')]))
+                     for line in lines.split('\n') if line]
+      yield getPagePath('comics', int(comicid)), (abbreviation, full_name, appearances)
+
+def _writePage(path, html):
+   """Write the gzip compressed @html to @path. The gzip header has no time, so the same page gives the same file."""
+   d = os.path.dirname(path)
+   if not os.path.isdir(d):
+      try:
+         os.makedirs(d)
+      except OSError:
+         # Created by another worker
+         if not os.path.isdir(d):
+            raise
+   tmp = path + '.tmp'
+   with open(tmp, 'wb') as raw:
+      out = gzip.GzipFile('', 'wb', 9, raw, 0)
+      out.write(html)
+      out.close()
+   if os.name == 'nt' and os.path.exists(path):
+      # os.rename does not replace files on windows
+      os.remove(path)
+   os.rename(tmp, path)
+
+def _renderChunk(args):
+   """Render a chunk of pages and write the changed ones. Return [(path, sha1, written), ...]"""
+   pagesdir, chunk = args
+   result = []
+   for path, render_args, old_hash in chunk:
+      html = renderComicPage(*render_args)
+      h = hashlib.sha1(html).hexdigest()
+      written = h != old_hash or not os.path.isfile(os.path.join(pagesdir, path))
+      if written:
+         _writePage(os.path.join(pagesdir, path), html)
+      result.append((path, h, written))
+   return result
+
+def writePages(pages, pagesdir=PAGESDIR, jobs=1):
+   """
+   Render and write the pages from iterPages in @jobs worker processes, only the pages whose content has changed
+   since the previous build are written. Pages in the manifest that are not in @pages are deleted, also the figure
+   pages of the builds that rendered them, and so are the directories left empty.
+
+   Return a dict with the number of 'written', 'unchanged' and 'removed' pages.
+   """
+   manifest_path = os.path.join(pagesdir, MANIFEST)
+   old = dict()
+   if os.path.isfile(manifest_path):
+      with open(manifest_path, 'r') as inp:
+         old = json.load(inp)
+
+   def chunks():
+      chunk = []
+      for path, render_args in pages:
+         chunk.append((path, render_args, old.get(path)))
+         if len(chunk) == CHUNK_SIZE:
+            yield pagesdir, chunk
+            chunk = []
+      if chunk:
+         yield pagesdir, chunk
+
+   def results():
+      if jobs <= 1:
+         for c in chunks():
+            yield _renderChunk(c)
+         return
+      # Pool.imap would read all pages into its task queue, keep at most two chunks per worker queued
+      pool = multiprocessing.Pool(jobs)
+      try:
+         queued = deque()
+         for c in chunks():
+            queued.append(pool.apply_async(_renderChunk, (c,)))
+            if len(queued) > 2*jobs:
+               yield queued.popleft().get()
+         while queued:
+            yield queued.popleft().get()
+      finally:
+         pool.close()
+         pool.join()
+
+   manifest = dict()
+   stats = {'written': 0, 'unchanged': 0, 'removed': 0}
+   for result in results():
+      for path, h, written in result:
+         manifest[path] = h
+         stats['written' if written else 'unchanged'] += 1
+
+   removed_dirs = set()
+   for path in old:
+      if not path in manifest:
+         if os.path.isfile(os.path.join(pagesdir, path)):
+            os.remove(os.path.join(pagesdir, path))
+         removed_dirs.add(os.path.dirname(path))
+         stats['removed'] += 1
+   # Remove the directories that are left empty, and their parents
+   for d in removed_dirs:
+      while d and os.path.isdir(os.path.join(pagesdir, d)) and not os.listdir(os.path.join(pagesdir, d)):
+         os.rmdir(os.path.join(pagesdir, d))
+         d = os.path.dirname(d)
+
+   if not os.path.isdir(pagesdir):
+      os.makedirs(pagesdir)
+   tmp = manifest_path + '.tmp'
+   with open(tmp, 'w') as out:
+      json.dump(manifest, out, sort_keys=True)
+   if os.name == 'nt' and os.path.exists(manifest_path):
+      os.remove(manifest_path)
+   os.rename(tmp, manifest_path)
+   return stats
@@ -0,0 +1,232 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Provide the class Profiler that records the wall time, CPU time and peak memory of the phases of a build,
+counts the calls of the parser's most called methods and other counts, for example of the rows written.
+
+Usage
+-----
+profiler = Profiler(cprofile_phase='sql')
+instrumentParser(profiler, parser)
+with profiler.phase('sort'):
+   comics_str.sort(key=lambda c: comics[c].sortkey)
+profiler.count('rows mcp_comics', 12)
+print '\\n'.join(profiler.formatReport())
+profiler.save('data/2026-10-18/profile.json')
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import pstats
+from StringIO import StringIO
+try:
+   import resource
+except ImportError:
+   # Windows
+   resource = None
+
+# Parser methods that are called for every entry or comic, only counted
+PARSER_CALLS = ['_clean', '_classifyComic', '_getAbbreviationAndNumber', '_getFullComicName', 'getComicSortKey']
+
+def getPeakMemory():
+   """Return the peak resident memory of the process in MB, None if it is not known"""
+   if resource is None:
+      return None
+   # Kilobytes on linux, bytes on mac os
+   rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   return rss / (1024.0*1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+def _cpuTime():
+   """Return the user and system CPU time of the process in seconds"""
+   t = os.times()
+   return t[0] + t[1]
+
+class _NoPhase(object):
+   """The phase of a disabled profiler, does nothing"""
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      return False
+
+_NO_PHASE = _NoPhase()
+
+class _Phase(object):
+   """A context manager that adds the time and memory used in it to a phase of a Profiler"""
+   __slots__ = ('profiler', 'name', 'wall', 'cpu', 'memory', 'cprofile')
+
+   def __init__(self, profiler, name):
+      self.profiler = profiler
+      self.name = name
+
+   def __enter__(self):
+      self.cprofile = self.profiler._startPhase(self.name)
+      self.memory = getPeakMemory()
+      self.cpu = _cpuTime()
+      self.wall = time.time()
+      return self
+
+   def __exit__(self, *args):
+      wall = time.time() - self.wall
+      cpu = _cpuTime() - self.cpu
+      self.profiler._stopPhase(self.name, wall, cpu, self.memory, self.cprofile)
+      return False
+
+class Profiler:
+   """
+   Record the phases of a build. A phase can be entered many times, for example once per mcp file,
+   the calls, wall time and CPU time are then summed. Entering a phase costs a few microseconds, for work
+   done once per figure or row use count instead.
+
+   For each phase the report has:
+   * calls          - Number of times the phase was entered.
+   * wall           - Wall time in seconds.
+   * cpu            - CPU time of the process in seconds, worker processes are not included.
+   * peak_memory_mb - Peak memory of the process when the phase was last left, None on windows.
+   * growth_mb      - How much the phases raised the peak memory.
+   * parent         - The phase the phase was first entered in, or None. Its time is part of the parent's time.
+
+   If @cprofile_phase is given, the phases with that name or whose name starts with it and a space
+   ('sql' is 'sql mcp_comics', 'sql mcp_figures' ...) are also run with cProfile, see saveCProfile.
+
+   A disabled profiler records nothing and its phases cost almost nothing, so the code to profile need not check.
+   """
+
+   def __init__(self, enabled=True, cprofile_phase=None):
+      self.enabled = enabled or cprofile_phase is not None
+      self.cprofile_phase = cprofile_phase
+      self._phases = dict()
+      self._order = []
+      self._stack = []
+      self._calls = dict()
+      self._counts = dict()
+      self._cprofile = cProfile.Profile() if cprofile_phase is not None else None
+      self._cprofile_depth = 0
+      self._start = (time.time(), _cpuTime())
+
+   def phase(self, name):
+      """Return a context manager that records the time and memory used in it as phase @name"""
+      if not self.enabled:
+         return _NO_PHASE
+      return _Phase(self, name)
+
+   def wrapPhase(self, obj, method, name):
+      """
+      Record each call of the method @method of the object @obj as the phase @name.
+      @name can also be a function that is given the arguments of the call and returns the name of the phase.
+      """
+      if not self.enabled:
+         return
+      func = getattr(obj, method)
+      def wrapper(*args, **kwargs):
+         with _Phase(self, name(*args, **kwargs) if callable(name) else name):
+            return func(*args, **kwargs)
+      setattr(obj, method, wrapper)
+
+   def countCalls(self, obj, methods):
+      """Count the calls of the methods @methods of the object @obj"""
+      if not self.enabled:
+         return
+      for method in methods:
+         self._calls[method] = 0
+         setattr(obj, method, self._countingWrapper(method, getattr(obj, method)))
+
+   def count(self, name, n=1):
+      """Add @n to the count @name"""
+      if self.enabled:
+         self._counts[name] = self._counts.get(name, 0) + n
+
+   def _countingWrapper(self, method, func):
+      def wrapper(*args, **kwargs):
+         self._calls[method] += 1
+         return func(*args, **kwargs)
+      return wrapper
+
+   def _isCProfiled(self, name):
+      p = self.cprofile_phase
+      return p is not None and (name == p or name.startswith(p + ' '))
+
+   def _startPhase(self, name):
+      if not name in self._phases:
+         self._phases[name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_memory_mb': None, 'growth_mb': 0.0,
+                               'parent': self._stack[-1] if self._stack else None}
+         self._order.append(name)
+      self._stack.append(name)
+      if self._isCProfiled(name):
+         if self._cprofile_depth == 0:
+            self._cprofile.enable()
+         self._cprofile_depth += 1
+         return True
+      return False
+
+   def _stopPhase(self, name, wall, cpu, memory, cprofiled):
+      if cprofiled:
+         self._cprofile_depth -= 1
+         if self._cprofile_depth == 0:
+            self._cprofile.disable()
+      self._stack.pop()
+      p = self._phases[name]
+      p['calls'] += 1
+      p['wall'] += wall
+      p['cpu'] += cpu
+      p['peak_memory_mb'] = getPeakMemory()
+      if memory is not None:
+         p['growth_mb'] += p['peak_memory_mb'] - memory
+
+   def getReport(self):
+      """
+      Return the report as a dict with the 'phases' in the order they were first entered, the 'calls', the 'counts'
+      and the 'total'
+      """
+      return {'phases': [dict(name=name, **self._phases[name]) for name in self._order],
+              'calls': dict(self._calls),
+              'counts': dict(self._counts),
+              'total': {'wall': time.time() - self._start[0], 'cpu': _cpuTime() - self._start[1],
+                        'peak_memory_mb': getPeakMemory()}}
+
+   def formatReport(self):
+      """Return the lines of a table with the report"""
+      report = self.getReport()
+      memory = lambda m: '%10.1f' % m if m is not None else '%10s' % '-'
+      lines = ['%-40s %8s %9s %9s %10s %10s' % ('phase', 'calls', 'wall (s)', 'cpu (s)', 'peak (MB)', 'growth (MB)')]
+      depth = dict()
+      for p in report['phases']:
+         depth[p['name']] = depth[p['parent']] + 1 if p['parent'] is not None else 0
+         lines.append('%-40s %8d %9.2f %9.2f %s %s' % ('  '*depth[p['name']] + p['name'], p['calls'], p['wall'], p['cpu'],
+                                                       memory(p['peak_memory_mb']), memory(p['growth_mb'])))
+      t = report['total']
+      lines.append('%-40s %8s %9.2f %9.2f %s' % ('total', '', t['wall'], t['cpu'], memory(t['peak_memory_mb'])))
+      for method in sorted(report['calls']):
+         lines.append('%-40s %8d' % ('calls of %s' % method, report['calls'][method]))
+      for name in sorted(report['counts']):
+         lines.append('%-40s %8d' % (name, report['counts'][name]))
+      return lines
+
+   def save(self, path):
+      """Write the report as json to @path"""
+      with open(path, 'w') as out:
+         json.dump(self.getReport(), out, indent=1, sort_keys=True)
+
+   def saveCProfile(self, path, limit=25):
+      """Write the cProfile statistics to @path, readable with pstats, and return the @limit most expensive functions"""
+      self._cprofile.dump_stats(path)
+      out = StringIO()
+      pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(limit)
+      return out.getvalue()
+
+def instrumentParser(profiler, parser):
+   """
+   Record the phases of the MCPFilesParser @parser: 'key' (the abbreviation key), 'figures <mcp file>' (the figure
+   extraction of each file), 'entries' (the entry cleaning and comic checks of each figure, part of the figure
+   extraction) and 'comics' (the comic collection), and count the calls of PARSER_CALLS.
+   The comic checks are only counted, a phase around each of them would cost more than the check.
+   The files parsed in worker processes are not recorded, profile with one job to see them.
+   """
+   profiler.wrapPhase(parser, '_getAbbreviations', 'key')
+   profiler.wrapPhase(parser, '_parseFile', lambda f, *args: 'figures ' + f)
+   profiler.wrapPhase(parser, '_readCache', lambda f, *args: 'figures ' + f)
+   profiler.wrapPhase(parser, '_cleanEntries', 'entries')
+   profiler.wrapPhase(parser, '_collectAppearances', 'comics')
+   profiler.countCalls(parser, PARSER_CALLS)
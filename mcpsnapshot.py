@@ -0,0 +1,119 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Provide the class SnapshotWriter that saves the parse result of a build, and the function iterSnapshot that reads
+it back, so the output files can be created again without parsing the mcp files.
+
+The snapshot is a sequence of marshal records, read and written one figure at a time:
+
+   ('snapshot', SnapshotWriter.VERSION, MCPFilesParser.PARSER_VERSION, marshal.version)
+   ('figure', fields, entries, comics, appearances)    - One record per figure in file order, see SnapshotWriter.add
+   ...
+   ('end', number of figures, anomalies)              - The anomalies as the list of an AnomalyLog
+
+Usage
+-----
+snapshot = SnapshotWriter('data/2026-10-18/snapshot.marshal')
+for f, appearances in parser.iterFiguresAndComics(comics, anomaly_log):
+   snapshot.add(f, appearances)
+snapshot.close(anomaly_log)
+
+for f, appearances in iterSnapshot('data/2026-10-18/snapshot.marshal', comics, anomaly_log):
+   ...
+"""
+
+import os
+import marshal
+
+from mcparser import MCPFilesParser, Comic, Appearance, Entry, ComicRef, EMPTY_ENTRY
+
+SNAPSHOTFILE = 'snapshot.marshal'
+
+def getSnapshotPath(path):
+   """Return the path of the snapshot in the build directory @path, or @path if it is a file"""
+   return os.path.join(path, SNAPSHOTFILE) if os.path.isdir(path) else path
+
+class SnapshotWriter:
+   """
+   Write the figures, comics and anomalies from MCPFilesParser.iterFiguresAndComics to a snapshot file.
+   The file gets its name when the snapshot is closed, an unfinished snapshot is never read.
+   """
+
+   VERSION = 1
+
+   def __init__(self, path):
+      self.path = path
+      self._tmp = path + '.part'
+      self._out = open(self._tmp, 'wb')
+      self._comics = set()
+      self._figures = 0
+      marshal.dump(('snapshot', self.VERSION, MCPFilesParser.PARSER_VERSION, marshal.version), self._out)
+
+   def add(self, f, appearances):
+      """
+      Add figure @f, with its 'entries' from iterFiguresAndComics, and its @appearances. The record has:
+
+      * fields      - The figure dict without the entries.
+      * entries     - (rawstr, ((comicstr, appendix, comicid), ...)) of each entry.
+      * comics      - (id, abbreviation, full_name, sortkey) of the comics first found in the figure.
+      * appearances - (comicstr, appendix, entry index, index of the next entry or -1) of each appearance.
+      """
+      fields = dict([(k, v) for k, v in f.iteritems() if k != 'entries'])
+      entries = f['entries']
+      index = dict([(id(e), i) for i, e in enumerate(entries)])
+      comics = []
+      for comic, appendix, a in appearances:
+         if not comic.id in self._comics:
+            self._comics.add(comic.id)
+            comics.append((comic.id, comic.abbreviation, comic.full_name, comic.sortkey))
+      marshal.dump(('figure', fields,
+                    [(e.rawstr, tuple([(r.comicstr, r.appendix, r.comicid) for r in e.comics])) for e in entries],
+                    comics,
+                    [(comic.abbreviation, appendix, a.index, -1 if a.next is EMPTY_ENTRY else index[id(a.next)])
+                     for comic, appendix, a in appearances]), self._out)
+      self._figures += 1
+
+   def close(self, anomaly_log):
+      """
+      Add the anomalies and give the snapshot its name. The anomalies are given as an AnomalyLog,
+      so they are added in the same order when the snapshot is read and the dicts of Anomalies are the same.
+      """
+      marshal.dump(('end', self._figures, list(anomaly_log)), self._out)
+      self._out.close()
+      if os.name == 'nt' and os.path.exists(self.path):
+         # os.rename does not replace files on windows
+         os.remove(self.path)
+      os.rename(self._tmp, self.path)
+
+def iterSnapshot(path, comics, anomalies):
+   """
+   Read the snapshot @path and generate (figure, appearances) for each figure, the same as
+   MCPFilesParser.iterFiguresAndComics. The comics are added to the dict @comics and the anomalies to @anomalies
+   (Anomalies or AnomalyLog), they are complete when all figures have been generated.
+   """
+   with open(path, 'rb') as inp:
+      header = marshal.load(inp)
+      if header != ('snapshot', SnapshotWriter.VERSION, MCPFilesParser.PARSER_VERSION, marshal.version):
+         raise ValueError('Unknown version %r of the snapshot %r, parse the mcp files again' % (header[1:], path))
+      figures = 0
+      while True:
+         try:
+            record = marshal.load(inp)
+         except EOFError:
+            raise ValueError('The snapshot %r is incomplete' % path)
+         if record[0] == 'end':
+            if record[1] != figures:
+               raise ValueError('The snapshot %r has %d figures, expected %d' % (path, figures, record[1]))
+            for args in record[2]:
+               anomalies.add(*args)
+            return
+         kind, f, entries, new_comics, appearances = record
+         for comicid, abbreviation, full_name, sortkey in new_comics:
+            comics[abbreviation] = Comic(comicid, abbreviation, full_name, sortkey)
+         # The comic strings and appendixes are interned by MCPFilesParser._collectAppearances,
+         # marshal keeps them interned
+         entries = [Entry(rawstr, tuple([ComicRef(*ref) for ref in refs])) for rawstr, refs in entries]
+         f['entries'] = entries
+         yield f, [(comics[c], a, Appearance(i, entries[i], entries[n] if n >= 0 else EMPTY_ENTRY,
+                                             entries[i-1] if i > 0 else EMPTY_ENTRY))
+                   for c, a, i, n in appearances]
+         figures += 1
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+"""
+Provide functions for loading a build into a local SQLite database and for running the lookups of the search page
+on it, so a build can be checked and its query times measured before it is imported into MySQL.
+
+The tables have the columns and indexes of the MySQL tables, see MCPDB._sqlCreate*Table. The text columns
+compare case insensitively, as the MySQL tables. The view mcp_comics_view is not created.
+
+The lookups are the same as in web/mcpfunctions.php:
+* searchForComic   - The comic pages of a comic abbreviation.
+* getComic         - The comic page of a comic id.
+* searchForFigures - The figures whose name or search name contain a string, with the trigram index.
+
+Usage
+-----
+loadSqlite('data/2026-10-18/mcp.sqlite', db, {'mcp_figures': 'data/2026-10-18/figures.tsv', ...})
+
+or from the command line, with the database of a build made with 'searchthemcp.py --sqlite':
+
+$ ./mcpsqlite.py data/2026-10-18/mcp.sqlite comic "W2 1"
+$ ./mcpsqlite.py data/2026-10-18/mcp.sqlite comicid 18012 --html
+$ ./mcpsqlite.py data/2026-10-18/mcp.sqlite figures wolverine --repeat 10
+"""
+
+import os
+import re
+import time
+import sqlite3
+import argparse
+
+from mcpdb import MCPDB, tsvRows, tsvUnescape, figureTrigrams, splitCreateTable
+from mcppages import renderComicPage
+
+SQLITEFILE = 'mcp.sqlite'
+
+# Rows inserted with one executemany
+BATCH_SIZE = 10000
+
+re_prefix_length = re.compile(r'\(\d+\)')
+
+def sqliteSchema(create_sql):
+   """
+   Translate the MySQL CREATE TABLE statement @create_sql (see MCPDB._sqlCreate*Table) to SQLite.
+   Return the CREATE TABLE statement without the indexes and the CREATE INDEX statements.
+   The int columns are INTEGER, all other columns TEXT COLLATE NOCASE, as the case insensitive MySQL collation.
+   """
+   t, definitions, indexes, options = splitCreateTable(create_sql)
+   columns = []
+   for part in definitions:
+      if part.startswith('primary key '):
+         columns.append('PRIMARY KEY ' + part[len('primary key '):])
+      else:
+         name, type_ = part.split(' ', 1)
+         columns.append('%s %s' % (name, 'INTEGER' if type_ == 'int' else 'TEXT COLLATE NOCASE'))
+   create_indexes = ['CREATE INDEX %s_%d ON %s %s' % (t, n, t, re_prefix_length.sub('', index[len('index '):]))
+                     for n, index in enumerate(indexes)]
+   return 'CREATE TABLE %s (%s)' % (t, ', '.join(columns)), create_indexes
+
+def loadSqlite(path, db, tsv_files, verbose=False):
+   """
+   Create the SQLite database @path with the tables in @tsv_files, a dict with table name mapped to the path of its
+   tab separated file, see MCPDB.generateTsvFor*. An existing database is replaced when the new one is loaded.
+   The rows of a table are inserted in one transaction and the indexes are created after them.
+
+   * db - MCPDB, for the table definitions.
+
+   Return a dict with table name mapped to the number of rows.
+   """
+   tmp = path + '.tmp'
+   if os.path.exists(tmp):
+      os.remove(tmp)
+   counts = dict()
+   conn = sqlite3.connect(tmp)
+   try:
+      # The database is thrown away if the load fails, no need for a journal
+      conn.execute('PRAGMA journal_mode = OFF')
+      conn.execute('PRAGMA synchronous = OFF')
+      for t in sorted(tsv_files):
+         start = time.time()
+         create_sql, columns = db.getTableSchema(t)
+         create_table, create_indexes = sqliteSchema(create_sql)
+         insert = 'INSERT INTO %s VALUES (%s)' % (t, ','.join(['?']*len(columns)))
+         with conn:
+            conn.execute(create_table)
+            counts[t] = 0
+            with open(tsv_files[t], 'rb') as rows:
+               batch = []
+               for row in tsvRows(rows):
+                  # The files are iso-8859-1, sqlite stores utf-8
+                  batch.append([v.decode('latin-1') for v in row])
+                  if len(batch) == BATCH_SIZE:
+                     conn.executemany(insert, batch)
+                     counts[t] += len(batch)
+                     batch = []
+               conn.executemany(insert, batch)
+               counts[t] += len(batch)
+            for sql in create_indexes:
+               conn.execute(sql)
+         if verbose:
+            print 'SQLite table %s: %d rows loaded in %.1f s' % (t, counts[t], time.time() - start)
+   finally:
+      conn.close()
+   if os.name == 'nt' and os.path.exists(path):
+      # os.rename does not replace files on windows
+      os.remove(path)
+   os.rename(tmp, path)
+   return counts
+
+def openSqlite(path):
+   """Open the SQLite database @path made by loadSqlite"""
+   if not os.path.isfile(path):
+      raise IOError('No SQLite database %r' % path)
+   return sqlite3.connect(path)
+
+def figureSearchTrigrams(s):
+   """
+   The trigrams of @s used by searchForFigures, empty if the trigram index can not be used.
+   Mirror of figureSearchTrigrams in web/mcpfunctions.php.
+   """
+   if len(s) < 3 or re.search(r'[%_\\\x80-\xff]', s):
+      return []
+   return figureTrigrams(s)
+
+def _comicPage(row):
+   """Return (comicid, abbreviation, full_name, appearances) of a comic page row, see mcppages.renderComicPage"""
+   comicid, abbreviation, full_name, lines = row
+   appearances = [dict(zip(MCPDB.COMIC_PAGE_FIELDS, [tsvUnescape(v) for v in line.split('\t')]))
+                  for line in lines.split('\n') if line]
+   return comicid, abbreviation, full_name, appearances
+
+def searchForComic(conn, abbreviation):
+   """Return the comic pages of the comic @abbreviation as (comicid, abbreviation, full_name, appearances)"""
+   rows = conn.execute('SELECT * FROM mcp_comics_page WHERE abbreviation=? ORDER BY comicid', (abbreviation,))
+   return [_comicPage(row) for row in rows]
+
+def getComic(conn, comicid):
+   """Return the comic pages of the comic id @comicid, see searchForComic"""
+   rows = conn.execute('SELECT * FROM mcp_comics_page WHERE comicid=?', (comicid,))
+   return [_comicPage(row) for row in rows]
+
+def searchForFigures(conn, s):
+   """Return (name, link, dimension) of the figures whose name or search name contain @s, in figure id order"""
+   # The LIKE escape character of MySQL
+   where = "search_name LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\'"
+   like = '%' + s + '%'
+   trigrams = figureSearchTrigrams(s)
+   if trigrams:
+      # Only the figures with all trigrams of the search string can match, the LIKE is then checked on them
+      sql = ('SELECT name,link,dimension FROM mcp_figures JOIN (SELECT figid AS trigram_figid FROM mcp_figures_trigram '
+             'WHERE trigram IN (%s) GROUP BY figid HAVING COUNT(DISTINCT trigram)=?) matches '
+             'ON figid=trigram_figid WHERE %s ORDER BY figid') % (','.join(['?']*len(trigrams)), where)
+      args = trigrams + [len(trigrams), like, like]
+   else:
+      sql = 'SELECT name,link,dimension FROM mcp_figures WHERE %s ORDER BY figid' % where
+      args = [like, like]
+   return conn.execute(sql, args).fetchall()
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Run the lookups of the search page on a SQLite database of a build.')
+   parser.add_argument('database', help="The SQLite database, data/YYYY-MM-DD/%s." % SQLITEFILE)
+   parser.add_argument('lookup', choices=['comic', 'comicid', 'figures'],
+                       help="comic: search for a comic abbreviation, comicid: get a comic, figures: search for figures.")
+   parser.add_argument('value', help="The comic abbreviation, comic id or figure search string.")
+   parser.add_argument('--html', action='store_true', help="If provided, print the html of the comic pages.")
+   parser.add_argument('--repeat', type=int, default=1, help="Run the lookup this many times and print the fastest time.")
+   args = parser.parse_args()
+
+   conn = openSqlite(args.database)
+   value = args.value.decode('latin-1')
+   lookup = {'comic': searchForComic, 'comicid': getComic, 'figures': searchForFigures}[args.lookup]
+   times = []
+   for _ in range(max(args.repeat, 1)):
+      start = time.time()
+      result = lookup(conn, value)
+      times.append(time.time() - start)
+   conn.close()
+
+   if args.lookup == 'figures':
+      for name, link, dimension in result:
+         print ('%s (%s) %s' % (name, dimension, link) if dimension != 'standard' else '%s %s' % (name, link)).encode('latin-1')
+   else:
+      for comicid, abbreviation, full_name, appearances in result:
+         if args.html:
+            print renderComicPage(abbreviation, full_name, appearances).encode('latin-1')
+         else:
+            print ('%d %s, %s: %d appearances' % (comicid, abbreviation, full_name, len(appearances))).encode('latin-1')
+   print '%d results in %.2f ms%s' % (len(result), 1000*min(times), ' (fastest of %d)' % len(times) if len(times) > 1 else '')
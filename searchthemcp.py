@@ -11,168 +11,428 @@ Usage:
 """
 
 import os
-import datetime
 import re
+import datetime
 import json
 import argparse
 
-from mcparser import MCPFilesParser, DATADIR
-from mcpdb import MCPDB
+from mcparser import MCPFilesParser, Anomalies, AnomalyLog, DATADIR
+from mcpdb import MCPDB, tsvRows
+from mcpids import IdRegistry, IDSFILE
+from mcppages import iterPages, writePages, PAGESDIR
+from mcpprofile import Profiler, instrumentParser
+from mcpsqlite import loadSqlite, SQLITEFILE
+from mcpsnapshot import SnapshotWriter, iterSnapshot, getSnapshotPath, SNAPSHOTFILE
+from mcpautocomplete import getAutoCompletionDict, getAutoCompletionShards, getAutoCompletionTrie, compareAutoCompletionFormats
+
+# The tab separated table files, also used as the base of the delta sql files of the next build
+TSV_FILES = {'mcp_comics': 'comics.tsv', 'mcp_comics_fullname': 'comics_fullname.tsv', 'mcp_figures': 'figures.tsv',
+             'mcp_figures_trigram': 'figures_trigram.tsv', 'mcp_comics_page': 'comics_page.tsv'}
+# The tables of the normalized comic table, only created with normalized=True
+NORMALIZED_TSV_FILES = {'mcp_entries': 'entries.tsv', 'mcp_entry_comics': 'entry_comics.tsv'}
+# The tables in the order of the sql files, with the start of the sql file names
+SQL_FILES = [('mcp_comics', 'comics'), ('mcp_comics_fullname', 'comics_fullname'), ('mcp_figures', 'figures'),
+             ('mcp_figures_trigram', 'figures_trigram'), ('mcp_comics_page', 'comics_page'),
+             ('mcp_entries', 'entries'), ('mcp_entry_comics', 'entry_comics')]
+
+re_build_dir = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def getPreviousBuildDir(outputdir):
+   """Return the latest build directory in DATADIR before @outputdir with all tab separated table files, or None"""
+   builds = [d for d in os.listdir(DATADIR) if re_build_dir.match(d) and d < os.path.basename(outputdir)]
+   for d in sorted(builds, reverse=True):
+      if all([os.path.isfile(os.path.join(DATADIR, d, f)) for f in TSV_FILES.values()]):
+         return os.path.join(DATADIR, d)
+   return None
+
+def spoolRows(out, rows, profiler, counter):
+   """Write the tab separated @rows to the file @out and count them as @counter of the profiler"""
+   rows = list(rows)
+   profiler.count(counter, len(rows))
+   out.writelines(rows)
 
-def getAutoCompletionDict(comics, limit=44):
+def spoolFigures(db, figures_and_comics, spool_files, snapshot, anomaly_log, profiler, normalized=False):
    """
-   Create a map between a string and a list of matching comics:
+   Write the table rows of each figure to the files @spool_files (table name mapped to path) as soon as it is
+   parsed, and add it to the SnapshotWriter @snapshot if given. The comic pages are not written, see spoolComicPages.
+   """
+   spool = dict([(t, open(spool_files[t], 'wb')) for t in spool_files])
+   written = set()
+   try:
+      for f, appearances in figures_and_comics:
+         profiler.count('figures')
+         if snapshot:
+            snapshot.add(f, appearances)
+         spoolRows(spool['mcp_figures'], db.generateTsvForFigures([f]), profiler, 'rows mcp_figures')
+         spoolRows(spool['mcp_figures_trigram'], db.generateTsvForFigureTrigrams([f]), profiler, 'rows mcp_figures_trigram')
+         spoolRows(spool['mcp_comics'], db.generateTsvForAppearances(f['id'], appearances), profiler, 'rows mcp_comics')
+         if normalized:
+            spoolRows(spool['mcp_entries'], db.generateTsvForEntries([f]), profiler, 'rows mcp_entries')
+            spoolRows(spool['mcp_entry_comics'], db.generateTsvForEntryComics([f]), profiler, 'rows mcp_entry_comics')
+         del f['entries']
+         # The full name of the comics first found in this figure
+         for comic, appendix, a in appearances:
+            if not comic.id in written:
+               written.add(comic.id)
+               spoolRows(spool['mcp_comics_fullname'], db.generateTsvForComicsFullName({comic.abbreviation: comic}),
+                         profiler, 'rows mcp_comics_fullname')
+   finally:
+      for out in spool.values():
+         out.close()
+   if snapshot:
+      snapshot.close(anomaly_log)
 
-   {'A': [all comics starting with A],
-    'AA': [all comics starting with AA],
-    ...
-   }
-   
-   If there are more than @limit comics starting with the key string it is excluded from the map,
-   so 'A' will probably never be included if you don't use an extremly large limit.
-
-   Usage
-   -----
-   with open('file_listing_all_comics.txt', limit=100) as comics:
-       d = getAutoCompletionDict(comics)
-
-   Compression
-   -----------
-   Some tricks are used to make the map smaller:
-   * Only include the missing part of the string in the matching list.
-     Example: "GUN RUNNER ": ["1","2","3","4","5","6"]
-   * If the key contain exactly the same list of matching comics as a longer key, redirect to the longer key.
-     Example: "GUN RUNNER": "GUN R"
-   * Do not include exact matches.
-     Example: "GUN RUNNER 1": [""] is not included in the map
+def spoolComicPages(db, comics, spool_files):
+   """
+   Write the comic page table file. The comic pages need all appearances of a comic, they are read back
+   from the comic table file written by spoolFigures.
    """
+   with open(spool_files['mcp_comics'], 'rb') as comic_lines:
+      with open(spool_files['mcp_figures'], 'rb') as figure_lines:
+         with open(spool_files['mcp_comics_page'], 'wb') as out:
+            out.writelines(db.generateTsvForComicPages(comics, figure_lines, comic_lines))
 
-   def lensort(x,y):
-     if len(x) > len(y):
-       return 1
-     else:
-       return -1
-
-   d = dict()
-   for line in comics:
-      line = line.strip()
-      for i in range(1,len(line)+1):
-         if line[:i] in d:
-            d[line[:i]].append(line[i:])
-         else:
-            d[line[:i]] = [line[i:]]
-   dlimit = dict()
-   ckeys = d.keys()
-   ckeys.sort(cmp=lensort)
-   for k in ckeys:
-      v = d[k]
-      if len(v) > limit:
-         # Too many alternatives
-         continue
-      if len(v) == 1 and v[0] == "":
-         # Do not include exact matches, example: "GUN RUNNER 1":[""] is excluded from the dict
+def writeComicsList(outputdir, comics):
+   """Write comics.txt with the comics sorted by their sort key, return the sorted list"""
+   comics_str = comics.keys()
+   comics_str.sort(key=lambda c: comics[c].sortkey)
+   with open(os.path.join(outputdir, "comics.txt"), 'w') as comics_out:
+      for c in comics_str:
+         comics_out.write('%s\n' % c)
+   return comics_str
+
+def writeAutoCompletion(outputdir, comics_str, autocomplete_format='json', autocomplete_shard_length=1):
+   """Write the auto completion data of comics.txt in @autocomplete_format, see createFiles"""
+   autocomplete_limit = 44
+   with open(os.path.join(outputdir, "comics.txt")) as comics_in:
+      acd = getAutoCompletionDict(comics_in, autocomplete_limit)
+   if autocomplete_format == 'trie':
+      trie = getAutoCompletionTrie(comics_str)
+      with open(os.path.join(outputdir, "comicsAutoCompleteTrie.js"), 'w') as auto_comp_out:
+         auto_comp_out.write("var comicsTrie = %s;" % json.dumps({'limit': autocomplete_limit, 'data': trie}))
+      cmp_ = compareAutoCompletionFormats(acd, trie, autocomplete_limit)
+      print 'Auto completion size: json %d bytes, trie %d bytes (%.1f%%)' % (cmp_['json_size'], cmp_['trie_size'],
+                                                                             100.0*cmp_['trie_size']/max(cmp_['json_size'], 1))
+      print 'Auto completion load: json %.1f ms, trie %.1f ms' % (1000*cmp_['json_load'], 1000*cmp_['trie_load'])
+      print 'Auto completion lookup of %d prefixes (python decoders): json %.1f ms, trie %.1f ms' % (cmp_['queries'],
+                                                                                 1000*cmp_['json_lookup'],
+                                                                                 1000*cmp_['trie_lookup'])
+   elif autocomplete_format == 'shards':
+      manifest, shards = getAutoCompletionShards(acd, autocomplete_shard_length)
+      shardsdir = os.path.join(outputdir, "comicsAutoComplete")
+      if not os.path.isdir(shardsdir):
+         os.mkdir(shardsdir)
+      for prefix, shard in shards.iteritems():
+         with open(os.path.join(shardsdir, manifest['shards'][prefix]), 'w') as shard_out:
+            shard_out.write(json.dumps(shard))
+      with open(os.path.join(outputdir, "comicsAutoCompleteManifest.js"), 'w') as manifest_out:
+         manifest_out.write("var comicsManifest = %s;" % json.dumps(manifest))
+   else:
+      acd = json.dumps(acd)
+      with open(os.path.join(outputdir, "comicsAutoComplete.js"), 'w') as auto_comp_out:
+         auto_comp_out.write("var comics = %s;" % acd)
+
+def writeSql(gen, outputdir, file_name, max_size):
+   """Write the statements to numbered files of at most max_size, return the total size"""
+   s = 0
+   n = 0
+   total = 0
+
+   sql_out = open(os.path.join(outputdir, "%s#%d.txt" % (file_name, n)), 'w')
+   for sql in gen:
+      sql_ = '%s;\n' % sql
+      if s and s + len(sql_) > max_size:
+         s = 0
+         n += 1
+         sql_out.close()
+         sql_out = open(os.path.join(outputdir, "%s#%d.txt" % (file_name, n)), 'w')
+      s += len(sql_)
+      total += len(sql_)
+      sql_out.write(sql_)
+   sql_out.close()
+   return total
+
+def writeFullSql(db, outputdir, sql_files, spool_files, max_size, profiler, shadow=False, normalized=False):
+   """Write the sql files of the tables in @sql_files from their table files, return the table name mapped to the size"""
+   full_size = dict()
+   for t, name in sql_files:
+      with profiler.phase('sql ' + t):
+         with open(spool_files[t], 'rb') as rows:
+            full_size[t] = writeSql(db.generateSqlForTable(t, tsvRows(rows), shadow), outputdir, name + '_sql', max_size)
+   if shadow:
+      writeSql(db.generateSqlForShadowSwap([t for t, name in sql_files]), outputdir, 'swap_sql', max_size)
+   if normalized:
+      with profiler.phase('sql mcp_comics_view'):
+         writeSql(db.generateSqlForComicsView('mcp_comics_view'), outputdir, 'comics_view_sql', max_size)
+   return full_size
+
+def writeDeltaSql(db, outputdir, previousdir, sql_files, tsv_files, spool_files, full_size, max_size, profiler):
+   """Write the delta sql files of the tables in @sql_files against the table files in @previousdir"""
+   print 'Delta against the build in %s' % previousdir
+   for t, name in sql_files:
+      if not os.path.isfile(os.path.join(previousdir, tsv_files[t])):
+         print 'No %s in %s, import the full sql files for %s' % (tsv_files[t], previousdir, t)
          continue
-      else:
-         for i in range(1,len(k)):
-            if k[:i] in dlimit and len(dlimit[k[:i]]) == len(v):
-               # If the matches list is the same, redirect, example: "GUN RUNNER":"GUN R"
-               dlimit[k] = k[:i]
-               break
-      if not k in dlimit:
-         dlimit[k] = v
-   
-   return dlimit
+      stats = dict()
+      with profiler.phase('delta ' + t):
+         with open(os.path.join(previousdir, tsv_files[t]), 'rb') as previous:
+            with open(spool_files[t], 'rb') as rows:
+               delta_size = writeSql(db.generateSqlDeltaForTable(t, tsvRows(rows), previous, stats), outputdir,
+                                     name + '_delta_sql', max_size)
+      changed = stats['inserted'] + stats['updated'] + stats['deleted']
+      print ('Delta %s: %d inserted, %d updated, %d deleted, %d unchanged rows (%.1f%% changed), '
+             'delta sql %d KB, full sql %d KB') % (t, stats['inserted'], stats['updated'], stats['deleted'], stats['unchanged'],
+                                                   100.0*changed/max(changed + stats['unchanged'], 1),
+                                                   delta_size/1024, full_size[t]/1024)
+
+def writeTsvFiles(db, outputdir, tsv_files, spool_files, sql_files, shadow=False, normalized=False):
+   """Give the table files their final names and write load_sql.txt"""
+   for t in tsv_files:
+      path = os.path.join(outputdir, tsv_files[t])
+      if os.name == 'nt' and os.path.exists(path):
+         # os.rename does not replace files on windows
+         os.remove(path)
+      os.rename(spool_files[t], path)
+   with open(os.path.join(outputdir, "load_sql.txt"), 'w') as load_out:
+      for sql in db.generateSqlLoadData(tsv_files, shadow):
+         load_out.write('%s;\n' % sql)
+      if shadow:
+         for sql in db.generateSqlForShadowSwap([t for t, name in sql_files]):
+            load_out.write('%s;\n' % sql)
+      if normalized:
+         for sql in db.generateSqlForComicsView('mcp_comics_view'):
+            load_out.write('%s;\n' % sql)
 
-def createFiles(update_source_files=False, sql_files_max_size=5):
+def createFiles(update_source_files=False, sql_files_max_size=5, autocomplete_format='json', autocomplete_shard_length=1,
+                jobs=1, use_cache=True, sql_insert_max_size=0, tsv=False,
+                delta=False, delta_from=None, compact_ids=False, pages=False, normalized=False,
+                profile=False, profile_phase=None, sqlite=False, from_snapshot=None, shadow=False):
    """
    Create all files needed for a searchthemcp update in the directory 'data/YYYY-MM-DD':
    
    * comicsAutoComplete.js    - Data used by the auto completion functionality
+                                (comicsAutoCompleteTrie.js if autocomplete_format is 'trie',
+                                 comicsAutoCompleteManifest.js and comicsAutoComplete/*.json if it is 'shards')
    * comics_sql.txt           - SQL statements for building the comics database
    * figures_sql.txt          - SQL statements for the characters database
+   * figures_trigram_sql.txt  - SQL statements for the trigram index used by the character search
+   * comics_page_sql.txt      - SQL statements for the comic pages, everything shown for a comic in one row
    * comics_fullname_sql.txt  - SQL statements for the comics full name database
    
+   If tsv is True, also create the tables as tab separated files for LOAD DATA LOCAL INFILE:
+   * comics.tsv, figures.tsv, comics_fullname.tsv,
+     figures_trigram.tsv, comics_page.tsv         - The rows of the five tables
+   * load_sql.txt                                 - SQL statements that create and load the tables
+                                                    (run with 'mysql --local-infile=1' in the output directory)
+
+   If delta is True, also create SQL statements that only update the rows that have changed since the previous build:
+   * comics_delta_sql.txt, comics_fullname_delta_sql.txt, figures_delta_sql.txt, figures_trigram_delta_sql.txt,
+     comics_page_delta_sql.txt
+   The tab separated files are then always created, so the build can be the base of the next delta.
+
    Also create:
-   * comics.txt    - List of all found comics.
-   * anomalies.txt - List of anomalies.
+   * comics.txt       - List of all found comics.
+   * anomalies.txt    - List of anomalies.
+   * snapshot.marshal - The parse result, see mcpsnapshot. Give the build directory as from_snapshot to create the
+                        files again without parsing the mcp files.
+
+   If shadow is True, the sql files and load_sql.txt load the new tables mcp_*_new instead of emptying the
+   live tables, and the indexes are added after the rows. Then create:
+   * swap_sql.txt  - SQL statements that replace the live tables with the new tables at once and drop the old tables.
+                     Import it after all other sql files.
+
+   If sqlite is True, also create:
+   * mcp.sqlite    - The tables in a SQLite database, for checking the build and its query times with mcpsqlite.py.
+
+   If profile is True, also create:
+   * profile.json  - Wall time, CPU time and peak memory of each phase of the build, see mcpprofile.Profiler.
+
+   The figure and comic ids are kept in the id registry data/ids.json, so the same figure or comic gets
+   the same id in every build.
+
+   If normalized is True, also create the comic table as an entry table and an entry comic table,
+   with a view that has the columns of the comic table:
+   * entries_sql.txt, entry_comics_sql.txt - SQL statements for the tables (and entries.tsv, entry_comics.tsv)
+   * comics_view_sql.txt                   - SQL statements for the view mcp_comics_view
+
+   If pages is True, also render the comic pages to gzip compressed html files in data/pages,
+   see mcppages. The directory is kept between builds and only the changed pages are written.
+
+   The table rows are written to the tab separated files while the figures are parsed, and the SQL
+   statements are then generated from the files, so the chronology lists and appearances of all
+   figures are never in memory at the same time. The comic pages and the delta statements need the rows
+   sorted by comic id and by key, the files are sorted with mcpdb.sortLines in chunks of
+   mcpdb.SORT_CHUNK_LINES lines. What stays in memory is the mcparser.Comic of every comic, the name,
+   link and dimension of every figure for the comic pages, the comic ids already written and one chunk.
 
    Parameters
    ----------
 
    * update_source_files: If True, download all mcp html files to data/mcp/.
    * sql_files_max_size:  Max size in MB of the SQL statements files.
+   * autocomplete_format: 'json' for the auto completion dict, 'trie' for the serialized comic trie
+                          decoded by web/autocomplete/comictrie.js, 'shards' for the auto completion
+                          dict split in files that are loaded when needed.
+   * autocomplete_shard_length: Length of the key prefix that decides the shard of a key.
+   * jobs:                Number of processes used for parsing the mcp files and rendering the pages.
+   * use_cache:           If True, reuse the parse result of mcp files that have not changed since the last run.
+   * sql_insert_max_size: Max size in KB of a multi-row INSERT statement. 0 gives one INSERT statement per row.
+   * tsv:                 If True, also create the tab separated files and the LOAD DATA statements.
+   * delta:               If True, also create the delta SQL statements files.
+   * delta_from:          Build directory to compare with. If not given, the latest previous build in data/ with
+                          tab separated files.
+   * compact_ids:         If True, number all figures and comics from 0 in file order, as in the first build,
+                          and forget the ids of removed figures and comics. All ids can change, so the tables
+                          must be reloaded with the full sql files.
+   * pages:               If True, also render the static comic pages, in @jobs processes.
+   * normalized:          If True, also create the normalized comic tables and the view mcp_comics_view.
+   * shadow:              If True, load new tables and swap them with the live tables when all are loaded.
+   * sqlite:              If True, also load the tables into a local SQLite database.
+   * from_snapshot:       Build directory or snapshot file of an earlier build. If given, the figures and comics
+                          are read from its snapshot instead of parsing the mcp files, and the id registry is
+                          not used.
+   * profile:             If True, print and save the time and memory used by each phase.
+   * profile_phase:       Also run cProfile on this phase and write the statistics to profile_<phase>.pstats.
    """
+   if from_snapshot and (update_source_files or compact_ids):
+      raise ValueError('The mcp files can not be downloaded or the ids compacted when the snapshot %r is used' % from_snapshot)
+   profiler = Profiler(profile, profile_phase)
    parser = MCPFilesParser()
-   
-   def comicSorter(x,y):
-      def fixNr(c):
-         abbr,nr = parser._getAbbreviationAndNumber(c)
-         if nr:
-            m = re.search(r'^(\d*)', nr)
-            if m:
-               base_nr = m.group(1)
-               return '%s %s%s' % (abbr, '0'*(4-len(base_nr)), nr)
-         return c
-      x = fixNr(x)
-      y = fixNr(y)
-      
-      if x > y:
-         return 1
-      elif y > x:
-         return -1
-      else:
-         return 0
+   instrumentParser(profiler, parser)
    
    if update_source_files:
-      parser.updateMCPFiles()
-   figures,comics,anomalies = parser.getFiguresAndComics(verbose=True)
+      with profiler.phase('download'):
+         parser.updateMCPFiles()
+   # The ids in a snapshot are already assigned
+   registry = IdRegistry() if not from_snapshot else None
+   if compact_ids:
+      print 'Compacting the id registry with %d figure ids and %d comic ids' % registry.compact()
    
    outputdir = os.path.join(DATADIR, datetime.datetime.now().strftime('%Y-%m-%d'))
    if not os.path.isdir(outputdir):
       os.mkdir(outputdir)
    
-   with open(os.path.join(outputdir, "anomalies.txt"), 'w') as anom_out:
-      anom_out.write(str(anomalies))
+   max_size = sql_files_max_size*1024*1024
    
-   comics_str = comics.keys()
-   comics_str.sort(cmp=comicSorter)
-   with open(os.path.join(outputdir, "comics.txt"), 'w') as comics_out:
-      for c in comics_str:
-         comics_out.write('%s\n' % c)
+   # An INSERT statement must fit in one sql file, including the ';\n' added by writeSql
+   max_insert_size = min(sql_insert_max_size*1024, max_size - 2) if sql_insert_max_size else 0
+   db = MCPDB('mcp_figures', 'mcp_comics', 'mcp_comics_fullname', 'mcp_figures_trigram', 'mcp_comics_page',
+              'mcp_entries', 'mcp_entry_comics', max_insert_size)
+   tsv_files = dict(TSV_FILES)
+   if normalized:
+      tsv_files.update(NORMALIZED_TSV_FILES)
+   sql_files = [(t, name) for t, name in SQL_FILES if t in tsv_files]
    
-   with open(os.path.join(outputdir, "comics.txt")) as comics_in:
-      acd = getAutoCompletionDict(comics_in)
-   acd = json.dumps(acd)
-   with open(os.path.join(outputdir, "comicsAutoComplete.js"), 'w') as auto_comp_out:
-      auto_comp_out.write("var comics = %s;" % acd)
+   # The table files get their final names when the build is done, the previous build can be in the same directory.
+   spool_files = dict([(t, os.path.join(outputdir, tsv_files[t] + '.part')) for t in tsv_files])
+   comics = dict()
+   # The anomalies are logged in the order they are found, so the snapshot gives the same anomalies.txt
+   anomaly_log = AnomalyLog()
+   if from_snapshot:
+      print 'Reading the figures and comics from %s' % getSnapshotPath(from_snapshot)
+      figures_and_comics = iterSnapshot(getSnapshotPath(from_snapshot), comics, anomaly_log)
+      snapshot = None
+   else:
+      figures_and_comics = parser.iterFiguresAndComics(comics, anomaly_log, verbose=True, jobs=jobs, cache=use_cache,
+                                                       registry=registry)
+      snapshot = SnapshotWriter(os.path.join(outputdir, SNAPSHOTFILE))
+   # One phase for the whole loop, the parsing of the figures is in it. A phase per figure would cost
+   # more than the work in it, the figures and rows are only counted.
+   with profiler.phase('parse and spool'):
+      spoolFigures(db, figures_and_comics, dict([(t, spool_files[t]) for t in spool_files if t != 'mcp_comics_page']),
+                   snapshot, anomaly_log, profiler, normalized)
+   with profiler.phase('anomalies'):
+      anomalies = Anomalies()
+      anomaly_log.replay(anomalies)
+      with open(os.path.join(outputdir, "anomalies.txt"), 'w') as anom_out:
+         anom_out.write(str(anomalies))
+   with profiler.phase('comic pages'):
+      spoolComicPages(db, comics, spool_files)
+   if registry:
+      print 'Id registry %s: %d figure ids and %d comic ids no longer used' % ((IDSFILE,) + registry.getUnusedCounts())
    
-   db = MCPDB('mcp_figures', 'mcp_comics', 'mcp_comics_fullname')
+   with profiler.phase('sort'):
+      comics_str = writeComicsList(outputdir, comics)
+   with profiler.phase('autocomplete'):
+      writeAutoCompletion(outputdir, comics_str, autocomplete_format, autocomplete_shard_length)
    
-   max_size = sql_files_max_size*1024*1024
+   full_size = writeFullSql(db, outputdir, sql_files, spool_files, max_size, profiler, shadow, normalized)
+   if delta:
+      previousdir = delta_from or getPreviousBuildDir(outputdir)
+      if previousdir is None:
+         print 'No previous build with tab separated files found in %s, no delta sql files created' % DATADIR
+      else:
+         writeDeltaSql(db, outputdir, previousdir, sql_files, tsv_files, spool_files, full_size, max_size, profiler)
+   
+   if pages:
+      with profiler.phase('pages'):
+         with open(spool_files['mcp_comics_page'], 'rb') as page_lines:
+            stats = writePages(iterPages(tsvRows(page_lines)), jobs=jobs)
+      print 'Static pages in %s: %d written, %d unchanged, %d removed' % (PAGESDIR, stats['written'], stats['unchanged'],
+                                                                           stats['removed'])
+   
+   if sqlite:
+      with profiler.phase('sqlite'):
+         loadSqlite(os.path.join(outputdir, SQLITEFILE), db, spool_files, verbose=True)
+   
+   if tsv or delta:
+      writeTsvFiles(db, outputdir, tsv_files, spool_files, sql_files, shadow, normalized)
+   else:
+      for t in tsv_files:
+         os.remove(spool_files[t])
    
-   def writeSql(gen, file_name):
-      s = 0
-      n = 0
-      
-      sql_out = open(os.path.join(outputdir, "%s#%d.txt" % (file_name, n)), 'w')
-      for sql in gen:
-         sql_ = '%s;\n' % sql
-         if s + len(sql_) > max_size:
-            s = 0
-            n += 1
-            sql_out.close()
-            sql_out = open(os.path.join(outputdir, "%s#%d.txt" % (file_name, n)), 'w')
-         s += len(sql_)
-         sql_out.write(sql_)
-      sql_out.close()
+   if registry:
+      registry.save()
    
-   writeSql(db.generateSqlForComics(comics), 'comics_sql')
-   writeSql(db.generateSqlForComicsFullName(comics), 'comics_fullname_sql')
-   writeSql(db.generateSqlForFigures(figures), 'figures_sql')
+   if profiler.enabled:
+      print '\n'.join(profiler.formatReport())
+      if jobs > 1:
+         print 'The mcp files parsed in the worker processes are not in the figures phases, profile with --jobs 1'
+      profiler.save(os.path.join(outputdir, 'profile.json'))
+      if profile_phase is not None:
+         path = os.path.join(outputdir, 'profile_%s.pstats' % profile_phase.replace(' ', '_'))
+         print profiler.saveCProfile(path)
+         print 'cProfile statistics of %r written to %s' % (profile_phase, path)
    
 if __name__ == '__main__':
    parser = argparse.ArgumentParser(description='Generate all files needed for an update of the mcp search.')
    parser.add_argument('--download', action='store_true', help="If provided, download mcp files.")
    parser.add_argument('--maxsqlsize', type=int, default=5, help="Max size (Mb) of the sql statement files.")
+   parser.add_argument('--autocompleteformat', choices=['json', 'trie', 'shards'], default='json',
+                       help="Format of the auto completion data, the trie is smaller but needs comictrie.js.")
+   parser.add_argument('--autocompleteshardlength', type=int, choices=[1, 2], default=1,
+                       help="Shard the auto completion data by the first one or two characters.")
+   parser.add_argument('--jobs', type=int, default=1, help="Number of processes used for parsing the mcp files.")
+   parser.add_argument('--nocache', action='store_true', help="If provided, parse all mcp files even if they have not changed.")
+   parser.add_argument('--maxinsertsize', type=int, default=0,
+                       help="Max size (Kb) of a multi-row INSERT statement. If not provided, one INSERT statement per row.")
+   parser.add_argument('--tsv', action='store_true',
+                       help="If provided, also create tab separated table files and LOAD DATA statements for a bulk load.")
+   parser.add_argument('--delta', action='store_true',
+                       help="If provided, also create sql statements for only the rows changed since the previous build.")
+   parser.add_argument('--deltafrom', default=None,
+                       help="Build directory to compare with, default is the latest previous build in data/.")
+   parser.add_argument('--compactids', action='store_true',
+                       help="If provided, renumber all figure and comic ids from 0. The tables must then be fully reloaded.")
+   parser.add_argument('--pages', action='store_true',
+                       help="If provided, also render the comic pages to static gzip compressed html files.")
+   parser.add_argument('--normalized', action='store_true',
+                       help="If provided, also create the comic table as normalized entry tables with a view.")
+   parser.add_argument('--shadow', action='store_true',
+                       help="If provided, load new tables and swap them with the live tables at once with swap_sql.txt.")
+   parser.add_argument('--fromsnapshot', default=None,
+                       help="Build directory or snapshot file to read the figures and comics from instead of parsing the mcp files.")
+   parser.add_argument('--sqlite', action='store_true',
+                       help="If provided, also load the tables into a SQLite database for testing with mcpsqlite.py.")
+   parser.add_argument('--profile', action='store_true',
+                       help="If provided, print and save the time and memory used by each phase of the build.")
+   parser.add_argument('--profilephase', default=None,
+                       help="Also run cProfile on the phases with this name or starting with it, for example 'sql'.")
    args = parser.parse_args()
-   createFiles(update_source_files=args.download, sql_files_max_size=args.maxsqlsize)
+   createFiles(update_source_files=args.download, sql_files_max_size=args.maxsqlsize,
+               autocomplete_format=args.autocompleteformat, autocomplete_shard_length=args.autocompleteshardlength,
+               jobs=args.jobs, use_cache=not args.nocache, sql_insert_max_size=args.maxinsertsize,
+               tsv=args.tsv, delta=args.delta or args.deltafrom is not None, delta_from=args.deltafrom,
+               compact_ids=args.compactids, pages=args.pages,
+               normalized=args.normalized, profile=args.profile, profile_phase=args.profilephase,
+               sqlite=args.sqlite, from_snapshot=args.fromsnapshot, shadow=args.shadow)
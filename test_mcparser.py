@@ -0,0 +1,300 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Tests of MCPFilesParser.
+
+* TestUpdateMCPFiles - The downloads, against a local http server with fixture pages.
+* TestSingleFigures  - The figures with their chronology list on their own page, on synthetic mcp files.
+* TestClean          - _clean against the implementation it replaced, on all strings cleaned when parsing data/mcp,
+                       or synthetic mcp files if there are none.
+
+Usage
+-----
+$ python -m unittest test_mcparser
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+import BaseHTTPServer
+import SocketServer
+
+from mcparser import MCPFilesParser, MCPFILESDIR
+from mcpcorpus import generateCorpus
+
+# The fixture pages served for every mcp file, alternate.php has the expand-collapse coding that is removed
+FIXTURE_PAGE = '<html>\n<body>\n%s\n</body></html>\n'
+FIXTURE_ALTERNATE = ('<html>\r\n<body>\r\n<div id="alt1">\r\n<p><hr></p>\r\n<b>ALTERNATE FIGURE</b><br>\r\n'
+                     'A 1<br>\r\n</span></div>\r\n</body></html>\r\n')
+FIXTURE_ALTERNATE_CLEANED = '<html>\r\n<body>\r\n<b>ALTERNATE FIGURE</b><br>\r\nA 1<br>\r\n</body></html>\r\n'
+
+def getMCPFileNames():
+   """Return the names of all files downloaded by MCPFilesParser.updateMCPFiles"""
+   p = MCPFilesParser
+   return [f + p.FILEEND for f in p.MCPFILES + [p.KEYFILE] + [u for _,u in p.SINGLEFIGURES] + [u for u,_ in p.MCPDIMENSIONS]]
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+   """
+   Serve the fixture pages of the server with ETag and Last-Modified, and 304 to conditional requests
+   with the current ETag. The server's @errors (file name mapped to a list of status codes) are returned before
+   the page, and the files in @truncated are cut off after half of the announced length.
+   """
+
+   def do_GET(self):
+      f = self.path.lstrip('/')
+      server = self.server
+      with server.lock:
+         server.requests.append((f, self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')))
+         errors = server.errors.get(f)
+         code = errors.pop(0) if errors else None
+      if code is not None:
+         self.send_error(code)
+         return
+      if not f in server.pages:
+         self.send_error(404)
+         return
+      body, etag = server.pages[f]
+      if self.headers.get('If-None-Match') == etag:
+         self.send_response(304)
+         self.end_headers()
+         return
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/html')
+      self.send_header('Content-Length', str(len(body)))
+      self.send_header('ETag', etag)
+      self.send_header('Last-Modified', 'Sun, 18 Oct 2026 12:00:00 GMT')
+      self.end_headers()
+      self.wfile.write(body[:len(body)//2] if f in server.truncated else body)
+
+   def log_message(self, *args):
+      pass
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+   daemon_threads = True
+
+   def __init__(self):
+      BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FixtureHandler)
+      self.lock = threading.Lock()
+      self.requests = []
+      self.errors = dict()
+      self.truncated = set()
+      self.pages = dict()
+      for f in getMCPFileNames():
+         self.setPage(f, FIXTURE_PAGE % f)
+      self.setPage('alternate.php', FIXTURE_ALTERNATE)
+
+   def setPage(self, f, body, etag=None):
+      self.pages[f] = (body, etag or '"%s-%d"' % (f, len(body)))
+
+   def getRequests(self, f):
+      return [r for r in self.requests if r[0] == f]
+
+re_tag = re.compile(r'<[^>]*?>')
+re_to_remove = re.compile(r'[\[\{\}\]]')
+re_cf = re.compile(r'\|\s*cf[^\|]+(\||$)')
+figure_redirections = ["(~", "(See", "See", "(From","From", "Note", "Caution", "(may continue","may continue","between"]
+
+def referenceClean(rawstr, isComic=True):
+   """The previous MCPFilesParser._clean, with a replace or a pattern for each html entity and each separator"""
+
+   # Remove html tags
+   cleanstr = re_tag.sub('',rawstr)
+
+   replacements = {"&lt;":"<",
+                   "&gt;":">",
+                   "&amp;":"&",
+                   "&quot;":'"',
+                   "&and;":"&",
+                   "&Ntilde;":"\xd1",
+                   '\n':'',
+                   '&hearts;':'HEART', # TODO, unicode
+                   '&infin;': 'INFINITY'}
+
+   # Replace html entities etc
+   for torepl,repl in replacements.items():
+      cleanstr = cleanstr.replace(torepl,repl)
+   rawstr = re.sub(' +', ' ', cleanstr.strip())
+
+   figure_redirect = ''
+   if isComic:
+      cleanstr = re_cf.sub('',cleanstr)
+      extra_repl = {" | ":" ~ ", " & ":" ~ ", "=":" ~ "}
+      for torepl,repl in extra_repl.items():
+         cleanstr = cleanstr.replace(torepl,repl)
+
+      cleanstr = re_to_remove.sub('',cleanstr)
+      for r in figure_redirections:
+         i = cleanstr.find(r)
+         if i != -1:
+            figure_redirect = cleanstr[i:] + figure_redirect
+            cleanstr = cleanstr[:i]
+
+      cleanstr = cleanstr.strip()
+      cleanstr = re.sub(' +', ' ', cleanstr)
+      comics = cleanstr.split(" ~ ")
+
+      return comics, rawstr, figure_redirect
+
+   return rawstr
+
+class TestUpdateMCPFiles(unittest.TestCase):
+
+   def setUp(self):
+      # The requests to localhost must not go through a proxy from the environment
+      urllib2.install_opener(urllib2.build_opener(urllib2.ProxyHandler({})))
+      self.server = FixtureServer()
+      self.thread = threading.Thread(target=self.server.serve_forever)
+      self.thread.daemon = True
+      self.thread.start()
+      self.baseurl = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+      self.mcpfilesdir = tempfile.mkdtemp(prefix='mcpfiles')
+      self.parser = MCPFilesParser(mcpfilesdir=self.mcpfilesdir, cachedir=os.path.join(self.mcpfilesdir, 'cache'))
+
+   def tearDown(self):
+      self.server.shutdown()
+      self.server.server_close()
+      shutil.rmtree(self.mcpfilesdir, ignore_errors=True)
+      urllib2.install_opener(None)
+
+   def update(self, retries=3):
+      self.parser.updateMCPFiles(verbose=False, retries=retries, backoff=0, baseurl=self.baseurl)
+
+   def read(self, f):
+      with open(os.path.join(self.mcpfilesdir, f), 'rb') as inp:
+         return inp.read()
+
+   def testDownload(self):
+      self.update()
+      for f in getMCPFileNames():
+         if f != 'alternate.php':
+            self.assertEqual(self.read(f), FIXTURE_PAGE % f)
+      manifest = self.parser._readDownloadManifest()
+      self.assertEqual(manifest['a.php'], {'etag': '"a.php-%d"' % len(FIXTURE_PAGE % 'a.php'),
+                                           'last_modified': 'Sun, 18 Oct 2026 12:00:00 GMT'})
+
+   def testNotModified(self):
+      self.update()
+      # Date the files back, a file that is written again gets a new modification time
+      paths = [os.path.join(self.mcpfilesdir, f) for f in ['a.php', 'alternate.php', MCPFilesParser.DOWNLOADMANIFEST]]
+      for path in paths:
+         os.utime(path, (1000000000, 1000000000))
+      contents = [self.read(os.path.basename(path)) for path in paths]
+      del self.server.requests[:]
+      self.update()
+      requests = self.server.getRequests('a.php')
+      self.assertEqual(requests, [('a.php', '"a.php-%d"' % len(FIXTURE_PAGE % 'a.php'), 'Sun, 18 Oct 2026 12:00:00 GMT')])
+      self.assertEqual([self.read(os.path.basename(path)) for path in paths], contents)
+      self.assertEqual([os.path.getmtime(path) for path in paths], [1000000000]*len(paths))
+
+   def testChangedFile(self):
+      self.update()
+      self.server.setPage('b.php', 'changed')
+      self.update()
+      self.assertEqual(self.read('b.php'), 'changed')
+      self.assertEqual(self.parser._readDownloadManifest()['b.php']['etag'], '"b.php-7"')
+
+   def testServerErrorIsRetried(self):
+      self.server.errors['c.php'] = [503, 500]
+      self.update(retries=3)
+      self.assertEqual(len(self.server.getRequests('c.php')), 3)
+      self.assertEqual(self.read('c.php'), FIXTURE_PAGE % 'c.php')
+
+   def testClientErrorIsNotRetried(self):
+      self.server.errors['c.php'] = [404]
+      self.assertRaises(IOError, self.update, 3)
+      self.assertEqual(len(self.server.getRequests('c.php')), 1)
+
+   def testFailedDownloadLeavesNoPartialFile(self):
+      self.update()
+      old_manifest = self.parser._readDownloadManifest()
+      self.server.setPage('d.php', FIXTURE_PAGE % 'changed d.php')
+      self.server.setPage('e.php', FIXTURE_PAGE % 'changed e.php')
+      self.server.truncated.add('d.php')
+      self.server.errors['e.php'] = [500, 500, 500]
+      self.assertRaises(IOError, self.update, 2)
+      self.assertEqual(len(self.server.getRequests('d.php')), 1 + 3)
+      self.assertEqual(self.read('d.php'), FIXTURE_PAGE % 'd.php')
+      self.assertEqual(self.read('e.php'), FIXTURE_PAGE % 'e.php')
+      self.assertEqual([f for f in os.listdir(self.mcpfilesdir) if f.endswith('.tmp')], [])
+      manifest = self.parser._readDownloadManifest()
+      self.assertEqual(manifest['d.php'], old_manifest['d.php'])
+      self.assertEqual(manifest['e.php'], old_manifest['e.php'])
+
+   def testFailedFirstDownloadLeavesNoFile(self):
+      self.server.truncated.add('f.php')
+      self.assertRaises(IOError, self.update, 0)
+      self.assertFalse(os.path.exists(os.path.join(self.mcpfilesdir, 'f.php')))
+      self.assertFalse('f.php' in self.parser._readDownloadManifest())
+
+   def testAlternateUniversesCleaned(self):
+      self.update()
+      self.assertEqual(self.read('alternate.php'), FIXTURE_ALTERNATE_CLEANED)
+      # Not modified, the cleaned file is kept as it is
+      self.update()
+      self.assertEqual(self.read('alternate.php'), FIXTURE_ALTERNATE_CLEANED)
+      self.server.setPage('alternate.php', FIXTURE_ALTERNATE.replace('A 1', 'A 2'), '"alternate 2"')
+      self.update()
+      self.assertEqual(self.read('alternate.php'), FIXTURE_ALTERNATE_CLEANED.replace('A 1', 'A 2'))
+
+class TestSingleFigures(unittest.TestCase):
+
+   def setUp(self):
+      self.mcpfilesdir = tempfile.mkdtemp(prefix='mcpfiles')
+      generateCorpus(self.mcpfilesdir, figures=100, list_length=5)
+      self.parser = MCPFilesParser(mcpfilesdir=self.mcpfilesdir, cachedir=os.path.join(self.mcpfilesdir, 'cache'))
+
+   def tearDown(self):
+      shutil.rmtree(self.mcpfilesdir, ignore_errors=True)
+
+   def testSingleFigure(self):
+      fig_list, link, f = self.parser._getSingleFigureFileList('<b>HULK Chronology Page</b>')
+      self.assertEqual((link, f), (MCPFilesParser.BASEURL + 'hulk.php', 'hulk'))
+      self.assertTrue(fig_list)
+      self.assertEqual(self.parser._getSingleFigureFileList('<b>HULKLING</b>'), (None, None, None))
+
+   def testListOrder(self):
+      # The first name in SINGLEFIGURES wins, not the leftmost one in the line
+      name_line = 'STORM Chronology Page, see also CAPTAIN AMERICA Chronology Page and HULK Chronology Page'
+      self.assertEqual(self.parser._getSingleFigureFileList(name_line)[2], 'capa')
+      self.assertEqual(self.parser._getSingleFigureFileList('HULK Chronology Page / STORM Chronology Page')[2], 'hulk')
+
+class TestClean(unittest.TestCase):
+
+   def testEntities(self):
+      parser = MCPFilesParser()
+      for rawstr in ['A 1 &amp; B 2', 'A 1 &amp;gt; B', 'A 1 &amp;lt; B', 'A &and;gt; B', 'X&Ntilde;\nY &hearts;',
+                     '<i>A 1</i>\n (See <a href="#x">X</a>)', '[A 1] | cf B 2 | C 3', 'A 1=B 2', 'A  1 &quot;x&quot;']:
+         self.assertEqual(parser._clean(rawstr), referenceClean(rawstr))
+         self.assertEqual(parser._clean(rawstr, False), referenceClean(rawstr, False))
+
+   def assertSameClean(self, mcpfilesdir):
+      """Parse the mcp files in @mcpfilesdir and compare _clean with referenceClean on every string it gets"""
+      parser = MCPFilesParser(mcpfilesdir=mcpfilesdir, cachedir=os.path.join(mcpfilesdir, 'cache'))
+      clean = parser._clean
+      calls = []
+      def recordingClean(rawstr, isComic=True):
+         calls.append((rawstr, isComic))
+         return clean(rawstr, isComic)
+      parser._clean = recordingClean
+      parser.getFiguresAndComics(jobs=1, cache=False)
+      self.assertTrue(len(calls) > 1000)
+      for rawstr, isComic in calls:
+         self.assertEqual(clean(rawstr, isComic), referenceClean(rawstr, isComic), repr(rawstr))
+
+   def testMCPFiles(self):
+      if os.path.isfile(os.path.join(MCPFILESDIR, MCPFilesParser.KEYFILE + MCPFilesParser.FILEEND)):
+         self.assertSameClean(MCPFILESDIR)
+         return
+      # No downloaded mcp files, use synthetic ones
+      mcpfilesdir = tempfile.mkdtemp(prefix='mcpfiles')
+      try:
+         generateCorpus(mcpfilesdir, figures=2000)
+         self.assertSameClean(mcpfilesdir)
+      finally:
+         shutil.rmtree(mcpfilesdir, ignore_errors=True)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,122 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Compare getAutoCompletionDict with the implementation it replaced, on the comic list of synthetic mcp files,
+on the comics.txt of the latest build in data/ if there is one, and on small lists with the edge cases.
+
+Usage
+-----
+$ python -m unittest test_mcpautocomplete
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from mcparser import MCPFilesParser, DATADIR
+from mcpcorpus import generateCorpus
+from mcpautocomplete import getAutoCompletionDict
+
+re_build_dir = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def referenceAutoCompletionDict(comics, limit=44):
+   """The previous getAutoCompletionDict, building the matching list of every prefix"""
+
+   def lensort(x,y):
+     if len(x) > len(y):
+       return 1
+     else:
+       return -1
+
+   d = dict()
+   for line in comics:
+      line = line.strip()
+      for i in range(1,len(line)+1):
+         if line[:i] in d:
+            d[line[:i]].append(line[i:])
+         else:
+            d[line[:i]] = [line[i:]]
+   dlimit = dict()
+   ckeys = d.keys()
+   ckeys.sort(cmp=lensort)
+   for k in ckeys:
+      v = d[k]
+      if len(v) > limit:
+         # Too many alternatives
+         continue
+      if len(v) == 1 and v[0] == "":
+         # Do not include exact matches, example: "GUN RUNNER 1":[""] is excluded from the dict
+         continue
+      else:
+         for i in range(1,len(k)):
+            if k[:i] in dlimit and len(dlimit[k[:i]]) == len(v):
+               # If the matches list is the same, redirect, example: "GUN RUNNER":"GUN R"
+               dlimit[k] = k[:i]
+               break
+      if not k in dlimit:
+         dlimit[k] = v
+
+   return dlimit
+
+def getLatestComicsList():
+   """Return the path of comics.txt of the latest build in DATADIR, or None"""
+   if not os.path.isdir(DATADIR):
+      return None
+   for d in sorted([d for d in os.listdir(DATADIR) if re_build_dir.match(d)], reverse=True):
+      path = os.path.join(DATADIR, d, 'comics.txt')
+      if os.path.isfile(path):
+         return path
+   return None
+
+def getCorpusComicsList(figures=1000):
+   """Return the lines of comics.txt, as written by searchthemcp.py, of a synthetic set of mcp files"""
+   mcpfilesdir = tempfile.mkdtemp(prefix='mcpfiles')
+   try:
+      generateCorpus(mcpfilesdir, figures=figures)
+      parser = MCPFilesParser(mcpfilesdir=mcpfilesdir, cachedir=os.path.join(mcpfilesdir, 'cache'))
+      comics = parser.getFiguresAndComics()[1]
+   finally:
+      shutil.rmtree(mcpfilesdir, ignore_errors=True)
+   comics_str = comics.keys()
+   comics_str.sort(key=lambda c: comics[c].sortkey)
+   return ['%s\n' % c for c in comics_str]
+
+class TestAutoCompletionDict(unittest.TestCase):
+
+   def assertSameDict(self, comics, limit):
+      self.assertEqual(getAutoCompletionDict(comics, limit), referenceAutoCompletionDict(comics, limit))
+
+   def testCorpusComicsList(self):
+      comics = getCorpusComicsList()
+      self.assertTrue(len(comics) > 1000)
+      for limit in [44, 5, 1, 200]:
+         self.assertSameDict(comics, limit)
+
+   def testBuiltComicsList(self):
+      path = getLatestComicsList()
+      if path is None:
+         self.skipTest('No build with comics.txt in %s' % DATADIR)
+      with open(path) as inp:
+         comics = inp.readlines()
+      for limit in [44, 5, 1, 200]:
+         self.assertSameDict(comics, limit)
+
+   def testLimitOne(self):
+      self.assertSameDict(['A 1\n', 'A 2\n', 'AB 1\n', 'B\n'], 1)
+
+   def testDuplicatePrefixes(self):
+      comics = ['GUN RUNNER %d\n' % n for n in range(1, 7)] + ['GUN RUNNER 1\n', 'GUNS 1\n', 'GUNS 1\n']
+      for limit in [1, 2, 6, 44]:
+         self.assertSameDict(comics, limit)
+
+   def testOneCharacterTitles(self):
+      comics = ['A\n', 'B\n', 'B 1\n', 'C\n', 'C\n', 'X\n', 'XM 1\n']
+      for limit in [1, 2, 44]:
+         self.assertSameDict(comics, limit)
+
+   def testEmptyList(self):
+      self.assertSameDict([], 44)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: iso-8859-1 -*-
+"""
+Tests of MCPDB.
+
+* TestSortLines - sortLines, in one chunk and merged from many chunks.
+* TestSqlDelta  - The delta statements against the implementation they replaced, which kept both builds in dicts.
+
+Usage
+-----
+$ python -m unittest test_mcpdb
+"""
+
+import random
+import unittest
+
+from mcpdb import MCPDB, sortLines, tsvRows, tsvUnescape
+
+def getDB():
+   return MCPDB('mcp_figures', 'mcp_comics', 'mcp_comics_fullname', 'mcp_figures_trigram', 'mcp_comics_page',
+                'mcp_entries', 'mcp_entry_comics')
+
+def referenceSqlDelta(db, t, rows, previous):
+   """The previous MCPDB._sqlDelta, return the statements and the counts"""
+   create, columns, key = db._tables[t]
+   old = dict()
+   old_keys = []
+   for line in previous:
+      fields = line[:-1].split('\t')
+      k = tuple([tsvUnescape(fields[i]) for i in key])
+      if not k in old:
+         old[k] = []
+         old_keys.append(k)
+      old[k].append(line)
+   new = dict()
+   new_keys = []
+   for row in rows:
+      k = db._rowKey(key, row)
+      if not k in new:
+         new[k] = []
+         new_keys.append(k)
+      new[k].append(row)
+   counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+   sql = []
+   inserts = []
+   for k in new_keys:
+      new_rows = new[k]
+      old_lines = old.pop(k, [])
+      if old_lines == [db._tsvLine(row) for row in new_rows]:
+         counts['unchanged'] += len(new_rows)
+      elif len(old_lines) == 1 and len(new_rows) == 1:
+         sql.append(db._sqlUpdate(t, columns, key, new_rows[0]))
+         counts['updated'] += 1
+      else:
+         if old_lines:
+            sql.append(db._sqlDeleteRows(t, columns, key, k))
+            counts['deleted'] += len(old_lines)
+         inserts.extend(new_rows)
+         counts['inserted'] += len(new_rows)
+   for k in old_keys:
+      if k in old:
+         sql.append(db._sqlDeleteRows(t, columns, key, k))
+         counts['deleted'] += len(old[k])
+   sql.extend(db._sqlInsert(t, (db._sqlValues(row) for row in inserts)))
+   return sql, counts
+
+def getComicTables(seed, n=3000):
+   """Return the lines of a previous and a changed comic table, with keys in random order and duplicate keys"""
+   rnd = random.Random(seed)
+   db = getDB()
+   previous = []
+   for i in range(n):
+      row = (rnd.randint(0, n/10), 'ABC', rnd.choice(['', '-FB', '\\x']), rnd.randint(0, 50), rnd.randint(0, 5),
+             'raw %d\ttab' % i, 'ABC|1|', '', '', '', '')
+      previous.append(db._tsvLine(row))
+   lines = []
+   for line in previous:
+      r = rnd.random()
+      if r < 0.05:
+         continue
+      if r < 0.1:
+         line = line[:-1] + 'x\n'
+      lines.append(line)
+      if r > 0.98:
+         lines.append(line)
+   return previous, lines
+
+class TestSortLines(unittest.TestCase):
+
+   def assertSorted(self, lines, chunk_lines):
+      key = lambda line: line[0]
+      expected = [(key(line), line) for line in sorted(lines, key=key)]
+      self.assertEqual(list(sortLines(lines, key, chunk_lines)), expected)
+
+   def testOneChunk(self):
+      self.assertSorted(['b1', 'a1', 'b2', 'a2'], 10)
+
+   def testManyChunks(self):
+      rnd = random.Random(1)
+      lines = ['%s%d' % (rnd.choice('abcdef'), i) for i in range(1000)]
+      for chunk_lines in [1, 7, 100, 1000]:
+         self.assertSorted(lines, chunk_lines)
+
+   def testEmpty(self):
+      self.assertSorted([], 10)
+
+class TestSqlDelta(unittest.TestCase):
+
+   def assertSameDelta(self, t, rows, previous):
+      db = getDB()
+      stats = dict()
+      sql = list(db.generateSqlDeltaForTable(t, rows, previous, stats))
+      expected, counts = referenceSqlDelta(db, t, rows, previous)
+      self.assertEqual(sorted(sql), sorted(expected))
+      self.assertEqual(stats, counts)
+      # The DELETE statements first, then the UPDATE statements, then the INSERT statements
+      kinds = [s.split(' ', 1)[0] for s in sql]
+      self.assertEqual(kinds, sorted(kinds, key=['DELETE', 'UPDATE', 'INSERT'].index))
+
+   def testComicTable(self):
+      for seed in range(3):
+         previous, lines = getComicTables(seed)
+         self.assertSameDelta('mcp_comics', list(tsvRows(lines)), previous)
+
+   def testEmptyBuilds(self):
+      previous, lines = getComicTables(0, n=100)
+      self.assertSameDelta('mcp_comics', [], previous)
+      self.assertSameDelta('mcp_comics', list(tsvRows(lines)), [])
+
+   def testManyChunks(self):
+      previous, lines = getComicTables(1)
+      defaults = sortLines.func_defaults
+      sortLines.func_defaults = (50,)
+      try:
+         self.assertSameDelta('mcp_comics', list(tsvRows(lines)), previous)
+      finally:
+         sortLines.func_defaults = defaults
+
+if __name__ == '__main__':
+   unittest.main()
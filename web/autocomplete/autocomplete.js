@@ -98,6 +98,95 @@
     }
 
 
+    /**
+    * Attachs the autocomplete object to a form element, with autocomplete
+    * data that is split in shards by searchthemcp.py. A shard is fetched
+    * the first time a value starting with its prefix is typed.
+    *
+    * @param string   id        Id of form element to attach to
+    * @param object   manifest  The shards manifest (comicsAutoCompleteManifest.js)
+    * @param string   baseurl   Url of the directory with the shard files
+    * @param function matchfunc Function that takes a string and the data of
+    *                           a shard as input. Returns a list of matching
+    *                           strings that should be added to the autocomplete list
+    */
+    function AutoComplete_CreateSharded (id, formid, manifest, baseurl, matchfunc)
+    {
+        var data = {'id':id,
+                    'manifest':manifest,
+                    'baseurl':baseurl,
+                    'matchfunc':matchfunc,
+                    'shards':new Object()};
+
+        AutoComplete_Create(id, formid, data, AutoComplete_ShardedMatch, arguments[5]);
+    }
+
+
+    /**
+    * Matchfunc for sharded data. Returns undefined while the shard is loading.
+    *
+    * @param string query The value of the form element
+    * @param object data  The sharded data created by AutoComplete_CreateSharded
+    */
+    function AutoComplete_ShardedMatch(query, data)
+    {
+        var manifest = data['manifest'];
+        var n = manifest['prefix_length'];
+
+        query = query.toUpperCase();
+        if (query.length < n) {
+            return data['matchfunc'](query, manifest['short']);
+        }
+
+        var prefix = query.substring(0, n);
+        if (!manifest['shards'].hasOwnProperty(prefix)) {
+            return undefined;
+        }
+        if (!data['shards'].hasOwnProperty(prefix)) {
+            AutoComplete_LoadShard(data, prefix);
+            return undefined;
+        }
+        if (data['shards'][prefix] === null) {
+            // Still loading
+            return undefined;
+        }
+        return data['matchfunc'](query, data['shards'][prefix]);
+    }
+
+
+    /**
+    * Fetches a shard and shows the dropdown when it has been loaded
+    *
+    * @param object data   The sharded data created by AutoComplete_CreateSharded
+    * @param string prefix The prefix of the shard
+    */
+    function AutoComplete_LoadShard(data, prefix)
+    {
+        var request = window.XMLHttpRequest ? new XMLHttpRequest() : new ActiveXObject('Microsoft.XMLHTTP');
+
+        data['shards'][prefix] = null;
+        request.onreadystatechange = function()
+        {
+            if (request.readyState != 4) {
+                return;
+            }
+            if (request.status == 200) {
+                data['shards'][prefix] = window.JSON ? JSON.parse(request.responseText) : eval('(' + request.responseText + ')');
+            } else {
+                data['shards'][prefix] = new Object();
+            }
+
+            var id = data['id'];
+            var value = __AutoComplete[id]['element'].value.toUpperCase();
+            if (value.substring(0, prefix.length) == prefix) {
+                AutoComplete_ShowDropdown(id);
+            }
+        }
+        request.open('GET', data['baseurl'] + data['manifest']['shards'][prefix], true);
+        request.send(null);
+    }
+
+
     /**
     * Creates the dropdown layer
     * 
@@ -0,0 +1,172 @@
+/**
+* Decoder for the comic trie generated by mcpautocomplete.getAutoCompletionTrie.
+*
+* The trie is a string where each edge is written in pre-order as:
+*
+*     LABEL ['[' RANK] ('{' EDGES '}' | ']')
+*
+* ComicTrie_Match gives the same matches as matchfunc in searchthemcp.php
+* does with the auto completion dict, and can be used as matchfunc
+* argument to AutoComplete_Create:
+*
+*     AutoComplete_Create('comic', 'comicform', comicsTrie, ComicTrie_Match, 10);
+*
+* -------------
+* Written by Jimmy Petersson
+*/
+
+    /**
+    * Maps the position of each '{' to the position of the matching '}'.
+    * Built once, on the first lookup.
+    *
+    * @param string data The serialized trie
+    */
+    function ComicTrie_CloseIndex(data)
+    {
+        var close = new Array();
+        var stack = new Array();
+
+        for (var i=0; i<data.length; ++i) {
+            var ch = data.charAt(i);
+            if (ch == '{') {
+                stack.push(i);
+            } else if (ch == '}') {
+                close[stack.pop()] = i;
+            }
+        }
+        return close;
+    }
+
+
+    /**
+    * Returns the end of the label and the end of the edge starting at position p
+    *
+    * @param object trie The comic trie
+    * @param int    p    Start position of the edge
+    */
+    function ComicTrie_ReadEdge(trie, p)
+    {
+        var data = trie['data'];
+        var j = p;
+        var ch = data.charAt(j);
+
+        while (ch != '[' && ch != ']' && ch != '{') {
+            ch = data.charAt(++j);
+        }
+        var k = j;
+        if (ch == '[') {
+            do {
+                ch = data.charAt(++k);
+            } while (ch != '{' && ch != ']');
+        }
+        if (ch == '{') {
+            return [j, trie['close'][k] + 1];
+        }
+        return [j, k + 1];
+    }
+
+
+    /**
+    * Returns the list of comics starting with query, or undefined if
+    * there are no matches or more matches than the trie limit.
+    *
+    * @param string query The string to complete
+    * @param object trie  The comic trie: {'limit': int, 'data': string}
+    */
+    function ComicTrie_Match(query, trie)
+    {
+        query = query.toUpperCase();
+        if (query.length == 0) {
+            return undefined;
+        }
+        if (trie['close'] === undefined) {
+            trie['close'] = ComicTrie_CloseIndex(trie['data']);
+        }
+
+        var data  = trie['data'];
+        var pos   = 0;
+        var end   = data.length;
+        var qi    = 0;
+        var start = 0;
+        var edge  = null;
+
+        while (true) {
+            // Find the edge starting with the next query character
+            while (pos < end && data.charAt(pos) != query.charAt(qi)) {
+                pos = ComicTrie_ReadEdge(trie, pos)[1];
+            }
+            if (pos >= end) {
+                return undefined;
+            }
+            edge = ComicTrie_ReadEdge(trie, pos);
+            var label = data.substring(pos, edge[0]);
+            var rest  = query.substr(qi, label.length);
+            if (label.substr(0, rest.length) != rest) {
+                return undefined;
+            }
+            if (qi + rest.length == query.length) {
+                break;
+            }
+            qi += label.length;
+            if (data.charAt(edge[1] - 1) != '}') {
+                return undefined;
+            }
+            // Step into the children of the edge
+            pos = edge[0];
+            while (data.charAt(pos) != '{') {
+                pos++;
+            }
+            pos++;
+            end = edge[1] - 1;
+        }
+
+        // Collect all comics in the sub trie of the edge
+        var matches = new Array();
+        var stack   = [query.substring(0, qi)];
+        var current = '';
+        var i = pos;
+
+        while (i < edge[1]) {
+            var ch = data.charAt(i);
+            if (ch == '}') {
+                stack.pop();
+                i++;
+            } else if (ch == ']') {
+                i++;
+            } else if (ch == '{') {
+                stack.push(current);
+                i++;
+            } else {
+                var j = i;
+                while (ch != '[' && ch != ']' && ch != '{') {
+                    ch = data.charAt(++j);
+                }
+                current = stack[stack.length - 1] + data.substring(i, j);
+                i = j;
+                if (ch == '[') {
+                    j = ++i;
+                    do {
+                        ch = data.charAt(++j);
+                    } while (ch != '{' && ch != ']');
+                    matches.push([parseInt(data.substring(i, j), 36), current]);
+                    if (matches.length > trie['limit']) {
+                        // Too many alternatives
+                        return undefined;
+                    }
+                    i = j;
+                }
+            }
+        }
+
+        if (matches.length == 1 && matches[0][1] == query) {
+            // Exact matches are not included
+            return undefined;
+        }
+        matches.sort(function(a, b) {return a[0] - b[0];});
+
+        var comics = new Array();
+        for (i=0; i<matches.length; ++i) {
+            comics[comics.length] = matches[i][1];
+        }
+        return comics;
+    }
@@ -1,5 +1,9 @@
 <?php
 
+// The uploaded data/pages directory with the static comic pages of 'searchthemcp.py --pages',
+// "" to always read the comics from the database
+define("MCP_PAGES_DIR", "");
+
 function openConnection() {
    $host = "localhost";
    $login = "YOUR_MYSQL_USERNAME";
@@ -22,17 +26,45 @@ function errorManagement($db = "") {
 function searchForComic($comic) {
    $db = openConnection();
    $comic = $db->real_escape_string($comic);
-   $sql = "SELECT * FROM mcp_comics WHERE abbreviation='{$comic}' ORDER BY appendix,figid,entry_index";
+   $sql = "SELECT * FROM mcp_comics_page WHERE abbreviation='{$comic}' ORDER BY comicid";
    $result = $db->query($sql) or errorManagement($db);
-   publishComic($result, $db);
+   publishComic($result);
    $result->close();
    $db->close();
 }
 
+/* The distinct lower case trigrams of $s, see figureTrigrams in mcpdb.py.
+   Empty if the trigram index can not be used for the search: shorter than three characters,
+   LIKE wildcards or escapes, or non-ASCII characters. */
+function figureSearchTrigrams($s) {
+   if (strlen($s) < 3 || preg_match('/[%_\\\\\x80-\xff]/', $s))
+      return array();
+   $s = strtolower($s);
+   $trigrams = array();
+   for ($i = 0; $i + 3 <= strlen($s); $i++)
+      $trigrams[substr($s, $i, 3)] = true;
+   return array_keys($trigrams);
+}
+
 function searchForFigures($searchString) {
    $db = openConnection();
+   $trigrams = figureSearchTrigrams($searchString);
    $searchString = $db->real_escape_string($searchString);
-   $sql = "SELECT name,link,dimension FROM mcp_figures WHERE search_name LIKE '%{$searchString}%' OR name LIKE '%{$searchString}%'";
+   $where = "search_name LIKE '%{$searchString}%' OR name LIKE '%{$searchString}%'";
+   if ($trigrams) {
+      // Only the figures with all trigrams of the search string can match, the LIKE is then checked on them
+      // The join can change the row order, keep the figid order of a scan of mcp_figures
+      foreach ($trigrams as $i => $trigram)
+         $trigrams[$i] = $db->real_escape_string($trigram);
+      $trigrams_in = "'" . implode("','", $trigrams) . "'";
+      $ntrigrams = count($trigrams);
+      $sql = "SELECT name,link,dimension FROM mcp_figures JOIN (SELECT figid AS trigram_figid FROM mcp_figures_trigram " .
+             "WHERE trigram IN ({$trigrams_in}) GROUP BY figid HAVING COUNT(DISTINCT trigram)={$ntrigrams}) matches " .
+             "ON figid=trigram_figid WHERE {$where} ORDER BY figid";
+   }
+   else {
+      $sql = "SELECT name,link,dimension FROM mcp_figures WHERE {$where}";
+   }
    $result = $db->query($sql) or errorManagement($db);
    echo "<p>Results for '{$searchString}':</p>";
    while($figureobj = $result->fetch_object()) {
@@ -63,12 +95,29 @@ function getFigure($index) {
    $db->close();
 }
 
+/* Output the static page $id of $kind ("comics") created with 'searchthemcp.py --pages'.
+   Return false if the static pages are not used or the page does not exist. */
+function readStaticPage($kind, $id) {
+   if (MCP_PAGES_DIR == "" || !ctype_digit((string) $id)) {
+      return false;
+   }
+   $path = sprintf("%s/%s/%d/%d.html.gz", MCP_PAGES_DIR, $kind, intval($id / 1000), $id);
+   if (!is_file($path)) {
+      return false;
+   }
+   readgzfile($path);
+   return true;
+}
+
 function getComic($index) {
+   if (readStaticPage("comics", $index)) {
+      return;
+   }
    $db = openConnection();
    $index = $db->real_escape_string($index);
-   $sql = "SELECT * FROM mcp_comics WHERE comicid='{$index}' ORDER BY appendix,figid,entry_index";
+   $sql = "SELECT * FROM mcp_comics_page WHERE comicid='{$index}'";
    $result = $db->query($sql) or errorManagement($db);
-   publishComic($result, $db);
+   publishComic($result);
    $result->close();
    $db->close();
 }
@@ -87,22 +136,42 @@ function addLinksToRaw($comicobj, $rawstr, $comics, $linkCurrent) {
    return $linkstr;
 }
 
-function publishComic($comic, $db) {
+/* Reverse tsvEscape in mcpdb.py */
+function tsvUnescape($s) {
+   return strtr($s, array("\\\\" => "\\", "\\t" => "\t", "\\n" => "\n", "\\r" => "\r", "\\0" => "\0"));
+}
+
+/* The appearances of the comic page rows in $pages as objects with the columns of mcp_comics and
+   the name, link and dimension of the figure, see COMIC_PAGE_FIELDS in mcpdb.py. */
+function getPageAppearances($pages) {
+   $fields = array('appendix', 'figid', 'entry_index', 'current_raw', 'current_comics', 'next_raw', 'next_comics',
+                   'previous_raw', 'previous_comics', 'name', 'link', 'dimension');
+   $appearances = array();
+   while($page = $pages->fetch_object()) {
+      if ($page->appearances == "") {
+         continue;
+      }
+      foreach (explode("\n", $page->appearances) as $line) {
+         $comicobj = (object) array_combine($fields, array_map("tsvUnescape", explode("\t", $line)));
+         $comicobj->comicid = $page->comicid;
+         $comicobj->abbreviation = $page->abbreviation;
+         $comicobj->full_name = $page->full_name;
+         $appearances[] = $comicobj;
+      }
+   }
+   return $appearances;
+}
+
+function publishComic($pages) {
 
    $comicFound = false;
    $current_appendix = -1;
    $color = false;
-   while($comicobj = $comic->fetch_object()) {
+   foreach (getPageAppearances($pages) as $comicobj) {
       if (!$comicFound) {
          $comicFound = true;
          echo "<table class=\"comictable\" cellspacing=0 cellpadding=4><tr><th></th><th>Previous</th><th colspan=2>Current</th><th>Next</th></tr>";
-         $comicid = $db->real_escape_string($comicobj->comicid);
-         $sql = "SELECT full_name FROM mcp_comics_fullname WHERE comicid='{$comicid}'";
-         $result = $db->query($sql) or errorManagement($db);
-         if($fullname = $result->fetch_object()) {
-            echo "<b>{$fullname->full_name}</b>";
-         }
-         $result->close();
+         echo "<b>{$comicobj->full_name}</b>";
       }
       if( $comicobj->appendix != $current_appendix ) {
          if ($current_appendix != -1) {
@@ -119,18 +188,12 @@ function publishComic($comic, $db) {
       else {
         echo "<tr id=\"{$current_appendix}{$comicobj->figid}\" class=\"figrow\">";
       }
-      $figid = $db->real_escape_string($comicobj->figid);
-      $sql = "SELECT name,link,dimension FROM mcp_figures WHERE figid='{$figid}'";
-      $figresult = $db->query($sql) or errorManagement($db);
-      if($figureobj = $figresult->fetch_object()) {
-         if($figureobj->dimension != "standard") {
-            echo "<td><a href=\"{$figureobj->link}\">{$figureobj->name} ({$figureobj->dimension})</a></td>";
-         }
-         else {
-            echo "<td><a href=\"{$figureobj->link}\">{$figureobj->name}</a></td>";
-         }
+      if($comicobj->dimension != "standard") {
+         echo "<td><a href=\"{$comicobj->link}\">{$comicobj->name} ({$comicobj->dimension})</a></td>";
+      }
+      else {
+         echo "<td><a href=\"{$comicobj->link}\">{$comicobj->name}</a></td>";
       }
-      $figresult->close();
 
       $prev_str = addLinksToRaw($comicobj, $comicobj->previous_raw, split("#", $comicobj->previous_comics), true);
       echo "<td>{$prev_str}</td>";
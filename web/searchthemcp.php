@@ -5,6 +5,12 @@
   <link rel="StyleSheet" href="mcp.css" type="text/css">
   <script language="javascript" type="text/javascript" src="autocomplete/autocomplete.js"></script>
   <script language="javascript" type="text/javascript" src="autocomplete/comicsAutoComplete.js"></script>
+<!-- With the trie format (searchthemcp.py --autocompleteformat trie), replace comicsAutoComplete.js with:
+  <script language="javascript" type="text/javascript" src="autocomplete/comictrie.js"></script>
+  <script language="javascript" type="text/javascript" src="autocomplete/comicsAutoCompleteTrie.js"></script>
+     With the shards format (searchthemcp.py --autocompleteformat shards), replace comicsAutoComplete.js with:
+  <script language="javascript" type="text/javascript" src="autocomplete/comicsAutoCompleteManifest.js"></script>
+-->
 
 <head><title>Marvel Chronology Project - Search</title></head>
 
@@ -90,6 +96,10 @@ Go to comic:
 
 //    remove the double-slash from the next line to reactivate autocomplete functionality
     AutoComplete_Create('comic', 'comicform', comics, matchfunc, 10);
+//    with the trie format, use this line instead:
+//    AutoComplete_Create('comic', 'comicform', comicsTrie, ComicTrie_Match, 10);
+//    with the shards format, use this line instead:
+//    AutoComplete_CreateSharded('comic', 'comicform', comicsManifest, 'autocomplete/comicsAutoComplete/', matchfunc, 10);
 // -->
 </script>
 